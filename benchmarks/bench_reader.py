@@ -0,0 +1,49 @@
+"""Reader benchmarks: parsing synthetic STAR files into vectors layer data."""
+from napari_starfile._reader import read_stars
+
+from .synthetic import ROW_COUNTS, synthetic_star
+
+
+class ReadStars:
+    params = (ROW_COUNTS, [0, 20], [None, 100_000])
+    param_names = ["n_rows", "n_extra_columns", "chunksize"]
+    timeout = 600
+
+    def setup(self, n_rows, n_extra_columns, chunksize):
+        self.path = synthetic_star(n_rows, n_extra_columns)
+
+    def time_read_stars(self, n_rows, n_extra_columns, chunksize):
+        read_stars(self.path, chunksize=chunksize)
+
+    def peakmem_read_stars(self, n_rows, n_extra_columns, chunksize):
+        read_stars(self.path, chunksize=chunksize)
+
+
+class ReadStarsCardinality:
+    """Effect of many optics groups and micrographs, which affect the optics join and string columns."""
+    params = ([1, 50], [10, 10_000])
+    param_names = ["n_optics_groups", "n_micrographs"]
+    timeout = 600
+
+    def setup(self, n_optics_groups, n_micrographs):
+        self.path = synthetic_star(10**5, 0, n_optics_groups, n_micrographs)
+
+    def time_read_stars(self, n_optics_groups, n_micrographs):
+        read_stars(self.path)
+
+    def time_read_stars_compact(self, n_optics_groups, n_micrographs):
+        read_stars(self.path, compact=True)
+
+
+class ReadManyStars:
+    """Scaling of reading many files with the number of workers, on threads and on processes.
+    Threads only scale as far as parsing releases the GIL."""
+    params = ([1, 2, 4, 8], [False, True])
+    param_names = ["workers", "processes"]
+    timeout = 600
+
+    def setup(self, workers, processes):
+        self.paths = [synthetic_star(10**5)] * 16
+
+    def time_read_stars(self, workers, processes):
+        read_stars(self.paths, workers=workers, processes=processes)
@@ -0,0 +1,88 @@
+"""Benchmarks of the coordinate and orientation conversions in ``napari_starfile.utils``."""
+import numpy as np
+
+from napari_starfile import utils
+
+from .synthetic import ROW_COUNTS, make_optics, make_particles
+
+
+class Conversions:
+    params = [ROW_COUNTS]
+    param_names = ["n_rows"]
+    timeout = 600
+
+    def setup(self, n_rows):
+        self.particles = make_particles(n_rows, n_optics_groups=4)
+        self.optics = make_optics(4)
+        self.angles = self.particles[["rlnAngleRot", "rlnAngleTilt", "rlnAnglePsi"]].to_numpy()
+        self.vecs = utils.particles2vecs(self.particles, self.optics)
+
+    def time_particles2vecs(self, n_rows):
+        utils.particles2vecs(self.particles, self.optics)
+
+    def peakmem_particles2vecs(self, n_rows):
+        utils.particles2vecs(self.particles, self.optics)
+
+    def time_euler2vec(self, n_rows):
+        utils.euler2vec(self.angles)
+
+    def peakmem_euler2vec(self, n_rows):
+        utils.euler2vec(self.angles)
+
+    def time_vec2euler(self, n_rows):
+        utils.vec2euler(self.vecs)
+
+    def peakmem_vec2euler(self, n_rows):
+        utils.vec2euler(self.vecs)
+
+    def time_euler2matrix(self, n_rows):
+        utils.euler2matrix(self.angles, homogenous=False)
+
+    def peakmem_euler2matrix(self, n_rows):
+        utils.euler2matrix(self.angles, homogenous=False)
+
+    def time_vecs2particles(self, n_rows):
+        utils.vecs2particles(self.vecs)
+
+
+class Vec2EulerLoop:
+    """The per-vector conversion that ``utils.vec2euler`` replaced, to compare with ``Conversions.time_vec2euler``."""
+    params = [[n for n in ROW_COUNTS if n <= 10**4]]
+    param_names = ["n_rows"]
+
+    def setup(self, n_rows):
+        self.vecs = utils.particles2vecs(make_particles(n_rows), None)[:, 1]
+
+    def time_vec2euler_loop(self, n_rows):
+        from scipy.spatial.transform import Rotation
+
+        for vec in self.vecs:
+            rot, _ = Rotation.align_vectors(vec[::-1], [[0, 0, 1]])
+            rot.inv().as_euler("ZYZ", degrees=True)
+
+
+class Spatial:
+    params = [[n for n in ROW_COUNTS if n <= 10**6]]
+    param_names = ["n_rows"]
+    timeout = 600
+
+    def setup(self, n_rows):
+        particles = make_particles(n_rows)
+        self.vecs = utils.particles2vecs(particles, None)
+        self.scores = particles["rlnLogLikeliContribution"].to_numpy()
+        self.tree = utils.build_kdtree(self.vecs)
+
+    def time_build_kdtree(self, n_rows):
+        utils.build_kdtree(self.vecs)
+
+    def time_remove_duplicates(self, n_rows):
+        utils.remove_duplicates(self.vecs, self.scores, 10.0, tree=self.tree)
+
+    def time_spatial_grid_sample(self, n_rows):
+        utils.SpatialGrid(self.vecs[:, 0]).sample(100_000)
+
+
+class Baseline:
+    def peakmem_baseline(self):
+        """Peak memory of the interpreter with numpy, pandas and the plugin imported, for reference."""
+        np.empty(0)
@@ -0,0 +1,120 @@
+"""Widget benchmarks: filter masks of the subset selector, incremental range-filter updates
+and splitting a layer by a column.
+
+The widgets are created without a window; a ``ViewerModel`` stands in for the viewer so that
+adding layers is measured without rendering.
+"""
+import os
+
+import numpy as np
+
+from .synthetic import ROW_COUNTS, make_particles
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+def _qapp():
+    from qtpy.QtWidgets import QApplication
+
+    return QApplication.instance() or QApplication([])
+
+
+class FilterMask:
+    params = (ROW_COUNTS, ["rlnLogLikeliContribution", "rlnMicrographName"])
+    param_names = ["n_rows", "column"]
+    timeout = 600
+
+    def setup(self, n_rows, column):
+        from napari.layers import Points
+
+        from napari_starfile._widget import FilterWidget
+
+        _qapp()
+        particles = make_particles(n_rows)
+        coords = particles[[f"rlnCoordinate{zyx}" for zyx in "ZYX"]].to_numpy()
+        self.widget = FilterWidget(parent=None)
+        self.widget.points_layer = Points(coords, properties=particles)
+        self.widget.cb_filter_property.value = column
+        if self.widget._mode == "range":
+            self.low, self.high = self.widget.rs_float_filter.value
+        else:
+            self.choices = self.widget.cb_discrete_filter.choices
+
+    def time_get_mask(self, n_rows, column):
+        """Mask after the filter value changed, as seen by the subset selector."""
+        if self.widget._mode == "range":
+            self.widget.rs_float_filter.value = (self.low, self.high - 1.0)
+            self.widget.update_mask()
+            self.widget.rs_float_filter.value = (self.low, self.high)
+            self.widget.update_mask()
+        else:
+            self.widget.cb_discrete_filter.value = self.choices[: len(self.choices) // 2]
+            self.widget.update_mask()
+        self.widget.get_mask()
+
+    def peakmem_get_mask(self, n_rows, column):
+        self.widget._mask = None
+        self.widget.get_mask()
+
+
+class RangeFilterUpdate:
+    """Latency of a slider tick on one of four range filters: recomputing every mask
+    compared with the incremental ``SortedIndex`` update of the subset selector."""
+    params = (ROW_COUNTS,)
+    param_names = ["n_rows"]
+    n_filters = 4
+
+    def setup(self, n_rows):
+        from napari_starfile._widget import SortedIndex
+
+        rng = np.random.default_rng(0)
+        self.columns = [rng.normal(size=n_rows) for _ in range(self.n_filters)]
+        self.indices = [SortedIndex(values) for values in self.columns]
+        self.excluded_count = np.zeros(n_rows, dtype=np.int32)
+        for index in self.indices:
+            index.select(-2.0, 2.0)
+            self.excluded_count += ~index.mask
+        self.high = 2.0
+
+    def time_full_update(self, n_rows):
+        self.high = 3.8 - self.high
+        mask = np.ones(len(self.columns[0]), dtype=bool)
+        for i, values in enumerate(self.columns):
+            mask &= (values >= -2.0) & (values <= (self.high if i == 0 else 2.0))
+
+    def time_incremental_update(self, n_rows):
+        # Alternates between two nearby upper bounds, like a slider moved back and forth
+        self.high = 3.8 - self.high
+        changed = self.indices[0].select(-2.0, self.high)
+        self.excluded_count[changed] += np.where(self.indices[0].mask[changed], -1, 1).astype(np.int32)
+
+
+class Split:
+    # Adding a layer costs tens of milliseconds on its own, so the number of groups is kept small
+    params = ([n for n in ROW_COUNTS if n <= 10**6], [10, 100])
+    param_names = ["n_rows", "n_micrographs"]
+    timeout = 600
+
+    def setup(self, n_rows, n_micrographs):
+        from napari.components import ViewerModel
+
+        from napari_starfile import utils
+        from napari_starfile._widget import SplitWidget
+
+        _qapp()
+        self.viewer = ViewerModel()
+        self.widget = SplitWidget(self.viewer)
+        self.features = make_particles(n_rows, n_micrographs=n_micrographs)
+        self.vecs = utils.particles2vecs(self.features, None)
+
+    def time_split(self, n_rows, n_micrographs):
+        for batch in self.widget._split(self.vecs, self.features, "rlnMicrographName", None):
+            self.widget._add_layers(batch)
+
+    def teardown(self, n_rows, n_micrographs):
+        self.viewer.layers.clear()
+
+    def peakmem_split(self, n_rows, n_micrographs):
+        for batch in self.widget._split(self.vecs, self.features, "rlnMicrographName", None):
+            self.widget._add_layers(batch)
+
@@ -0,0 +1,62 @@
+"""Writer benchmarks: saving vectors layers as Relion 3.0 and 3.1 STAR files, and the streaming
+STAR writer compared with ``starfile.write``."""
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import starfile
+
+from napari_starfile import utils
+from napari_starfile._star_writer import write_star
+from napari_starfile._writer import write_star_relion3, write_star_relion31
+
+from .synthetic import ROW_COUNTS, make_optics, make_particles
+
+
+class WriteStar:
+    params = (ROW_COUNTS, [1, 8])
+    param_names = ["n_rows", "n_layers"]
+    timeout = 600
+
+    def setup(self, n_rows, n_layers):
+        self.tmp = tempfile.TemporaryDirectory()
+        optics = make_optics(4)
+        self.layers = []
+        for i in range(n_layers):
+            particles = make_particles(n_rows // n_layers, n_optics_groups=4, seed=i)
+            layer_meta = {"name": f"layer {i}", "features": particles, "metadata": {"optics": optics}}
+            self.layers.append((utils.particles2vecs(particles, optics), layer_meta, "vectors"))
+
+    def teardown(self, n_rows, n_layers):
+        self.tmp.cleanup()
+
+    def time_write_star_relion3(self, n_rows, n_layers):
+        write_star_relion3(str(Path(self.tmp.name) / "relion3.star"), self.layers)
+
+    def peakmem_write_star_relion3(self, n_rows, n_layers):
+        write_star_relion3(str(Path(self.tmp.name) / "relion3.star"), self.layers)
+
+    def time_write_star_relion31(self, n_rows, n_layers):
+        write_star_relion31(str(Path(self.tmp.name) / "relion31.star"), self.layers)
+
+    def peakmem_write_star_relion31(self, n_rows, n_layers):
+        write_star_relion31(str(Path(self.tmp.name) / "relion31.star"), self.layers)
+
+
+class StreamingWriter:
+    params = (ROW_COUNTS,)
+    param_names = ["n_rows"]
+    timeout = 600
+
+    def setup(self, n_rows):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.tables = [make_particles(n_rows // 4, seed=i) for i in range(4)]
+
+    def teardown(self, n_rows):
+        self.tmp.cleanup()
+
+    def time_write_star(self, n_rows):
+        write_star(Path(self.tmp.name) / "streaming.star", {"": self.tables})
+
+    def time_starfile_write(self, n_rows):
+        starfile.write(pd.concat(self.tables, ignore_index=True, join="inner"), Path(self.tmp.name) / "starfile.star")
@@ -0,0 +1,88 @@
+"""Synthetic Relion particle tables and STAR files for the benchmarks.
+
+Files are generated once per parameter combination into ``NAPARI_STARFILE_BENCHMARK_DIR``
+(defaults to a directory in the system temp dir) and reused by later runs, so timings of
+different commits read exactly the same input.
+"""
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from napari_starfile._star_writer import write_star
+
+# Row counts are capped at 1e6 by default because a 1e7-row file takes several GB of disk and memory.
+# Set NAPARI_STARFILE_BENCHMARK_MAX_ROWS=10000000 to include it.
+MAX_ROWS = int(os.environ.get("NAPARI_STARFILE_BENCHMARK_MAX_ROWS", 10**6))
+ROW_COUNTS = [n for n in [10**3, 10**4, 10**5, 10**6, 10**7] if n <= MAX_ROWS]
+
+
+def data_dir() -> Path:
+    directory = os.environ.get("NAPARI_STARFILE_BENCHMARK_DIR")
+    if directory is None:
+        directory = Path(tempfile.gettempdir()) / "napari-starfile-benchmarks"
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def make_optics(n_groups: int = 1) -> pd.DataFrame:
+    groups = np.arange(1, n_groups + 1)
+    return pd.DataFrame(
+        {
+            "rlnOpticsGroup": groups,
+            "rlnOpticsGroupName": [f"opticsGroup{i}" for i in groups],
+            "rlnSphericalAberration": np.full(n_groups, 2.7),
+            "rlnVoltage": np.full(n_groups, 300.0),
+            "rlnImagePixelSize": np.linspace(1.0, 2.0, n_groups),
+            "rlnImageSize": np.full(n_groups, 64),
+            "rlnImageDimensionality": np.full(n_groups, 3),
+        }
+    )
+
+
+def make_particles(
+    n_rows: int,
+    n_extra_columns: int = 0,
+    n_optics_groups: int = 1,
+    n_micrographs: int = 200,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Returns a Relion 3.1 particles table with ``n_rows`` particles spread over ``n_micrographs``
+    tomograms and ``n_optics_groups`` optics groups, plus ``n_extra_columns`` random float columns."""
+    rng = np.random.default_rng(seed)
+    micrograph_names = np.array([f"tomogram_{i:05d}.tomostar" for i in range(n_micrographs)], dtype=object)
+    columns = {
+        "rlnCoordinateX": rng.uniform(0, 4000, n_rows),
+        "rlnCoordinateY": rng.uniform(0, 4000, n_rows),
+        "rlnCoordinateZ": rng.uniform(0, 1000, n_rows),
+        "rlnAngleRot": rng.uniform(-180, 180, n_rows),
+        "rlnAngleTilt": rng.uniform(0, 180, n_rows),
+        "rlnAnglePsi": rng.uniform(-180, 180, n_rows),
+        "rlnMicrographName": pd.array(micrograph_names[rng.integers(0, n_micrographs, n_rows)], dtype="str"),
+        "rlnOpticsGroup": rng.integers(1, n_optics_groups + 1, n_rows),
+        "rlnClassNumber": rng.integers(1, 10, n_rows),
+        "rlnLogLikeliContribution": rng.normal(size=n_rows),
+    }
+    for i in range(n_extra_columns):
+        columns[f"rlnExtraColumn{i}"] = rng.normal(size=n_rows)
+    return pd.DataFrame(columns)
+
+
+def synthetic_star(
+    n_rows: int,
+    n_extra_columns: int = 0,
+    n_optics_groups: int = 1,
+    n_micrographs: int = 200,
+) -> Path:
+    """Returns the path to a Relion 3.1 STAR file with the given shape, writing it on first use."""
+    path = data_dir() / f"particles_{n_rows}_{n_extra_columns}_{n_optics_groups}_{n_micrographs}.star"
+    if not path.exists():
+        particles = make_particles(n_rows, n_extra_columns, n_optics_groups, n_micrographs)
+        # Write to a temporary name first so an interrupted run does not leave a truncated file behind
+        tmp = path.with_suffix(".tmp")
+        write_star(tmp, {"optics": make_optics(n_optics_groups), "particles": particles})
+        tmp.rename(path)
+    return path
@@ -1,24 +1,75 @@
+import importlib
+
 try:
     from ._version import version as __version__
 except ImportError:
     __version__ = "unknown"
 
 
+from typing import TYPE_CHECKING
+
+from ._profiling import StageRecord, disable_profiling, enable_profiling
 from ._reader import napari_get_reader
 from ._sample_data import make_sample_data
-from ._widget import SubsetSelectorWidget, SplitWidget
-from ._writer import (
-    write_star_relion3,
-    write_star_relion5,
-    write_star_relion31,
-)
+
+if TYPE_CHECKING:
+    from ._batch import batch_process
+    from ._cache import cache_stats, clear_cache, disable_cache, enable_cache
+    from ._widget import LevelOfDetailWidget, SpatialWidget, SplitWidget, SubsetSelectorWidget, SymmetryWidget, WatchWidget
+    from ._writer import write_star_relion3, write_star_relion5, write_star_relion31, write_starz
 
 __all__ = (
     "napari_get_reader",
     "make_sample_data",
     "SubsetSelectorWidget",
     "SplitWidget",
+    "SpatialWidget",
+    "LevelOfDetailWidget",
+    "WatchWidget",
+    "SymmetryWidget",
     "write_star_relion3",
     "write_star_relion31",
     "write_star_relion5",
+    "write_starz",
+    "enable_cache",
+    "disable_cache",
+    "clear_cache",
+    "cache_stats",
+    "enable_profiling",
+    "disable_profiling",
+    "StageRecord",
+    "batch_process",
 )
+
+# Discovering the plugin and checking files with napari_get_reader only needs the standard library.
+# Everything built on numpy, pandas, scipy or magicgui is imported on first access
+_LAZY_ATTRIBUTES = {
+    "batch_process": "_batch",
+    "cache_stats": "_cache",
+    "clear_cache": "_cache",
+    "disable_cache": "_cache",
+    "enable_cache": "_cache",
+    "LevelOfDetailWidget": "_widget",
+    "SpatialWidget": "_widget",
+    "SplitWidget": "_widget",
+    "SubsetSelectorWidget": "_widget",
+    "SymmetryWidget": "_widget",
+    "WatchWidget": "_widget",
+    "write_star_relion3": "_writer",
+    "write_star_relion31": "_writer",
+    "write_star_relion5": "_writer",
+    "write_starz": "_writer",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRIBUTES:
+        module = importlib.import_module(f".{_LAZY_ATTRIBUTES[name]}", __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,5 @@
+import sys
+
+from napari_starfile._cli import main
+
+sys.exit(main())
@@ -0,0 +1,241 @@
+"""Headless batch processing of many STAR files, without napari or Qt.
+
+:func:`batch_process` runs the same steps as the widgets and writers of the plugin on every file:
+it reads the particles with :func:`napari_starfile._reader.read_star`, keeps the rows that pass the
+filters (inclusive value ranges like the float filter of the subset selector, or value lists like
+its discrete filter), optionally splits them by a column with :func:`napari_starfile.utils.split_layer`,
+and saves every resulting layer with one of the STAR writers. Files are processed on a pool of
+worker processes and each one is written to disk as soon as it is done, so only the files in flight
+are held in memory. The console entry point is :mod:`napari_starfile._cli`.
+"""
+import os
+import re
+import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from napari_starfile import utils
+from napari_starfile._reader import read_star, read_tomograms
+from napari_starfile._writer import write_star_relion3, write_star_relion5, write_star_relion31, write_starz
+
+WRITERS = {
+    "relion3": write_star_relion3,
+    "relion31": write_star_relion31,
+    "relion5": write_star_relion5,
+    "starz": write_starz,
+}
+
+
+@dataclass
+class FileResult:
+    """Outcome of processing one input file. ``error`` is set instead of ``outputs`` if it failed."""
+    path: Path
+    outputs: list[str] = field(default_factory=list)
+    particles: int = 0
+    seconds: float = 0.0
+    error: str | None = None
+
+
+@dataclass
+class BatchSummary:
+    """Results of :func:`batch_process`, in input order, and the total wall time."""
+    results: list[FileResult]
+    seconds: float
+
+    @property
+    def files(self) -> int:
+        return len(self.results)
+
+    @property
+    def failed(self) -> list[FileResult]:
+        return [result for result in self.results if result.error is not None]
+
+    @property
+    def particles(self) -> int:
+        return sum(result.particles for result in self.results)
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.seconds if self.seconds > 0 else float("inf")
+
+    @property
+    def particles_per_second(self) -> float:
+        return self.particles / self.seconds if self.seconds > 0 else float("inf")
+
+    def __str__(self) -> str:
+        return (
+            f"Processed {self.files} files ({len(self.failed)} failed) with {self.particles} particles "
+            f"in {self.seconds:.2f} s: {self.files_per_second:.1f} files/s, {self.particles_per_second:.0f} particles/s"
+        )
+
+
+def find_star_files(paths: Iterable[str | Path]) -> list[tuple[Path, Path]]:
+    """Expands directories into the star and starz files below them. Returns ``(path, output stem)`` pairs, where the
+    output stem is the file name without suffix, prefixed by its location relative to a given directory."""
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            stars = sorted([*path.rglob("*.star"), *path.rglob("*.starz")])
+            files.extend((star, star.relative_to(path).with_suffix("")) for star in stars)
+        else:
+            files.append((path, Path(path.stem)))
+    return files
+
+
+def check_output_collisions(files: list[tuple[Path, Path]]):
+    """Raises a ValueError if several input files would be written to the same output, e.g.
+    ``a/run_data.star`` and ``b/run_data.star`` given as files instead of as a directory."""
+    inputs: dict[Path, list[Path]] = {}
+    for path, stem in files:
+        inputs.setdefault(stem, []).append(path)
+    collisions = [paths for paths in inputs.values() if len(paths) > 1]
+    if collisions:
+        listed = "; ".join(", ".join(map(str, paths)) for paths in collisions)
+        raise ValueError(f"Input files would overwrite each other's output: {listed}")
+
+
+def column_values(features: pd.DataFrame, metadata: dict, column: str) -> np.ndarray | pd.Series:
+    """Returns a feature column, loading it from the out-of-core store if the reader left it on disk."""
+    if column in features.columns:
+        return features[column]
+    store = metadata.get(utils.LAZY_COLUMNS_METADATA_KEY)
+    if store is None or column not in store.columns:
+        raise KeyError(f"No column {column}")
+    return store.column(column)
+
+
+def filter_mask(
+    features: pd.DataFrame,
+    metadata: dict,
+    ranges: dict[str, tuple[float, float]] | None = None,
+    values: dict[str, list] | None = None,
+) -> np.ndarray:
+    """Returns which rows have ``low <= value <= high`` for every column in ``ranges``
+    and one of the listed values for every column in ``values``."""
+    mask = np.ones(len(features), dtype=bool)
+    for column, (low, high) in (ranges or {}).items():
+        column_data = np.asarray(column_values(features, metadata, column))
+        mask &= (column_data >= low) & (column_data <= high)
+    for column, selected in (values or {}).items():
+        column_data = pd.Series(column_values(features, metadata, column))
+        if column_data.dtype.kind in "biuf":
+            # Values given as text on the command line
+            selected = pd.to_numeric(pd.Series(selected, dtype=object)).to_numpy()
+        mask &= column_data.isin(selected).to_numpy()
+    return mask
+
+
+def _file_name(value) -> str:
+    return re.sub(r"[^\w.-]+", "_", str(value))
+
+
+def process_file(
+    path: Path,
+    output: Path,
+    output_format: str = "relion31",
+    split_by: str | None = None,
+    ranges: dict[str, tuple[float, float]] | None = None,
+    values: dict[str, list] | None = None,
+    chunksize: int | None = 100_000,
+    lazy: bool = False,
+    tomograms: pd.DataFrame | None = None,
+) -> FileResult:
+    """Filters, splits and writes the particles of one star file to ``output`` (without the file extension).
+    Split groups are written to ``<output>_<value>``."""
+    start = time.perf_counter()
+    try:
+        vecs, extra_kwargs, layer_type = read_star(path, chunksize=chunksize, lazy=lazy, tomograms=tomograms)
+        features = extra_kwargs["features"]
+        metadata = extra_kwargs.get("metadata", {})
+        if utils.LAZY_COLUMNS_METADATA_KEY in metadata:
+            metadata[utils.LAZY_COLUMNS_METADATA_KEY].delete_when_unused()
+        if ranges or values:
+            rows = np.flatnonzero(filter_mask(features, metadata, ranges, values))
+            vecs = vecs[rows]
+            features = features.take(rows)
+            metadata = utils.slice_metadata(metadata, rows)
+        if split_by is None:
+            layers = [(vecs, {**extra_kwargs, "features": features, "metadata": metadata}, layer_type)]
+            names = [output]
+        else:
+            if split_by not in features.columns:
+                features = features.assign(**{split_by: column_values(features, metadata, split_by)})
+            layers = []
+            names = []
+            for group_vecs, group_kwargs, group_type in utils.split_layer(vecs, features, split_by, metadata):
+                names.append(output.with_name(f"{output.name}_{_file_name(group_kwargs['name'])}"))
+                # Particles without rlnMicrographName get the layer name, use the one of the whole file
+                group_kwargs["name"] = extra_kwargs["name"]
+                group_kwargs.setdefault("metadata", {})
+                layers.append((group_vecs, group_kwargs, group_type))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        writer = WRITERS[output_format]
+        outputs = []
+        for name, layer in zip(names, layers, strict=True):
+            # The writers add their file extension
+            outputs.extend(writer(str(name), [layer], keep_micrograph_names=True))
+        return FileResult(path, outputs, sum(len(layer[0]) for layer in layers), time.perf_counter() - start)
+    except Exception as err:  # noqa: BLE001
+        return FileResult(path, seconds=time.perf_counter() - start, error=f"{type(err).__name__}: {err}")
+
+
+def batch_process(
+    paths: Iterable[str | Path],
+    output_dir: str | Path,
+    output_format: str = "relion31",
+    split_by: str | None = None,
+    ranges: dict[str, tuple[float, float]] | None = None,
+    values: dict[str, list] | None = None,
+    workers: int | None = None,
+    chunksize: int | None = 100_000,
+    lazy: bool = False,
+    tomograms: str | Path | pd.DataFrame | None = None,
+    progress: Callable[[FileResult], None] | None = None,
+) -> BatchSummary:
+    """Filters, splits and converts star files into ``output_format`` (``relion3``, ``relion31``, ``relion5`` or ``starz``)
+    in ``output_dir``, on ``workers`` processes (default one per CPU core).
+    Directories in ``paths`` are searched for star files, and their layout is kept in ``output_dir``.
+    Input files that would be written to the same output raise a ValueError before anything is processed.
+    The particles keep their rlnMicrographName. Relion 5 centered coordinates are computed with the tomogram
+    sizes of ``tomograms`` (a tomograms.star or its global table), or of the tomograms.star found next to each
+    file like in :func:`napari_starfile._reader.read_stars`.
+
+    Filters are given as ``{column: (low, high)}`` in ``ranges`` and ``{column: [value, ...]}`` in ``values``.
+    With ``split_by``, each file is written as one file per value of that column. The particle count of
+    a file is the number of rows written. ``progress`` is called with every result as soon as the file is
+    done. Files that fail are reported in the results instead of stopping the batch."""
+    if output_format not in WRITERS:
+        raise ValueError(f"Unknown format {output_format}, expected one of {', '.join(WRITERS)}")
+    files = find_star_files(paths)
+    check_output_collisions(files)
+    if isinstance(tomograms, (str, Path)):
+        tomograms = read_tomograms(tomograms)
+    output_dir = Path(output_dir)
+    process = partial(
+        process_file, output_format=output_format, split_by=split_by, ranges=ranges, values=values, chunksize=chunksize,
+        lazy=lazy, tomograms=tomograms,
+    )
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(files)))
+    start = time.perf_counter()
+    results: list[FileResult | None] = [None] * len(files)
+    if workers == 1:
+        for i, (path, stem) in enumerate(files):
+            results[i] = process(path, output_dir / stem)
+            if progress is not None:
+                progress(results[i])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(process, path, output_dir / stem): i for i, (path, stem) in enumerate(files)}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if progress is not None:
+                    progress(results[futures[future]])
+    return BatchSummary(results, time.perf_counter() - start)
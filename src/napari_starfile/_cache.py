@@ -0,0 +1,234 @@
+"""Opt-in on-disk cache of parsed star files.
+
+Each cached file is stored as a directory of ``.npy`` files, one per column plus one for the
+``(N, 2, 3)`` vectors, so a warm open only has to memory-map them instead of reparsing the text.
+String columns are stored as integer codes plus their unique values, with code -1 for missing values.
+Entries are keyed by a fingerprint of the resolved path, size, modification time and a hash of the
+file content; the least recently used entries are evicted once the cache grows beyond ``max_bytes``.
+
+The cache is disabled by default. Enable it with :func:`enable_cache` or by setting the
+``NAPARI_STARFILE_CACHE_DIR`` environment variable.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Files up to this size are hashed completely, larger ones are hashed in evenly spaced samples
+FULL_HASH_BYTES = 64 * 1024**2
+HASH_SAMPLES = 16
+HASH_SAMPLE_BYTES = 1024**2
+# Entries written with another layout are treated as misses
+FORMAT_VERSION = 2
+
+
+def file_fingerprint(path: str | Path) -> str:
+    """Returns a hex digest of the resolved path, size, mtime and content of a file."""
+    path = Path(path).resolve()
+    stat = path.stat()
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+    with open(path, "rb") as f:
+        if stat.st_size <= FULL_HASH_BYTES:
+            while chunk := f.read(HASH_SAMPLE_BYTES):
+                digest.update(chunk)
+        else:
+            step = (stat.st_size - HASH_SAMPLE_BYTES) // (HASH_SAMPLES - 1)
+            for i in range(HASH_SAMPLES):
+                f.seek(i * step)
+                digest.update(f.read(HASH_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def _save_table(directory: Path, table: pd.DataFrame) -> list[dict]:
+    directory.mkdir()
+    columns = []
+    for i, name in enumerate(table.columns):
+        values = table[name]
+        if values.dtype.kind in "biuf":
+            np.save(directory / f"{i}.npy", values.to_numpy())
+            columns.append({"name": name, "dtype": str(values.dtype), "kind": "numeric"})
+        else:
+            codes, uniques = pd.factorize(values)
+            np.save(directory / f"{i}.codes.npy", codes)
+            np.save(directory / f"{i}.values.npy", np.asarray(uniques, dtype=str))
+            columns.append({"name": name, "dtype": str(values.dtype), "kind": "string"})
+    return columns
+
+
+def _load_table(directory: Path, columns: list[dict]) -> pd.DataFrame:
+    data = {}
+    for i, column in enumerate(columns):
+        if column["kind"] == "numeric":
+            data[column["name"]] = np.load(directory / f"{i}.npy", mmap_mode="r")
+        else:
+            codes = np.load(directory / f"{i}.codes.npy", mmap_mode="r")
+            uniques = np.load(directory / f"{i}.values.npy")
+            data[column["name"]] = pd.array(uniques.astype(object), dtype=column["dtype"]).take(codes, allow_fill=True)
+    return pd.DataFrame(data, columns=[column["name"] for column in columns], copy=False)
+
+
+def _entry_size(directory: Path) -> int:
+    return sum(f.stat().st_size for f in directory.rglob("*") if f.is_file())
+
+
+class StarCache:
+    """Size-bounded LRU cache of parsed particles/optics tables and vectors, stored in ``directory``."""
+
+    def __init__(self, directory: str | Path, max_bytes: int = 20 * 1024**3):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # Sent to worker processes without the lock, see __setstate__
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict):
+        # A copy in another process counts only its own hits, misses and evictions,
+        # which the reader adds back to the cache of the main process with add_counts
+        self.__dict__.update(state, hits=0, misses=0, evictions=0)
+        self._lock = threading.Lock()
+
+    def counts(self) -> tuple[int, int, int]:
+        return self.hits, self.misses, self.evictions
+
+    def add_counts(self, hits: int, misses: int, evictions: int):
+        """Adds the hits, misses and evictions counted by a copy of the cache in a worker process."""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+
+    def load(self, path: str | Path) -> tuple[np.ndarray, pd.DataFrame, pd.DataFrame | None] | None:
+        """Returns the cached ``(vecs, particles, optics)`` for ``path`` or None on a cache miss.
+        Vectors and numeric columns are memory-mapped read-only."""
+        entry = self.directory / file_fingerprint(path)
+        manifest_path = entry / "manifest.json"
+        try:
+            manifest = json.loads(manifest_path.read_text())
+            if manifest.get("version") != FORMAT_VERSION:
+                # Make room for an entry in the current layout
+                shutil.rmtree(entry, ignore_errors=True)
+                raise ValueError(f"Cache entry version {manifest.get('version')}")
+            vecs = np.load(entry / "vecs.npy", mmap_mode="r")
+            particles = _load_table(entry / "particles", manifest["particles"])
+            optics = None
+            if manifest["optics"] is not None:
+                optics = _load_table(entry / "optics", manifest["optics"])
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        # Mark as recently used
+        os.utime(manifest_path)
+        with self._lock:
+            self.hits += 1
+        return vecs, particles, optics
+
+    def store(self, path: str | Path, vecs: np.ndarray, particles: pd.DataFrame, optics: pd.DataFrame | None):
+        """Adds the parsed contents of ``path`` to the cache and evicts old entries if necessary."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = self.directory / file_fingerprint(path)
+        if entry.exists():
+            return
+        # Write into a temporary directory first so readers never see a partial entry
+        tmp = self.directory / f".tmp-{uuid.uuid4().hex}"
+        tmp.mkdir()
+        try:
+            np.save(tmp / "vecs.npy", np.ascontiguousarray(vecs))
+            manifest = {
+                "version": FORMAT_VERSION,
+                "source": str(Path(path).resolve()),
+                "particles": _save_table(tmp / "particles", particles),
+                "optics": None if optics is None else _save_table(tmp / "optics", optics),
+            }
+            (tmp / "manifest.json").write_text(json.dumps(manifest))
+            tmp.rename(entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not entry.exists():
+                raise
+            return
+        self.evict()
+
+    def entries(self) -> list[Path]:
+        """Returns the cache entries, least recently used first."""
+        if not self.directory.exists():
+            return []
+        entries = [e for e in self.directory.iterdir() if (e / "manifest.json").exists()]
+        return sorted(entries, key=lambda e: (e / "manifest.json").stat().st_mtime_ns)
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits into ``max_bytes``."""
+        entries = [(entry, _entry_size(entry)) for entry in self.entries()]
+        total = sum(size for _, size in entries)
+        for entry, size in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def clear(self):
+        """Removes all cache entries."""
+        if self.directory.exists():
+            for entry in self.directory.iterdir():
+                shutil.rmtree(entry, ignore_errors=True)
+
+    def stats(self) -> dict:
+        entries = self.entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(entries),
+            "bytes": sum(_entry_size(entry) for entry in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+
+_cache: StarCache | None = None
+if "NAPARI_STARFILE_CACHE_DIR" in os.environ:
+    _cache = StarCache(os.environ["NAPARI_STARFILE_CACHE_DIR"])
+
+
+def enable_cache(directory: str | Path | None = None, max_bytes: int = 20 * 1024**3) -> StarCache:
+    """Enables the on-disk cache for all subsequent reads.
+    Defaults to ``~/.cache/napari-starfile``."""
+    global _cache
+    if directory is None:
+        directory = Path.home() / ".cache" / "napari-starfile"
+    _cache = StarCache(directory, max_bytes=max_bytes)
+    return _cache
+
+
+def disable_cache():
+    global _cache
+    _cache = None
+
+
+def get_cache() -> StarCache | None:
+    return _cache
+
+
+def clear_cache():
+    if _cache is not None:
+        _cache.clear()
+
+
+def cache_stats() -> dict | None:
+    """Returns hit/miss/eviction counts and the size of the cache, or None if it is disabled."""
+    return None if _cache is None else _cache.stats()
@@ -0,0 +1,96 @@
+"""Command line interface to :func:`napari_starfile._batch.batch_process`, e.g.::
+
+    napari-starfile convert particles/ -o relion5/ --format relion5 --tomograms tomograms.star
+    napari-starfile filter run_data.star -o filtered/ --range rlnMaxValueProbDistribution 0.2 1 --isin rlnClassNumber 1 3
+    napari-starfile split run_data.star -o classes/ --by rlnClassNumber
+
+Neither napari nor Qt is imported, so it runs on machines without a display.
+"""
+import argparse
+import sys
+
+from napari_starfile._batch import WRITERS, FileResult, batch_process
+
+
+def _add_common_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("paths", nargs="+", help="Star files or directories to search for star files")
+    parser.add_argument("-o", "--output-dir", required=True, help="Directory to write the results to")
+    parser.add_argument("--format", choices=list(WRITERS), default="relion31", help="Output format (default: %(default)s)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of processes (default: one per CPU core)")
+    parser.add_argument("--chunksize", type=int, default=100_000, help="Rows parsed at once (default: %(default)s)")
+    parser.add_argument("--lazy", action="store_true", help="Keep columns that are not needed for the vectors on disk")
+    parser.add_argument(
+        "--tomograms", default=None,
+        help="Relion 5 tomograms.star with the tomogram sizes for centered coordinates (default: found next to each file)",
+    )
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only print the summary")
+
+
+def _add_filter_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--range", nargs=3, action="append", default=[], metavar=("COLUMN", "LOW", "HIGH"),
+        help="Keep rows with LOW <= COLUMN <= HIGH, can be repeated",
+    )
+    parser.add_argument(
+        "--isin", nargs="+", action="append", default=[], metavar="COLUMN VALUE",
+        help="Keep rows whose COLUMN has one of the given values, can be repeated",
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="napari-starfile", description="Batch process Relion star files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="Convert star files to another format")
+    _add_common_arguments(convert)
+    filter_parser = commands.add_parser("filter", help="Keep the particles that pass all filters")
+    _add_common_arguments(filter_parser)
+    _add_filter_arguments(filter_parser)
+    split = commands.add_parser("split", help="Write one file per value of a column")
+    _add_common_arguments(split)
+    split.add_argument("--by", required=True, help="Column to split by")
+    _add_filter_arguments(split)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    ranges = {}
+    values = {}
+    for column, low, high in getattr(args, "range", []):
+        ranges[column] = (float(low), float(high))
+    for column, *selected in getattr(args, "isin", []):
+        if not selected:
+            parser.error(f"--isin {column} needs at least one value")
+        values[column] = selected
+    if args.command == "filter" and not ranges and not values:
+        parser.error("filter needs at least one --range or --isin")
+
+    def report(result: FileResult):
+        if result.error is not None:
+            print(f"{result.path}: {result.error}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"{result.path}: {result.particles} particles in {result.seconds:.2f} s -> {len(result.outputs)} files")
+
+    try:
+        summary = batch_process(
+            args.paths,
+            args.output_dir,
+            output_format=args.format,
+            split_by=getattr(args, "by", None),
+            ranges=ranges,
+            values=values,
+            workers=args.workers,
+            chunksize=args.chunksize,
+            lazy=args.lazy,
+            tomograms=args.tomograms,
+            progress=report,
+        )
+    except ValueError as err:
+        parser.error(str(err))
+    print(summary)
+    return 1 if summary.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""Out-of-core feature columns for particle tables larger than memory.
+
+With ``read_stars(..., lazy=True)`` only the columns needed to place and orient the particles
+(:data:`EAGER_COLUMNS`) become layer features. All other columns are streamed chunk by chunk
+into a :class:`ColumnStore`, one ``.npy`` file per column (string columns as integer codes plus
+their unique values), which is memory-mapped when a column is asked for. The store is kept in the
+layer metadata under ``lazy_columns``; the widgets load single columns from it on demand and the
+writers stream it back to disk one chunk of rows at a time through :class:`LazyFeatures`.
+"""
+import json
+import shutil
+import tempfile
+import weakref
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from napari_starfile import utils
+
+# Columns kept in memory as layer features, everything needed by utils.particles2vecs
+EAGER_COLUMNS = set(
+    utils.COORDINATE_COLUMNS
+    + utils.CENTERED_COORDINATE_COLUMNS
+    + utils.ANGLE_COLUMNS
+    + utils.PIXEL_SIZE_COLUMNS
+    + [utils.TILT_SERIES_PIXEL_SIZE_COLUMN]
+    + utils.TOMO_SIZE_COLUMNS
+    + [f"rlnOrigin{zyx}Angst" for zyx in "ZYX"]
+    + ["rlnOpticsGroup", "rlnTomoName"]
+)
+
+
+class ColumnStore:
+    """Feature columns stored as ``.npy`` files in ``directory``, optionally restricted to a subset of ``rows``.
+    Indexing a store with rows returns a store over these rows that shares the files."""
+
+    def __init__(self, directory: str | Path, rows: np.ndarray | slice | None = None, _owner=None):
+        self.directory = Path(directory)
+        manifest = json.loads((self.directory / "manifest.json").read_text())
+        self.order: list[str] = manifest["order"]
+        self._columns: dict[str, dict] = {column["name"]: column for column in manifest["columns"]}
+        self._n_total = manifest["n_rows"]
+        self.rows = slice(0, self._n_total) if rows is None else rows
+        # Keeps a temporary directory alive as long as any store uses its files
+        self._owner = _owner
+
+    @property
+    def columns(self) -> list[str]:
+        return [name for name in self.order if name in self._columns]
+
+    def __len__(self) -> int:
+        if isinstance(self.rows, slice):
+            return len(range(*self.rows.indices(self._n_total)))
+        return len(self.rows)
+
+    def __getitem__(self, rows: np.ndarray | slice) -> "ColumnStore":
+        if isinstance(rows, np.ndarray) and rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        if isinstance(self.rows, slice) and isinstance(rows, slice):
+            combined = range(*self.rows.indices(self._n_total))[rows]
+            rows = slice(combined.start, combined.stop, combined.step)
+        else:
+            rows = np.arange(self._n_total)[self.rows][rows]
+        return ColumnStore(self.directory, rows, _owner=self._owner or self)
+
+    def delete_when_unused(self):
+        """Removes the directory once this store and all stores indexed from it are garbage collected."""
+        weakref.finalize(self, shutil.rmtree, self.directory, ignore_errors=True)
+
+    def dtype(self, name: str) -> np.dtype:
+        column = self._columns[name]
+        return np.dtype(column["dtype"]) if column["kind"] == "numeric" else np.dtype(object)
+
+    def _selection(self, start: int, stop: int | None) -> np.ndarray | slice:
+        if isinstance(self.rows, slice):
+            selected = range(*self.rows.indices(self._n_total))[start:stop]
+            return slice(selected.start, selected.stop, selected.step)
+        return self.rows[start:stop]
+
+    def column(self, name: str, start: int = 0, stop: int | None = None) -> np.ndarray:
+        """Returns rows ``start`` to ``stop`` of a column. Numeric columns are memory-mapped if the
+        store covers a contiguous range of rows; string columns are decoded into an object array."""
+        column = self._columns[name]
+        values = np.load(self.directory / column["file"], mmap_mode="r")[self._selection(start, stop)]
+        if column["kind"] == "numeric":
+            return values
+        # Missing values have code -1, which picks the NaN at the end
+        return np.array(column["values"] + [np.nan], dtype=object)[values]
+
+    def load(self, names: list[str] | None = None, start: int = 0, stop: int | None = None) -> pd.DataFrame:
+        """Loads rows ``start`` to ``stop`` of the given columns (default all) into a DataFrame."""
+        names = self.columns if names is None else names
+        data = {name: self.column(name, start, stop) for name in names}
+        return pd.DataFrame(data, columns=names, copy=False)
+
+
+class ColumnStoreWriter:
+    """Writes the columns of a table of known length into a new :class:`ColumnStore`, one chunk at a time."""
+
+    def __init__(self, directory: str | Path, n_rows: int, order: list[str]):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.n_rows = n_rows
+        self.order = order
+        self._arrays: dict[str, np.ndarray] = {}
+        self._kinds: dict[str, str] = {}
+        self._codes: dict[str, dict] = {}
+        self._start = 0
+
+    def _open(self, name: str, dtype: np.dtype) -> np.ndarray:
+        path = self.directory / f"{len(self._arrays)}.npy" if name not in self._arrays else Path(self._arrays[name].filename)
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(self.n_rows,))
+
+    def _encode(self, name: str, values: pd.Series) -> np.ndarray:
+        codes = self._codes[name]
+        for value in pd.unique(values.dropna()):
+            if value not in codes:
+                codes[value] = len(codes)
+        return values.map(codes).fillna(-1).to_numpy(dtype=np.int32)
+
+    def _to_strings(self, name: str):
+        """Turns a column that was numeric so far into a string column."""
+        numeric = np.array(self._arrays[name][:self._start])
+        self._kinds[name] = "string"
+        self._codes[name] = {}
+        codes = self._encode(name, pd.Series(numeric.astype(str), dtype=object))
+        target = self._arrays[name] = self._open(name, np.dtype(np.int32))
+        target[:self._start] = codes
+
+    def append(self, chunk: pd.DataFrame):
+        stop = self._start + len(chunk)
+        for name in chunk.columns:
+            values = chunk[name]
+            numeric = values.dtype.kind in "biuf"
+            if name not in self._arrays:
+                self._kinds[name] = "numeric" if numeric else "string"
+                if not numeric:
+                    self._codes[name] = {}
+                self._arrays[name] = self._open(name, values.dtype if numeric else np.dtype(np.int32))
+            elif self._kinds[name] == "numeric" and not numeric:
+                self._to_strings(name)
+            target = self._arrays[name]
+            if self._kinds[name] == "string":
+                target[self._start:stop] = self._encode(name, values.astype(object) if numeric else values)
+                continue
+            dtype = np.result_type(target.dtype, values.dtype)
+            if dtype != target.dtype:
+                # e.g. an int column that turns out to contain floats further down
+                previous = np.array(target[:self._start])
+                target = self._arrays[name] = self._open(name, dtype)
+                target[:self._start] = previous
+            target[self._start:stop] = values.to_numpy()
+        self._start = stop
+
+    def finish(self) -> ColumnStore:
+        """Writes the manifest and returns the store."""
+        columns = []
+        for name, array in self._arrays.items():
+            array.flush()
+            column = {"name": name, "file": Path(array.filename).name, "kind": self._kinds[name], "dtype": str(array.dtype)}
+            if self._kinds[name] == "string":
+                column["values"] = [str(value) for value in self._codes[name]]
+            columns.append(column)
+        self._arrays.clear()
+        manifest = {"n_rows": self.n_rows, "order": self.order, "columns": columns}
+        (self.directory / "manifest.json").write_text(json.dumps(manifest))
+        return ColumnStore(self.directory)
+
+
+def temporary_store_dir() -> Path:
+    return Path(tempfile.mkdtemp(prefix="napari-starfile-columns-"))
+
+
+class LazyFeatures:
+    """Read-only table made of in-memory ``features`` and the columns of ``store`` that they do not have.
+    It provides what :func:`napari_starfile._star_writer.write_star` uses of a DataFrame, so a table
+    larger than memory is written one chunk at a time. Columns are in the order of the original file."""
+
+    def __init__(self, features: pd.DataFrame, store: ColumnStore):
+        if len(features) != len(store):
+            raise ValueError("Features and lazy columns have different numbers of rows")
+        self.features = features
+        self.store = store
+        present = set(features.columns)
+        self._lazy = [name for name in store.columns if name not in present]
+        lazy = set(self._lazy)
+        order = [name for name in store.order if name in present or name in lazy]
+        self.columns = order + [name for name in features.columns if name not in set(order)]
+
+    def __len__(self) -> int:
+        return len(self.features)
+
+    @property
+    def dtypes(self) -> pd.Series:
+        dtypes = self.features.dtypes.to_dict()
+        dtypes.update({name: self.store.dtype(name) for name in self._lazy})
+        return pd.Series({name: dtypes[name] for name in self.columns}, dtype=object)
+
+    @property
+    def iloc(self) -> "LazyFeatures":
+        return self
+
+    def __getitem__(self, rows: slice) -> pd.DataFrame:
+        start, stop, _ = rows.indices(len(self))
+        chunk = self.store.load(self._lazy, start, stop)
+        chunk.index = self.features.index[start:stop]
+        return pd.concat([self.features.iloc[start:stop], chunk], axis=1)[self.columns]
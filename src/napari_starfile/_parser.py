@@ -0,0 +1,220 @@
+"""Streaming parser for STAR files.
+
+``starfile.read`` loads the whole file into memory as text before handing it to pandas.
+The functions here scan the file once to locate the loop blocks and then parse a single
+block in fixed-size chunks, so at most one chunk of raw text is held at any time.
+Simple (key-value) blocks are small and parsed during the scan.
+"""
+from collections.abc import Collection
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass
+class LoopBlock:
+    """Location of a loop block inside a STAR file.
+    ``start`` and ``end`` are byte offsets of the first and one past the last data row."""
+    name: str
+    columns: list[str] = field(default_factory=list)
+    start: int = 0
+    end: int = 0
+    n_rows: int = 0
+
+
+def _parse_value(value: str) -> int | float | str:
+    """Converts the value of a key-value pair like ``starfile`` does."""
+    if len(value) > 1 and value[0] == value[-1] and value[0] in "\"'":
+        return value[1:-1]
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def scan_star(path: str | Path, complete_lines: bool = False) -> dict[str, LoopBlock | dict]:
+    """Scans a STAR file line by line and returns its blocks in file order, keyed by block name:
+    a :class:`LoopBlock` for every loop block and a dict of the pairs of every simple block.
+    With ``complete_lines``, a last line without a line break is ignored, as it may still be being written."""
+    blocks: dict[str, LoopBlock | dict] = {}
+    block: LoopBlock | None = None
+    in_header = False
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if complete_lines and not line.endswith(b"\n"):
+                break
+            stripped = line.strip()
+            if stripped.startswith(b"data_"):
+                block = LoopBlock(name=stripped[5:].decode())
+                in_header = False
+            elif block is None or stripped == b"" or stripped.startswith(b"#"):
+                pass
+            elif stripped.startswith(b"loop_"):
+                blocks[block.name] = block
+                in_header = True
+            elif stripped.startswith(b"_"):
+                if in_header:
+                    block.columns.append(stripped.split()[0][1:].decode())
+                    # Rows of a loop without rows yet would start here
+                    block.start = block.end = offset + len(line)
+                elif not isinstance(blocks.get(block.name), LoopBlock):
+                    key, *value = stripped[1:].decode().split(maxsplit=1)
+                    blocks.setdefault(block.name, {})[key] = _parse_value(value[0] if value else "")
+            elif isinstance(blocks.get(block.name), LoopBlock):
+                if in_header:
+                    block.start = offset
+                    in_header = False
+                block.n_rows += 1
+                block.end = offset + len(line)
+            offset += len(line)
+    return blocks
+
+
+def scan_blocks(path: str | Path, complete_lines: bool = False) -> dict[str, LoopBlock]:
+    """Returns the loop blocks of a STAR file found by :func:`scan_star`, keyed by block name."""
+    return {name: block for name, block in scan_star(path, complete_lines).items() if isinstance(block, LoopBlock)}
+
+
+def read_leading_simple_blocks(path: str | Path) -> dict[str, dict]:
+    """Returns the simple blocks in front of the first loop block, like ``data_general`` of Relion 5
+    particle files, without scanning the rest of the file."""
+    blocks: dict[str, dict] = {}
+    name = None
+    with open(path, "rb") as f:
+        for line in f:
+            stripped = line.strip()
+            if stripped.startswith(b"data_"):
+                name = stripped[5:].decode()
+            elif stripped.startswith(b"loop_"):
+                blocks.pop(name, None)
+                break
+            elif name is not None and stripped.startswith(b"_"):
+                key, *value = stripped[1:].decode().split(maxsplit=1)
+                blocks.setdefault(name, {})[key] = _parse_value(value[0] if value else "")
+    return blocks
+
+
+def scan_appended_rows(path: str | Path, block: LoopBlock) -> tuple[LoopBlock, bool]:
+    """Scans the complete lines written after the last row of ``block``.
+    Returns a block covering just the appended rows, which can be read with :func:`iter_loop_chunks`,
+    and whether the loop has ended, i.e. another block or loop header follows it."""
+    appended = LoopBlock(name=block.name, columns=block.columns, start=block.end, end=block.end)
+    ended = False
+    offset = block.end
+    with open(path, "rb") as f:
+        f.seek(block.end)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            stripped = line.strip()
+            if stripped.startswith((b"data_", b"loop_", b"_")):
+                ended = True
+                break
+            if stripped and not stripped.startswith(b"#"):
+                if appended.n_rows == 0:
+                    appended.start = offset
+                appended.n_rows += 1
+                appended.end = offset + len(line)
+            offset += len(line)
+    return appended, ended
+
+
+def _numericise(column: pd.Series) -> pd.Series:
+    try:
+        return pd.to_numeric(column)
+    except ValueError:
+        return column
+
+
+def iter_loop_chunks(path: str | Path, block: LoopBlock, chunksize: int, text_columns: Collection[str] = ()):
+    """Yields the rows of a loop block as DataFrames of at most ``chunksize`` rows.
+    Columns are numericised the same way ``starfile`` does it, except ``text_columns``, which are kept as text."""
+    if block.n_rows == 0:
+        return
+    with open(path, "rb") as f:
+        f.seek(block.start)
+        reader = pd.read_csv(
+            f,
+            sep=r"\s+",
+            header=None,
+            names=block.columns,
+            comment="#",
+            nrows=block.n_rows,
+            chunksize=chunksize,
+            keep_default_na=False,
+            na_values=["nan", "NaN", "<NA>"],
+            dtype={name: str for name in text_columns},
+            engine="c",
+        )
+        for chunk in reader:
+            yield chunk.apply(lambda column: column if column.name in text_columns else _numericise(column))
+
+
+def _store_chunk(columns: dict[str, np.ndarray], dtypes: dict, chunk: pd.DataFrame, start: int) -> set[str]:
+    """Copies a chunk into the column arrays. Returns the columns that were numeric in earlier chunks and text
+    in this one or the other way round, which are not stored since they have to be read as text."""
+    stop = start + len(chunk)
+    mixed = set()
+    for name in chunk.columns:
+        values = chunk[name]
+        target = columns[name]
+        if (values.dtype.kind in "biuf") != (target.dtype.kind in "biuf"):
+            mixed.add(name)
+            continue
+        if values.dtype.kind in "biuf" and np.result_type(target.dtype, values.dtype) != target.dtype:
+            # e.g. an int column that turns out to contain floats further down
+            target = columns[name] = target.astype(np.result_type(target.dtype, values.dtype))
+            dtypes[name] = target.dtype
+        target[start:stop] = values.to_numpy()
+    return mixed
+
+
+def read_loop_chunked(path: str | Path, block: LoopBlock, chunksize: int = 100_000) -> pd.DataFrame:
+    """Reads a loop block into a DataFrame chunk by chunk.
+    Column arrays are preallocated from the row count found by :func:`scan_blocks` and filled in place.
+
+    A column that holds numbers in some chunks and text in others is text as a whole, like when ``starfile``
+    parses it in one go, so the block is read again with that column as text; otherwise e.g. a micrograph
+    name "007" in the first chunk would be turned into 7."""
+    text_columns: set[str] = set()
+    while True:
+        columns: dict[str, np.ndarray] = {}
+        dtypes: dict = {}
+        start = 0
+        mixed: set[str] = set()
+        for chunk in iter_loop_chunks(path, block, chunksize, text_columns):
+            if not columns:
+                for name in chunk.columns:
+                    dtype = chunk[name].dtype
+                    dtypes[name] = dtype
+                    columns[name] = np.empty(block.n_rows, dtype=dtype if dtype.kind in "biuf" else object)
+            mixed = _store_chunk(columns, dtypes, chunk, start)
+            if mixed:
+                break
+            start += len(chunk)
+        if not mixed:
+            break
+        text_columns |= mixed
+    if not columns:
+        return pd.DataFrame(np.zeros(shape=(0, len(block.columns))), columns=block.columns)
+    return pd.DataFrame(
+        {
+            name: values if values.dtype.kind in "biuf" else pd.array(values, dtype=dtypes[name])
+            for name, values in columns.items()
+        },
+        copy=False,
+    )
+
+
+def read_star_chunked(path: str | Path, chunksize: int = 100_000) -> dict[str, pd.DataFrame | dict]:
+    """Chunked counterpart of ``starfile.read(path, always_dict=True)``.
+    Loop blocks are read with :func:`read_loop_chunked`, simple blocks are returned as dicts."""
+    return {
+        name: read_loop_chunked(path, block, chunksize) if isinstance(block, LoopBlock) else block
+        for name, block in scan_star(path).items()
+    }
@@ -0,0 +1,132 @@
+"""Opt-in timing and memory instrumentation of the read and write pipelines.
+
+The reader, writers and conversion functions wrap their stages (parsing, optics lookup,
+Euler angle conversion, writing, ...) in :func:`stage`. While profiling is disabled a stage
+costs little more than a flag check. Once enabled with :func:`enable_profiling`, every finished stage
+produces a :class:`StageRecord` with its wall time, number of rows and, if requested, its peak
+allocation as seen by :mod:`tracemalloc`. Records are
+
+- logged to the ``napari_starfile.profiling`` logger at DEBUG level,
+- passed to the callbacks given to :func:`enable_profiling`, and
+- stored as a list of dicts under ``profile`` in the metadata of the layers returned by
+  :func:`napari_starfile._reader.read_stars`.
+
+``tracemalloc`` traces the whole process, so peak allocations of files read on several threads
+at once overlap. Read with ``workers=1`` for exact per-file numbers.
+"""
+import logging
+import threading
+import time
+import tracemalloc
+from collections.abc import Callable
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+
+logger = logging.getLogger("napari_starfile.profiling")
+
+
+@dataclass
+class StageRecord:
+    """Measurements of one stage. ``peak_bytes`` is None unless memory tracing is enabled."""
+    stage: str
+    seconds: float
+    rows: int | None = None
+    peak_bytes: int | None = None
+
+
+_enabled = False
+_trace_memory = False
+_callbacks: list[Callable[[StageRecord], None]] = []
+# Per-thread stack of open stages and of record lists collecting the stages of one file
+_local = threading.local()
+
+
+def enable_profiling(memory: bool = False, callback: Callable[[StageRecord], None] | None = None):
+    """Enables stage instrumentation. With ``memory``, peak allocations are traced as well,
+    which slows down allocation-heavy code noticeably. ``callback`` is called with every record."""
+    global _enabled, _trace_memory
+    _enabled = True
+    _trace_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if callback is not None:
+        _callbacks.append(callback)
+
+
+def disable_profiling():
+    global _enabled, _trace_memory
+    if _trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _enabled = False
+    _trace_memory = False
+    _callbacks.clear()
+
+
+def profiling_enabled() -> bool:
+    return _enabled
+
+
+def _stack(name: str) -> list:
+    if not hasattr(_local, name):
+        setattr(_local, name, [])
+    return getattr(_local, name)
+
+
+@contextmanager
+def stage(name: str, rows: int | None = None):
+    """Measures the enclosed block as stage ``name`` processing ``rows`` rows, if profiling is enabled."""
+    if not _enabled:
+        yield
+        return
+    # Peak memory of nested stages: the peak counter is reset for every stage,
+    # so the peak seen so far is handed on to the enclosing stage before resetting it
+    open_stages = _stack("open_stages")
+    tracing = _trace_memory and tracemalloc.is_tracing()
+    start_bytes = 0
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        if open_stages:
+            open_stages[-1][0] = max(open_stages[-1][0], peak)
+        tracemalloc.reset_peak()
+        start_bytes = current
+    frame = [0]
+    open_stages.append(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        open_stages.pop()
+        peak_bytes = None
+        if tracing:
+            peak = max(frame[0], tracemalloc.get_traced_memory()[1])
+            if open_stages:
+                open_stages[-1][0] = max(open_stages[-1][0], peak)
+            peak_bytes = max(0, peak - start_bytes)
+        _emit(StageRecord(name, seconds, rows, peak_bytes))
+
+
+def _emit(record: StageRecord):
+    for records in _stack("collectors"):
+        records.append(record)
+    if logger.isEnabledFor(logging.DEBUG):
+        memory = "" if record.peak_bytes is None else f", peak {record.peak_bytes / 1024**2:.1f} MiB"
+        rows = "" if record.rows is None else f", {record.rows} rows"
+        logger.debug("%s: %.4f s%s%s", record.stage, record.seconds, rows, memory)
+    for callback in _callbacks:
+        callback(record)
+
+
+@contextmanager
+def collect():
+    """Collects the records of all stages finished on this thread inside the block, as a list of dicts.
+    The list stays empty while profiling is disabled."""
+    records: list[StageRecord] = []
+    collectors = _stack("collectors")
+    collectors.append(records)
+    result: list[dict] = []
+    try:
+        yield result
+    finally:
+        collectors.remove(records)
+        result.extend(asdict(record) for record in records)
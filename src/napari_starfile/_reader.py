@@ -1,41 +1,387 @@
+"""Reader of STAR files into vectors layers.
+
+napari imports this module to call :func:`napari_get_reader` on every file that is opened, so it only
+imports the standard library at module level. numpy, pandas, starfile and the modules built on them are
+imported by the functions that read a file.
+"""
+from __future__ import annotations
+
+import multiprocessing
+import os
+import re
 import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+from napari_starfile._profiling import collect, profiling_enabled, stage
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+    from napari_starfile._cache import StarCache
+    from napari_starfile._lazy import ColumnStore
+
+
+# Feature column and metadata key holding the file each particle of a directory layer came from
+SOURCE_FILE_COLUMN = "sourceFile"
+SOURCE_FILES_METADATA_KEY = "source_files"
+# Per-iteration outputs of Relion refinement and classification jobs, e.g. run_it025_data.star
+ITERATION_FILE_PATTERN = re.compile(r"_it\d+_")
+# Relion 5 files next to particles that give the tomogram sizes for centered coordinates
+TOMOGRAMS_FILE_NAME = "tomograms.star"
+OPTIMISATION_SET_FILE_NAME = "optimisation_set.star"
+# Files adding up to less than this are read on threads by default, since starting processes takes longer
+PROCESS_POOL_MIN_BYTES = 32 * 1024**2
 
-import numpy as np
-import pandas as pd
-import starfile
-from scipy.spatial.transform import Rotation
 
-from napari_starfile import utils
+class NoParticlesError(ValueError):
+    pass
 
 
 def napari_get_reader(path: str | list[str]):
+    if isinstance(path, str) and os.path.isdir(path):
+        return read_star_directory if directory_star_files(path) else None
     if isinstance(path, str):
         path = [path]
-    if not all(p.endswith(".star") for p in path):
+    if not all(p.endswith((".star", ".starz")) for p in path):
         return None
     return read_stars
 
 
-def read_stars(paths: str | list[str] | Path | list[Path]) -> list:
-    paths = [paths] if isinstance(paths, str) else paths
+def read_stars(
+    paths: str | list[str] | Path | list[Path],
+    chunksize: int | None = None,
+    workers: int | None = None,
+    processes: bool | None = None,
+    cache: StarCache | None = None,
+    compact: bool = False,
+    lazy: bool = False,
+    tomograms: str | Path | pd.DataFrame | None = None,
+) -> list:
+    """Reads one or more star files into vectors layer data tuples.
+    If ``chunksize`` is given, the loop blocks are parsed in chunks of that many rows
+    instead of loading the whole file as text first, which keeps peak memory low for large files.
+
+    Multiple files are parsed concurrently on ``workers`` processes, or threads if ``processes`` is False,
+    defaulting to one per CPU core. Parsing mostly holds the GIL, so threads hardly run in parallel; by default,
+    processes are used unless the files add up to less than ``PROCESS_POOL_MIN_BYTES``, which threads read
+    faster than processes start. Layers are returned in input order. Files that fail to load are
+    reported with a warning and skipped; if none of the files could be read the first error is raised.
+
+    Parsed files are looked up in and added to ``cache``, or the cache set up with
+    :func:`napari_starfile.enable_cache` if none is given. Worker processes use a copy of the cache, whose
+    hits, misses and evictions are added to the counts of ``cache`` once the files are read.
+
+    With ``compact``, the features table is shrunk with :func:`utils.compact_features`
+    and the number of bytes saved is stored as ``features_bytes_saved`` in the layer metadata.
+
+    While profiling is enabled (see :func:`napari_starfile.enable_profiling`), the per-stage
+    measurements of each file are stored as ``profile`` in its layer metadata.
+
+    With ``lazy``, only the columns needed for the vectors are loaded as features. The others are
+    streamed into a memory-mapped :class:`napari_starfile._lazy.ColumnStore` in a temporary directory,
+    stored as ``lazy_columns`` in the layer metadata; the cache is not used.
+
+    Relion 5 centered coordinates are converted to pixels with the tomogram sizes and tilt-series pixel
+    sizes of ``tomograms``, a tomograms.star or its global table, which is kept as ``tomograms`` in the
+    layer metadata for the Relion 5 writer. Without it, each file uses the tomograms.star next to it or
+    named by the optimisation_set.star next to it, if there is one (see :func:`find_tomograms_file`);
+    files with centered coordinates and no known tomogram sizes fail to load. Files read with a
+    tomograms table are not cached.
+
+    Binary ``.starz`` files (see :mod:`napari_starfile._starz`) are read as they are, without
+    parsing, caching or out-of-core columns; their vectors are memory-mapped."""
+    from napari_starfile import utils
+
+    paths = [paths] if isinstance(paths, (str, Path)) else paths
     paths = [Path(p) for p in paths]
-    layers = []
+    if isinstance(tomograms, (str, Path)):
+        tomograms = read_tomograms(tomograms)
+    results = _read_all(
+        paths, chunksize=chunksize, workers=workers, processes=processes, cache=cache, compact=compact, lazy=lazy, tomograms=tomograms
+    )
+    layers = [result for result in results if not isinstance(result, Exception)]
+    for _, extra_kwargs, _ in layers:
+        if utils.LAZY_COLUMNS_METADATA_KEY in extra_kwargs.get("metadata", {}):
+            extra_kwargs["metadata"][utils.LAZY_COLUMNS_METADATA_KEY].delete_when_unused()
+    errors = [(path, result) for path, result in zip(paths, results, strict=True) if isinstance(result, Exception)]
+    if errors and not layers:
+        raise errors[0][1]
+    for path, err in errors:
+        warnings.warn(f"Could not read {path}: {err}", stacklevel=2)
+    return layers
+
+
+def _total_size(paths: list[Path]) -> int:
+    total = 0
     for path in paths:
-        star = starfile.read(path, always_dict=True)
-        if "particles" in star:
-            particles = star["particles"]
-        elif "" in star:
-            particles = star[""]
+        try:
+            total += path.stat().st_size
+        except OSError:
+            # Reported when the file is read
+            pass
+    return total
+
+
+def _read_all(paths: list[Path], workers: int | None = None, processes: bool | None = None, cache: StarCache | None = None, **kwargs) -> list:
+    """Reads the files concurrently and returns a layer data tuple or the exception raised for each of them."""
+    from napari_starfile._cache import get_cache
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(paths)))
+    if cache is None:
+        cache = get_cache()
+    if workers == 1:
+        return [_try_read_star(path, cache=cache, **kwargs) for path in paths]
+    if processes is None:
+        processes = _total_size(paths) >= PROCESS_POOL_MIN_BYTES
+    if not processes:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(partial(_try_read_star, cache=cache, **kwargs), paths))
+    # Forking could copy locks held by other threads of napari, e.g. Qt's
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        results = list(executor.map(partial(_read_star_in_process, cache=cache, **kwargs), paths))
+    if cache is not None:
+        for _, counts in results:
+            cache.add_counts(*counts)
+    return [result for result, _ in results]
+
+
+def directory_star_files(path: str | Path) -> list[Path]:
+    """Returns the star files directly in a directory, without the per-iteration files of Relion jobs."""
+    return sorted(p for p in Path(path).glob("*.star") if not ITERATION_FILE_PATTERN.search(p.name))
+
+
+def read_star_directory(
+    path: str | Path,
+    chunksize: int | None = None,
+    workers: int | None = None,
+    processes: bool | None = None,
+    cache: StarCache | None = None,
+    compact: bool = False,
+    tomograms: str | Path | pd.DataFrame | None = None,
+) -> list:
+    """Reads all star files with particles in a directory, e.g. a Relion job directory, into a single layer.
+    Files are parsed concurrently like in :func:`read_stars`; files without particles are skipped.
+    Subdirectories and the per-iteration files of refinement and classification jobs (``run_itNNN_*``)
+    are left out, so a finished job gives the particles of its final ``run_data.star``.
+
+    The particles of each file form a contiguous range of rows. The file they came from, relative to
+    ``path``, is stored in the categorical ``sourceFile`` feature, and the row ranges in the
+    ``source_files`` table (columns ``file``, ``start``, ``stop``) of the layer metadata.
+    Features missing from some of the files are dropped. ``tomograms`` is used like in :func:`read_stars`."""
+    import numpy as np
+    import pandas as pd
+
+    from napari_starfile import utils
+
+    directory = Path(path)
+    paths = directory_star_files(directory)
+    if isinstance(tomograms, (str, Path)):
+        tomograms = read_tomograms(tomograms)
+    results = _read_all(paths, chunksize=chunksize, workers=workers, processes=processes, cache=cache, tomograms=tomograms)
+    files: list[str] = []
+    layers = []
+    for star_path, result in zip(paths, results, strict=True):
+        if isinstance(result, NoParticlesError):
+            continue
+        if isinstance(result, Exception):
+            warnings.warn(f"Could not read {star_path}: {result}", stacklevel=2)
+            continue
+        files.append(star_path.relative_to(directory).as_posix())
+        layers.append(result)
+    if not layers:
+        raise ValueError(f"No star files with particles in {directory}")
+    vecs = np.concatenate([layer_vecs for layer_vecs, _, _ in layers])
+    merged = utils.merge_optics_tables([extra_kwargs.get("metadata", {}).get("optics") for _, extra_kwargs, _ in layers])
+    all_features = [merged.remap(i, extra_kwargs["features"]) for i, (_, extra_kwargs, _) in enumerate(layers)]
+    features = pd.concat(all_features, join="inner", ignore_index=True)
+    counts = [len(layer_vecs) for layer_vecs, _, _ in layers]
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    features[SOURCE_FILE_COLUMN] = pd.Categorical.from_codes(np.repeat(np.arange(len(files)), counts), categories=files)
+    metadata = {SOURCE_FILES_METADATA_KEY: pd.DataFrame({"file": files, "start": bounds[:-1], "stop": bounds[1:]})}
+    general = next((extra_kwargs["metadata"]["general"] for _, extra_kwargs, _ in layers if "general" in extra_kwargs.get("metadata", {})), None)
+    if general is not None:
+        metadata["general"] = general
+    tomograms = next((extra_kwargs["metadata"]["tomograms"] for _, extra_kwargs, _ in layers if "tomograms" in extra_kwargs.get("metadata", {})), None)
+    if tomograms is not None:
+        metadata["tomograms"] = tomograms
+    if merged.optics is not None:
+        if merged.n_renumbered:
+            warnings.warn(f"Files define the same optics group differently, renumbered {merged.n_renumbered} optics groups", stacklevel=2)
+        metadata["optics"] = merged.optics
+    all_quats = [extra_kwargs.get("metadata", {}).get(utils.ORIENTATIONS_METADATA_KEY) for _, extra_kwargs, _ in layers]
+    if all(quats is not None for quats in all_quats):
+        metadata[utils.ORIENTATIONS_METADATA_KEY] = np.concatenate(all_quats)
+    if compact:
+        features, metadata["features_bytes_saved"] = utils.compact_features(features)
+    extra_kwargs = {"name": directory.name, "edge_color": "blue", "features": features, "metadata": metadata}
+    return [(vecs, extra_kwargs, "vectors")]
+
+
+def _try_read_star(path: Path, **kwargs) -> tuple | Exception:
+    try:
+        return read_star(path, **kwargs)
+    except Exception as err:  # noqa: BLE001
+        return err
+
+
+def _read_star_in_process(path: Path, cache: StarCache | None = None, **kwargs) -> tuple:
+    """Like :func:`_try_read_star`, also returns the counts of the copy of the cache in the worker process."""
+    result = _try_read_star(path, cache=cache, **kwargs)
+    return result, (0, 0, 0) if cache is None else cache.counts()
+
+
+def find_tomograms_file(path: str | Path) -> Path | None:
+    """Returns the Relion 5 tomograms.star of a particles file: the one next to it, or the one named by the
+    optimisation_set.star next to it, relative to the Relion project directory. None if there is neither."""
+    path = Path(path)
+    sibling = path.with_name(TOMOGRAMS_FILE_NAME)
+    if sibling.is_file():
+        return sibling
+    optimisation_set = path.with_name(OPTIMISATION_SET_FILE_NAME)
+    if not optimisation_set.is_file():
+        return None
+    from napari_starfile._parser import read_leading_simple_blocks
+
+    for block in read_leading_simple_blocks(optimisation_set).values():
+        tomograms_file = block.get("rlnTomoTomogramsFile")
+        if not tomograms_file:
+            continue
+        # The project directory is one of the parents of the job directory
+        for parent in path.resolve().parents:
+            if (parent / str(tomograms_file)).is_file():
+                return parent / str(tomograms_file)
+    return None
+
+
+def read_tomograms(path: str | Path) -> pd.DataFrame:
+    """Reads the table of tomograms, with their rlnTomoName, sizes and tilt-series pixel sizes,
+    from the global block of a Relion 5 tomograms.star."""
+    import pandas as pd
+    import starfile
+
+    table = starfile.read(path, always_dict=True).get("global")
+    if not isinstance(table, pd.DataFrame) or "rlnTomoName" not in table.columns:
+        raise ValueError(f"No tomograms table in {path}")
+    return table
+
+
+def read_star(
+    path: Path,
+    chunksize: int | None = None,
+    cache: StarCache | None = None,
+    compact: bool = False,
+    lazy: bool = False,
+    tomograms: pd.DataFrame | None = None,
+) -> tuple:
+    from napari_starfile import utils
+
+    with collect() as profile, stage("read_star"):
+        metadata = {}
+        if tomograms is None and path.suffix != ".starz":
+            tomograms_file = find_tomograms_file(path)
+            if tomograms_file is not None:
+                tomograms = read_tomograms(tomograms_file)
+        if tomograms is not None:
+            metadata["tomograms"] = tomograms
+            # The vectors depend on the tomograms, which are not part of the cache key
+            cache = None
+        if path.suffix == ".starz":
+            from napari_starfile._starz import read_starz_tables
+
+            with stage("read_starz"):
+                vecs, particles, optics = read_starz_tables(path)
+        elif lazy:
+            vecs, particles, optics, metadata[utils.LAZY_COLUMNS_METADATA_KEY] = _parse_star_lazy(path, chunksize=chunksize or 100_000, tomograms=tomograms)
         else:
-            raise ValueError("No particles in star file")
-        assert isinstance(particles, pd.DataFrame)
-        optics = star.get("optics", None)
-        vecs = utils.particles2vecs(particles, optics)
-        extra_kwargs = {"name": path.stem, "edge_color": "blue", "features": particles}
+            with stage("cache_load"):
+                cached = None if cache is None else cache.load(path)
+            if cached is not None:
+                vecs, particles, optics = cached
+            else:
+                vecs, particles, optics = _parse_star(path, chunksize=chunksize, tomograms=tomograms)
+                if cache is not None:
+                    with stage("cache_store", rows=len(particles)):
+                        cache.store(path, vecs, particles, optics)
         if optics is not None:
-            extra_kwargs["metadata"] = {"optics": optics}
-        layers.append(
-            (vecs, extra_kwargs, "vectors")
-        )
-    return layers
+            metadata["optics"] = optics
+        if path.suffix != ".starz":
+            from napari_starfile._parser import read_leading_simple_blocks
+
+            # Relion 5 files start with a general block that the writer puts back
+            general = read_leading_simple_blocks(path).get("general")
+            if general is not None:
+                metadata["general"] = general
+        if all(col in particles.columns for col in utils.ANGLE_COLUMNS):
+            with stage("euler2quat", rows=len(particles)):
+                metadata[utils.ORIENTATIONS_METADATA_KEY] = utils.euler2quat(particles)
+        if compact:
+            with stage("compact_features", rows=len(particles)):
+                particles, metadata["features_bytes_saved"] = utils.compact_features(particles)
+    if profiling_enabled():
+        metadata["profile"] = profile
+    extra_kwargs = {"name": path.stem, "edge_color": "blue", "features": particles}
+    if metadata:
+        extra_kwargs["metadata"] = metadata
+    return (vecs, extra_kwargs, "vectors")
+
+
+def _parse_star(path: Path, chunksize: int | None = None, tomograms: pd.DataFrame | None = None) -> tuple[np.ndarray, pd.DataFrame, pd.DataFrame | None]:
+    import pandas as pd
+    import starfile
+
+    from napari_starfile import utils
+    from napari_starfile._parser import read_star_chunked
+
+    with stage("parse"):
+        if chunksize is None:
+            star = starfile.read(path, always_dict=True)
+        else:
+            star = read_star_chunked(path, chunksize=chunksize)
+    if "particles" in star:
+        particles = star["particles"]
+    elif "" in star:
+        particles = star[""]
+    else:
+        raise NoParticlesError("No particles in star file")
+    assert isinstance(particles, pd.DataFrame)
+    optics = star.get("optics", None)
+    vecs = utils.particles2vecs(particles, optics, tomograms)
+    return vecs, particles, optics
+
+
+def _parse_star_lazy(path: Path, chunksize: int, tomograms: pd.DataFrame | None = None) -> tuple[np.ndarray, pd.DataFrame, pd.DataFrame | None, ColumnStore]:
+    """Parses the particles chunk by chunk, keeping only the columns in ``_lazy.EAGER_COLUMNS`` in memory."""
+    import numpy as np
+    import pandas as pd
+
+    from napari_starfile import _lazy, utils
+    from napari_starfile._parser import iter_loop_chunks, read_loop_chunked, scan_blocks
+
+    blocks = scan_blocks(path)
+    if "particles" in blocks:
+        block = blocks["particles"]
+    elif "" in blocks:
+        block = blocks[""]
+    else:
+        raise NoParticlesError("No particles in star file")
+    optics = read_loop_chunked(path, blocks["optics"], chunksize) if "optics" in blocks else None
+    eager_columns = [col for col in block.columns if col in _lazy.EAGER_COLUMNS]
+    writer = _lazy.ColumnStoreWriter(_lazy.temporary_store_dir(), block.n_rows, block.columns)
+    eager_chunks = []
+    with stage("parse", rows=block.n_rows):
+        for chunk in iter_loop_chunks(path, block, chunksize):
+            eager_chunks.append(chunk[eager_columns])
+            writer.append(chunk.drop(columns=eager_columns))
+    store = writer.finish()
+    if eager_chunks:
+        particles = pd.concat(eager_chunks, ignore_index=True)
+    else:
+        particles = pd.DataFrame(np.zeros((0, len(eager_columns))), columns=eager_columns)
+    vecs = utils.particles2vecs(particles, optics, tomograms)
+    return vecs, particles, optics, store
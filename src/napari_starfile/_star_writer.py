@@ -0,0 +1,119 @@
+"""Streaming STAR writer.
+
+Produces the same text as ``starfile.write`` (with its default ``%.6f`` float format)
+apart from the header comment, but writes loop blocks that are split across several DataFrames without concatenating them,
+and formats a block of rows column by column instead of mapping over every cell.
+"""
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from napari_starfile import __version__
+from napari_starfile._profiling import stage
+
+FLOAT_FORMAT = "%.6f"
+NA_REP = "<NA>"
+SEPARATOR = "\t"
+
+
+def common_columns(tables: list[pd.DataFrame]) -> list[str]:
+    """Columns shared by all tables, in the order of the first one (like ``pd.concat(join="inner")``)."""
+    if not tables:
+        raise ValueError("Nothing to write, no layers or tables were given")
+    columns = list(tables[0].columns)
+    for table in tables[1:]:
+        present = set(table.columns)
+        columns = [col for col in columns if col in present]
+    return columns
+
+
+def _column_kind(dtypes: list) -> str:
+    """Returns how a column made of parts with ``dtypes`` is formatted after concatenation."""
+    kinds = {np.dtype(dtype).kind if isinstance(dtype, np.dtype) else "O" for dtype in dtypes}
+    if kinds <= {"i", "u"}:
+        return "int"
+    if kinds <= {"i", "u", "f"}:
+        return "float"
+    if kinds == {"b"}:
+        return "bool"
+    return "object"
+
+
+def _fill_na(out: list[str], na: np.ndarray) -> list[str]:
+    for i in np.flatnonzero(na).tolist():
+        out[i] = NA_REP
+    return out
+
+
+def format_column(values: pd.Series, kind: str) -> list[str]:
+    """Formats a column as ``starfile.write`` would after concatenating all parts of the block."""
+    if kind == "float":
+        values = values.to_numpy(dtype=float)
+        return _fill_na(list(map(FLOAT_FORMAT.__mod__, values.tolist())), np.isnan(values))
+    if kind in ("int", "bool"):
+        return list(map(str, values.tolist()))
+    na = values.isna().to_numpy()
+    out = values.tolist()
+    if isinstance(values.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(values):
+        # Only strings with spaces and empty strings are quoted
+        strings = values.astype(str)
+        quote = (strings.str.contains(" ", regex=False) | (strings.str.len() == 0)).to_numpy() & ~na
+        for i in np.flatnonzero(quote).tolist():
+            out[i] = f'"{out[i]}"'
+    else:
+        out = [f'"{value}"' if isinstance(value, str) and (" " in value or not value) else value for value in out]
+    return _fill_na(list(map(str, out)), na)
+
+
+def iter_loop_text(name: str, tables: list[pd.DataFrame], chunksize: int = 100_000):
+    """Yields the text of a loop block made of the rows of all ``tables``, one chunk of rows at a time."""
+    columns = common_columns(tables)
+    kinds = {col: _column_kind([table.dtypes[col] for table in tables]) for col in columns}
+    header = [f"data_{name}", "", "loop_"] + [f"_{column} #{idx}" for idx, column in enumerate(columns, 1)]
+    yield "\n".join(header) + "\n"
+    for table in tables:
+        for start in range(0, len(table), chunksize):
+            chunk = table.iloc[start:start + chunksize]
+            formatted = [format_column(chunk[col], kinds[col]) for col in columns]
+            yield "\n".join(map(SEPARATOR.join, zip(*formatted, strict=True))) + "\n"
+    yield "\n\n"
+
+
+def simple_block_text(name: str, values: dict) -> str:
+    """Returns the text of a block of key-value pairs, formatted like ``starfile.write``."""
+    lines = [f"data_{name}", ""]
+    for key, value in values.items():
+        if isinstance(value, str) and (" " in value or not value):
+            value = f'"{value}"'
+        lines.append(f"_{key}\t\t\t{value}")
+    return "\n".join(lines) + "\n\n\n"
+
+
+def header_line() -> str:
+    now = datetime.now()
+    return (
+        f"# Created by napari-starfile (version {__version__}) "
+        f"at {now.strftime('%H:%M:%S')} on {now.strftime('%d/%m/%Y')}"
+    )
+
+
+def write_star(path: str | Path, blocks: dict[str, pd.DataFrame | list[pd.DataFrame] | dict], chunksize: int = 100_000):
+    """Writes loop blocks to a STAR file, one chunk of ``chunksize`` rows at a time.
+    A block given as a list of DataFrames is written as if they had been concatenated with ``join="inner"``,
+    a block given as a dict is written as a simple block of key-value pairs."""
+    blocks = {name: [tables] if isinstance(tables, pd.DataFrame) else tables for name, tables in blocks.items()}
+    # Fail before creating the file
+    for tables in blocks.values():
+        if not isinstance(tables, dict):
+            common_columns(tables)
+    with open(path, "w", newline="") as f:
+        f.write(header_line() + "\n\n\n")
+        for name, tables in blocks.items():
+            if isinstance(tables, dict):
+                f.write(simple_block_text(name, tables))
+                continue
+            with stage(f"write_block_{name or 'particles'}", rows=sum(len(table) for table in tables)):
+                for text in iter_loop_text(name, tables, chunksize):
+                    f.write(text)
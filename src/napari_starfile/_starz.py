@@ -0,0 +1,180 @@
+"""Binary columnar particle files (``.starz``), an alternative to STAR text for exchanging particle sets.
+
+A ``.starz`` file is an uncompressed ZIP archive, like a numpy ``.npz``, of Arrow IPC files:
+
+- ``particles.arrow``: the particles table, as it would be written to a STAR file, with
+  zstd-compressed buffers. Categorical columns are stored as Arrow dictionaries.
+- ``optics.arrow``: the optics table, if there is one.
+- ``vectors.arrow``: the ``(N, 2, 3)`` vectors computed from the particles, as a single
+  uncompressed ``fixed_size_list<double>[6]`` column.
+- ``starz.json``: the format version and the number of particles.
+
+Members start at 64-byte aligned offsets, so the vectors can be memory-mapped straight from the
+archive without copying, and every member can be extracted with ``unzip`` and read by any Arrow library.
+Floating point values are stored exactly, so writing a STAR file from a ``.starz`` file gives the same
+text as writing it from the layers the ``.starz`` file was saved from.
+
+pyarrow is an optional dependency (``pip install napari-starfile[arrow]``).
+"""
+from __future__ import annotations
+
+import json
+import struct
+import zipfile
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from napari_starfile import utils
+from napari_starfile._lazy import LazyFeatures
+from napari_starfile._star_writer import common_columns
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+FORMAT_VERSION = 1
+MANIFEST = "starz.json"
+ALIGNMENT = 64
+# Extra field id used by Android's zipalign for padding, ignored by other zip readers
+_PADDING_EXTRA_ID = 0xD935
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_ZIP64_EXTRA_SIZE = 20
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc  # noqa: F401
+    except ImportError as err:
+        raise ImportError(".starz files need pyarrow, install it with `pip install napari-starfile[arrow]`") from err
+    return pa
+
+
+def _open_member(archive: zipfile.ZipFile, name: str):
+    """Opens a stored member for writing whose data starts at a multiple of ``ALIGNMENT`` bytes."""
+    info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+    info.compress_type = zipfile.ZIP_STORED
+    # Members are always written with a zip64 extra field, so the header size is known in advance
+    header_size = _LOCAL_HEADER.size + len(name.encode()) + _ZIP64_EXTRA_SIZE + 4
+    padding = -(archive.fp.tell() + header_size) % ALIGNMENT
+    info.extra = struct.pack("<HH", _PADDING_EXTRA_ID, padding) + bytes(padding)
+    return archive.open(info, "w", force_zip64=True)
+
+
+def _member_offsets(path: Path) -> dict[str, tuple[int, int]]:
+    """Returns the offset and size of the data of every member of an archive of stored members."""
+    offsets = {}
+    with open(path, "rb") as f, zipfile.ZipFile(f) as archive:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"Compressed member {info.filename} in {path}")
+            f.seek(info.header_offset)
+            header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+            offsets[info.filename] = (info.header_offset + _LOCAL_HEADER.size + header[-2] + header[-1], info.file_size)
+    return offsets
+
+
+def _table_schema(table: pd.DataFrame | LazyFeatures) -> pa.Schema:
+    pa = _pyarrow()
+    if isinstance(table, pd.DataFrame):
+        return pa.Schema.from_pandas(table, preserve_index=False).remove_metadata()
+    fields = {field.name: field for field in pa.Schema.from_pandas(table.features, preserve_index=False)}
+    for name, dtype in table.dtypes.items():
+        if name not in fields:
+            fields[name] = pa.field(name, pa.large_string() if dtype == object else pa.from_numpy_dtype(dtype))
+    return pa.schema([fields[name] for name in table.columns])
+
+
+def _common_schema(tables: list[pd.DataFrame | LazyFeatures]) -> pa.Schema:
+    """Schema of the tables concatenated with ``join="inner"``, with the same type promotions as the STAR writer."""
+    pa = _pyarrow()
+    columns = common_columns(tables)
+    schemas = [_table_schema(table) for table in tables]
+    if len(schemas) > 1:
+        # Categories differ between tables, but Arrow IPC files hold one dictionary per column
+        schemas = [
+            pa.schema([field.with_type(field.type.value_type) if pa.types.is_dictionary(field.type) else field for field in schema])
+            for schema in schemas
+        ]
+    schema = pa.unify_schemas(schemas, promote_options="permissive")
+    return pa.schema([schema.field(name) for name in columns])
+
+
+def _vectors(tables: list[pd.DataFrame | LazyFeatures], columns: list[str], optics: pd.DataFrame | None) -> np.ndarray:
+    """The vectors the reader computes from the written particles."""
+    all_vecs = []
+    for table in tables:
+        features = table.features if isinstance(table, LazyFeatures) else table
+        all_vecs.append(utils.particles2vecs(features[[col for col in columns if col in features.columns]], optics))
+    return np.concatenate(all_vecs) if all_vecs else np.zeros((0, 2, 3))
+
+
+def _write_ipc(archive: zipfile.ZipFile, name: str, schema: pa.Schema, batches, compression: str | None):
+    pa = _pyarrow()
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    with _open_member(archive, name) as member, pa.ipc.new_file(member, schema, options=options) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+def write_starz_tables(
+    path: str | Path,
+    particles: pd.DataFrame | LazyFeatures | list[pd.DataFrame | LazyFeatures],
+    optics: pd.DataFrame | None = None,
+    compression: str | None = "zstd",
+    chunksize: int = 100_000,
+):
+    """Writes particle tables, concatenated like :func:`napari_starfile._star_writer.write_star` does,
+    and their optics table to a ``.starz`` file, one chunk of ``chunksize`` rows at a time."""
+    pa = _pyarrow()
+    tables = [particles] if not isinstance(particles, list) else particles
+    schema = _common_schema(tables)
+    vecs = _vectors(tables, schema.names, optics)
+
+    def particle_batches():
+        for table in tables:
+            for start in range(0, len(table), chunksize):
+                chunk = table.iloc[start:start + chunksize][schema.names]
+                yield pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False)
+
+    with open(path, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_STORED) as archive:
+        vectors = pa.FixedSizeListArray.from_arrays(pa.array(np.ascontiguousarray(vecs, dtype=float).reshape(-1)), 6)
+        vectors_schema = pa.schema([pa.field("vectors", vectors.type)])
+        _write_ipc(archive, "vectors.arrow", vectors_schema, [pa.record_batch([vectors], schema=vectors_schema)], None)
+        _write_ipc(archive, "particles.arrow", schema, particle_batches(), compression)
+        if optics is not None:
+            optics_table = pa.Table.from_pandas(optics, preserve_index=False)
+            optics_table = optics_table.replace_schema_metadata(None)
+            _write_ipc(archive, "optics.arrow", optics_table.schema, optics_table.to_batches(), compression)
+        archive.writestr(MANIFEST, json.dumps({"version": FORMAT_VERSION, "n_rows": len(vecs)}))
+
+
+def read_starz_tables(path: str | Path, mmap: bool = True) -> tuple[np.ndarray, pd.DataFrame, pd.DataFrame | None]:
+    """Reads the vectors, particles and optics (or None) of a ``.starz`` file.
+    With ``mmap``, the vectors are a read-only view of the memory-mapped file instead of a copy."""
+    pa = _pyarrow()
+    path = Path(path)
+    offsets = _member_offsets(path)
+    with open(path, "rb") as f:
+        f.seek(offsets[MANIFEST][0])
+        manifest = json.loads(f.read(offsets[MANIFEST][1]))
+    if manifest["version"] > FORMAT_VERSION:
+        raise ValueError(f"{path} has format version {manifest['version']}, this version of napari-starfile reads up to {FORMAT_VERSION}")
+    source = pa.memory_map(str(path)) if mmap else pa.OSFile(str(path))
+
+    def read_table(name: str) -> pa.Table:
+        offset, size = offsets[name]
+        source.seek(offset)
+        return pa.ipc.open_file(source.read_buffer(size)).read_all()
+
+    with source:
+        vectors = read_table("vectors.arrow").column("vectors")
+        # The vectors are written as a single batch, so their values are one contiguous buffer
+        vecs = vectors.chunk(0).flatten().to_numpy().reshape((-1, 2, 3)) if vectors.num_chunks else np.zeros((0, 2, 3))
+        if not mmap:
+            vecs = vecs.copy()
+        particles = read_table("particles.arrow").to_pandas()
+        optics = read_table("optics.arrow").to_pandas() if "optics.arrow" in offsets else None
+    return vecs, particles, optics
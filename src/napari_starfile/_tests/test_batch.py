@@ -0,0 +1,84 @@
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import starfile
+
+from napari_starfile._batch import batch_process
+from napari_starfile._cli import main
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+
+
+def test_batch_filter_split(tmp_path):
+    path = DATA_DIR / "example_particles_with_optics.star"
+    particles = starfile.read(path)["particles"]
+    low, high = particles["rlnMaxValueProbDistribution"].quantile([0.25, 0.75])
+    expected = particles[particles["rlnMaxValueProbDistribution"].between(low, high) & (particles["rlnRandomSubset"] == 2)]
+    for job in ("job001", "job002"):
+        (tmp_path / "in" / job).mkdir(parents=True)
+        shutil.copy(path, tmp_path / "in" / job / "particles.star")
+    summary = batch_process(
+        [tmp_path / "in"],
+        tmp_path / "out",
+        split_by="rlnRandomSubset",
+        ranges={"rlnMaxValueProbDistribution": (low, high)},
+        values={"rlnRandomSubset": ["2"]},
+        workers=2,
+    )
+    assert not summary.failed
+    assert summary.files == 2
+    assert summary.particles == 2 * len(expected)
+    for job, result in zip(("job001", "job002"), summary.results, strict=True):
+        assert result.outputs == [str(tmp_path / "out" / job / "particles_2.star")]
+        written = starfile.read(result.outputs[0])["particles"]
+        np.testing.assert_allclose(written["rlnMaxValueProbDistribution"], expected["rlnMaxValueProbDistribution"])
+        pd.testing.assert_series_equal(written["rlnImageName"], expected["rlnImageName"].reset_index(drop=True))
+        pd.testing.assert_series_equal(written["rlnMicrographName"], expected["rlnMicrographName"].reset_index(drop=True))
+
+
+def test_cli_convert(tmp_path, capsys):
+    broken = tmp_path / "broken.star"
+    broken.write_text("data_\n\nloop_\n_rlnCoordinateX #1\n")
+    tomograms = pd.DataFrame(
+        {"rlnTomoName": ["example_particles_with_optics"], "rlnTomoSizeX": [4000], "rlnTomoSizeY": [4000], "rlnTomoSizeZ": [1000]}
+    )
+    starfile.write({"global": tomograms}, tmp_path / "tomograms.star")
+    assert main([
+        "convert", str(DATA_DIR / "example_particles_with_optics.star"), "-o", str(tmp_path / "out"), "--format", "relion5", "-j", "1",
+        "--tomograms", str(tmp_path / "tomograms.star"),
+    ]) == 0
+    written = starfile.read(tmp_path / "out" / "example_particles_with_optics.star")
+    particles = starfile.read(DATA_DIR / "example_particles_with_optics.star")["particles"]
+    expected = (particles["rlnCoordinateX"] - 2000) * particles["rlnPixelSize"]
+    np.testing.assert_allclose(written["particles"]["rlnCenteredCoordinateXAngst"], expected, atol=1e-4)
+    assert "Processed 1 files (0 failed) with 126 particles" in capsys.readouterr().out
+    assert main(["convert", str(broken), "-o", str(tmp_path / "out"), "-j", "1"]) == 1
+    assert "broken.star" in capsys.readouterr().err
+
+
+def test_batch_output_collisions(tmp_path):
+    for job in ("a", "b"):
+        (tmp_path / job).mkdir()
+        shutil.copy(DATA_DIR / "example_particles_with_optics.star", tmp_path / job / "run_data.star")
+    with pytest.raises(ValueError, match="overwrite"):
+        batch_process([tmp_path / "a" / "run_data.star", tmp_path / "b" / "run_data.star"], tmp_path / "out", workers=1)
+    assert not (tmp_path / "out").exists()
+    # Directories keep their layout in the output
+    summary = batch_process([tmp_path], tmp_path / "out", workers=1)
+    assert [result.outputs for result in summary.results] == [
+        [str(tmp_path / "out" / "a" / "run_data.star")],
+        [str(tmp_path / "out" / "b" / "run_data.star")],
+    ]
+
+
+def test_batch_does_not_import_qt():
+    code = (
+        "import sys, napari_starfile._cli; "
+        "print(sorted({name.split('.')[0] for name in sys.modules} & {'napari', 'magicgui', 'qtpy', 'PyQt5', 'PyQt6', 'PySide2', 'PySide6'}))"
+    )
+    assert subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.strip() == "[]"
@@ -0,0 +1,43 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import starfile
+
+from napari_starfile import utils
+from napari_starfile._lazy import EAGER_COLUMNS
+from napari_starfile._reader import read_stars
+from napari_starfile._writer import write_star_relion31
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+
+
+def test_read_stars_lazy(tmp_path):
+    path = DATA_DIR / "example_particles_with_optics.star"
+    (vecs, kwargs, _), = read_stars(path)
+    (lazy_vecs, lazy_kwargs, _), = read_stars(path, lazy=True, chunksize=1000)
+    np.testing.assert_array_equal(lazy_vecs, vecs)
+    features = kwargs["features"]
+    assert set(lazy_kwargs["features"].columns) <= EAGER_COLUMNS
+    store = lazy_kwargs["metadata"]["lazy_columns"]
+    assert set(store.columns) | set(lazy_kwargs["features"].columns) == set(features.columns)
+    np.testing.assert_array_equal(store.column("rlnClassNumber"), features["rlnClassNumber"])
+    assert list(store.column("rlnMicrographName")) == list(features["rlnMicrographName"])
+    # Indexed stores share the files
+    rows = np.flatnonzero(features["rlnClassNumber"] == 2)
+    assert list(store[rows][10:20].column("rlnMicrographName")) == list(features["rlnMicrographName"].iloc[rows[10:20]])
+    # Written files are the same, the lazy columns are streamed back in their original order
+    write_star_relion31(str(tmp_path / "eager.star"), [(vecs, {**kwargs, "name": "layer"}, "vectors")])
+    write_star_relion31(str(tmp_path / "lazy.star"), [(lazy_vecs, {**lazy_kwargs, "name": "layer"}, "vectors")])
+    eager, lazy = starfile.read(tmp_path / "eager.star"), starfile.read(tmp_path / "lazy.star")
+    pd.testing.assert_frame_equal(lazy["particles"], eager["particles"])
+    # Splitting by a lazy column carries the matching rows of the store over
+    (group_vecs, group_kwargs, _), *_ = utils.split_layer(
+        lazy_vecs,
+        lazy_kwargs["features"].assign(rlnClassNumber=store.column("rlnClassNumber")),
+        "rlnClassNumber",
+        lazy_kwargs["metadata"],
+    )
+    group_store = group_kwargs["metadata"]["lazy_columns"]
+    assert len(group_store) == len(group_vecs)
+    np.testing.assert_array_equal(group_store.column("rlnClassNumber"), group_kwargs["features"]["rlnClassNumber"])
@@ -0,0 +1,71 @@
+from pathlib import Path
+
+import numpy as np
+import starfile
+
+from napari_starfile import utils
+from napari_starfile._reader import read_stars
+from napari_starfile._widget import LevelOfDetailWidget, _visible_box
+from napari_starfile._writer import write_star_relion31
+
+
+def test_level_of_detail_widget(make_napari_viewer, tmp_path):
+    viewer = make_napari_viewer()
+    (vecs, kwargs, _), = read_stars(Path(__file__).parent.parent / "data" / "example_particles_with_optics.star")
+    layer = viewer.add_vectors(vecs, **kwargs)
+    widget = LevelOfDetailWidget(viewer)
+    widget.cb_layer.value = layer
+    widget.sb_max_vectors.value = len(vecs) // 4
+    widget.enable(layer)
+    assert len(layer.data) <= len(vecs) // 4
+    assert len(layer.features) == len(layer.data)
+    # Writers see all particles
+    path = str(tmp_path / "full.star")
+    write_star_relion31(path, [(layer.data, {**layer.as_layer_data_tuple()[1], "name": layer.name}, "vectors")])
+    assert len(starfile.read(path)["particles"]) == len(vecs)
+    # So do the other widgets
+    full_vecs, full_meta = utils.full_layer(layer.data, {"features": layer.features, "metadata": layer.metadata})
+    np.testing.assert_array_equal(full_vecs, vecs)
+    assert len(full_meta["features"]) == len(vecs)
+    widget.disable()
+    np.testing.assert_array_equal(layer.data, vecs)
+    assert len(layer.features) == len(vecs)
+
+
+def test_level_of_detail_keeps_edits(make_napari_viewer):
+    viewer = make_napari_viewer()
+    (vecs, kwargs, _), = read_stars(Path(__file__).parent.parent / "data" / "example_particles_with_optics.star")
+    layer = viewer.add_vectors(vecs, **kwargs)
+    widget = LevelOfDetailWidget(viewer)
+    widget.sb_max_vectors.value = len(vecs) // 4
+    widget.enable(layer)
+    shown = layer.metadata[utils.LOD_METADATA_KEY]["indices"]
+    moved = layer.data.copy()
+    moved[0, 0] += 10
+    layer.data = moved
+    full_vecs, _ = utils.full_layer(layer.data, {"metadata": layer.metadata})
+    np.testing.assert_array_equal(full_vecs[shown[0]], moved[0])
+    # Showing another subsample keeps the edit
+    widget.sb_max_vectors.value = len(vecs) // 2
+    widget.refresh()
+    widget.disable()
+    np.testing.assert_array_equal(layer.data[shown[0]], moved[0])
+    np.testing.assert_array_equal(np.delete(layer.data, shown[0], axis=0), np.delete(vecs, shown[0], axis=0))
+
+
+def test_level_of_detail_transformed_layer(make_napari_viewer):
+    viewer = make_napari_viewer()
+    (vecs, kwargs, _), = read_stars(Path(__file__).parent.parent / "data" / "example_particles_with_optics.star")
+    layer = viewer.add_vectors(vecs, scale=(2, 2, 2), translate=(0, 100, 100), **kwargs)
+    viewer.reset_view()
+    widget = LevelOfDetailWidget(viewer)
+    widget.enable(layer)
+    low, high = _visible_box(viewer, layer)
+    world_low = layer.data_to_world(np.where(np.isfinite(low), low, 0))
+    camera = viewer.camera
+    half_extent = np.asarray(viewer.canvas.size, dtype=float) / camera.zoom / 2
+    np.testing.assert_allclose(world_low[-2:], np.asarray(camera.center)[-2:] - half_extent)
+    # Removing the layer disconnects the widget
+    viewer.layers.remove(layer)
+    assert widget._layer is None
+    camera.zoom *= 2
@@ -1,6 +1,18 @@
+import subprocess
+import sys
+from pathlib import Path
+
 import numpy as np
+import pandas as pd
+import pytest
+import starfile
 
 from napari_starfile import napari_get_reader
+from napari_starfile._cache import StarCache
+from napari_starfile._parser import read_star_chunked
+from napari_starfile._profiling import disable_profiling, enable_profiling
+from napari_starfile._reader import read_star_directory, read_stars
+from napari_starfile.utils import split_layer
 
 
 # tmp_path is a pytest fixture
@@ -29,3 +41,219 @@ def test_reader(tmp_path):
 def test_get_reader_pass():
     reader = napari_get_reader("fake.file")
     assert reader is None
+
+
+# Seconds that importing the plugin and checking a file name may take
+IMPORT_BUDGET = 0.5
+
+
+def test_get_reader_imports():
+    code = """
+import sys, time
+start = time.perf_counter()
+import napari_starfile
+assert napari_starfile.napari_get_reader("image.tif") is None
+assert napari_starfile.napari_get_reader("particles.star") is not None
+print(time.perf_counter() - start)
+print(" ".join(sorted({name.split(".")[0] for name in sys.modules})))
+"""
+    seconds, modules = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.splitlines()
+    assert not set(modules.split()) & {"numpy", "pandas", "scipy", "starfile", "magicgui", "qtpy", "napari"}
+    assert float(seconds) < IMPORT_BUDGET
+
+
+def test_read_stars_chunked(tmp_path):
+    data_dir = Path(__file__).parent.parent / "data"
+    # Columns that look numeric in the first chunk but hold text further down, and the other way round
+    mixed = tmp_path / "mixed.star"
+    rows = [f"{i} {i} {i} 0 0 0 {name} {other}" for i, (name, other) in enumerate(
+        [("007", "mic_a"), ("008", "mic_a"), ("mic_b", "009"), ("010", "010"), ("011", "mic_c")]
+    )]
+    columns = ["rlnCoordinateX", "rlnCoordinateY", "rlnCoordinateZ", "rlnAngleRot", "rlnAngleTilt", "rlnAnglePsi", "rlnMicrographName", "rlnImageName"]
+    mixed.write_text("data_particles\n\nloop_\n" + "".join(f"_{name} #{i + 1}\n" for i, name in enumerate(columns)) + "\n".join(rows) + "\n")
+    for path, chunksize in [*((path, 100) for path in data_dir.glob("*.star")), (mixed, 2)]:
+        (vecs, kwargs, layer_type), = read_stars(path)
+        (chunked_vecs, chunked_kwargs, chunked_type), = read_stars(path, chunksize=chunksize)
+        assert chunked_type == layer_type
+        np.testing.assert_array_equal(chunked_vecs, vecs)
+        pd.testing.assert_frame_equal(chunked_kwargs["features"], kwargs["features"])
+        if "optics" in kwargs["metadata"]:
+            pd.testing.assert_frame_equal(chunked_kwargs["metadata"]["optics"], kwargs["metadata"]["optics"])
+        np.testing.assert_array_equal(chunked_kwargs["metadata"]["orientations"], kwargs["metadata"]["orientations"])
+    assert list(chunked_kwargs["features"]["rlnMicrographName"]) == ["007", "008", "mic_b", "010", "011"]
+    assert list(chunked_kwargs["features"]["rlnImageName"]) == ["mic_a", "mic_a", "009", "010", "mic_c"]
+
+
+def test_read_star_chunked_simple_blocks(tmp_path):
+    path = tmp_path / "general.star"
+    path.write_text(
+        "data_general\n\n_rlnTomoSubTomosAre2DStacks\t1\n_rlnTomoName 'TS 01'\n_rlnPixelSize 1.5\n\n"
+        "data_particles\n\nloop_\n_rlnCoordinateX #1\n_rlnCoordinateY #2\n1 2\n3 4\n"
+    )
+    expected = starfile.read(path, always_dict=True)
+    chunked = read_star_chunked(path, chunksize=1)
+    assert list(chunked) == list(expected) == ["general", "particles"]
+    assert chunked["general"] == expected["general"] == {"rlnTomoSubTomosAre2DStacks": 1, "rlnTomoName": "TS 01", "rlnPixelSize": 1.5}
+    pd.testing.assert_frame_equal(chunked["particles"], expected["particles"])
+
+
+def test_read_stars_parallel(tmp_path):
+    data_dir = Path(__file__).parent.parent / "data"
+    paths = sorted(data_dir.glob("*.star")) * 3
+    broken = tmp_path / "broken.star"
+    broken.write_text("data_optics\n\nloop_\n_rlnVoltage #1\n300\n")
+    serial = read_stars(paths, workers=1)
+    with pytest.warns(UserWarning, match="broken.star"):
+        parallel = read_stars(paths[:3] + [broken] + paths[3:], workers=4)
+    assert len(parallel) == len(serial) == len(paths)
+    for (vecs, kwargs, _), (parallel_vecs, parallel_kwargs, _) in zip(serial, parallel, strict=True):
+        assert parallel_kwargs["name"] == kwargs["name"]
+        np.testing.assert_array_equal(parallel_vecs, vecs)
+    with pytest.raises(ValueError, match="No particles"):
+        read_stars([broken, broken], workers=2)
+
+
+def test_read_stars_default_pool(monkeypatch):
+    from concurrent.futures import ProcessPoolExecutor
+
+    from napari_starfile import _reader
+
+    used = []
+
+    class RecordingPool(ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            used.append(kwargs["max_workers"])
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(_reader, "ProcessPoolExecutor", RecordingPool)
+    paths = sorted((Path(__file__).parent.parent / "data").glob("*.star"))
+    # Small files are read on threads
+    threaded = read_stars(paths, workers=2)
+    assert used == []
+    monkeypatch.setattr(_reader, "PROCESS_POOL_MIN_BYTES", 0)
+    parallel = read_stars(paths, workers=2)
+    assert used == [2]
+    for (vecs, _, _), (parallel_vecs, _, _) in zip(threaded, parallel, strict=True):
+        np.testing.assert_array_equal(parallel_vecs, vecs)
+
+
+def test_read_stars_cache_missing_strings(tmp_path):
+    star = starfile.read(Path(__file__).parent.parent / "data" / "example_particles_with_optics.star")
+    star["particles"].loc[[0, 3], "rlnMicrographName"] = np.nan
+    path = tmp_path / "particles.star"
+    starfile.write(star, path)
+    cache = StarCache(tmp_path / "cache")
+    (_, kwargs, _), = read_stars(path, cache=cache)
+    (_, cached_kwargs, _), = read_stars(path, cache=cache)
+    assert cache.stats()["hits"] == 1
+    assert cached_kwargs["features"]["rlnMicrographName"].isna().sum() == 2
+    pd.testing.assert_frame_equal(cached_kwargs["features"].copy(), kwargs["features"])
+
+
+def test_read_stars_cache(tmp_path):
+    cache = StarCache(tmp_path / "cache")
+    path = tmp_path / "particles.star"
+    path.write_bytes((Path(__file__).parent.parent / "data" / "example_particles_with_optics.star").read_bytes())
+    (vecs, kwargs, _), = read_stars(path, cache=cache)
+    (cached_vecs, cached_kwargs, _), = read_stars(path, cache=cache)
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    assert isinstance(cached_vecs, np.memmap)
+    np.testing.assert_array_equal(cached_vecs, vecs)
+    pd.testing.assert_frame_equal(cached_kwargs["features"].copy(), kwargs["features"])
+    pd.testing.assert_frame_equal(cached_kwargs["metadata"]["optics"].copy(), kwargs["metadata"]["optics"])
+    # Changing the file invalidates the entry
+    with open(path, "a") as f:
+        f.write("\n")
+    read_stars(path, cache=cache)
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["entries"] == 2
+    # Entries beyond the size limit are evicted, least recently used first
+    cache.max_bytes = cache.stats()["bytes"] // 2
+    cache.evict()
+    assert cache.stats()["entries"] == 1 and cache.evictions == 1
+    cache.clear()
+    assert cache.stats()["entries"] == 0
+
+
+def test_read_stars_cache_processes(tmp_path):
+    cache = StarCache(tmp_path / "cache")
+    source = (Path(__file__).parent.parent / "data" / "example_particles_with_optics.star").read_bytes()
+    paths = [tmp_path / f"particles{i}.star" for i in range(3)]
+    for i, path in enumerate(paths):
+        # Different content, so that every file gets its own entry
+        path.write_bytes(source + b"\n" * i)
+    layers = read_stars(paths, workers=2, processes=True, cache=cache)
+    assert cache.stats()["misses"] == 3 and cache.stats()["entries"] == 3
+    cached = read_stars(paths, workers=2, processes=True, cache=cache)
+    assert cache.stats()["hits"] == 3
+    for (vecs, _, _), (cached_vecs, _, _) in zip(layers, cached, strict=True):
+        np.testing.assert_array_equal(cached_vecs, vecs)
+
+
+def test_read_stars_profiling(caplog):
+    path = Path(__file__).parent.parent / "data" / "example_particles_with_optics.star"
+    (_, kwargs, _), = read_stars(path)
+    assert "profile" not in kwargs["metadata"]
+    records = []
+    enable_profiling(memory=True, callback=records.append)
+    try:
+        with caplog.at_level("DEBUG", logger="napari_starfile.profiling"):
+            (vecs, kwargs, _), = read_stars(path)
+    finally:
+        disable_profiling()
+    profile = kwargs["metadata"]["profile"]
+    stages = [record["stage"] for record in profile]
+    assert stages == [record.stage for record in records]
+    assert {"parse", "euler2vec", "particles2vecs", "read_star"} <= set(stages)
+    # Enclosing stages finish last and include the time and memory of the inner ones
+    read_star, = (record for record in profile if record["stage"] == "read_star")
+    assert read_star is profile[-1]
+    assert all(record["seconds"] <= read_star["seconds"] for record in profile)
+    assert all(record["peak_bytes"] <= read_star["peak_bytes"] for record in profile)
+    particles2vecs, = (record for record in profile if record["stage"] == "particles2vecs")
+    assert particles2vecs["rows"] == len(vecs)
+    assert "particles2vecs" in caplog.text
+
+
+def test_read_star_directory(tmp_path):
+    data_dir = Path(__file__).parent.parent / "data"
+    job_dir = tmp_path / "job001"
+    (job_dir / "sub").mkdir(parents=True)
+    source = (data_dir / "example_particles_with_optics.star").read_text()
+    (job_dir / "a.star").write_text(source)
+    (job_dir / "b.star").write_text(source)
+    # Nested directories and per-iteration files are not read
+    (job_dir / "sub" / "c.star").write_text(source)
+    (job_dir / "run_it001_data.star").write_text(source)
+    # Star files without particles are skipped
+    (job_dir / "job.star").write_text("data_job\n\n_rlnJobTypeLabel relion.autopick\n")
+    assert napari_get_reader(str(job_dir)) is read_star_directory
+    (vecs, kwargs, _), = read_star_directory(job_dir)
+    (file_vecs, file_kwargs, _), = read_stars(job_dir / "a.star")
+    n = len(file_vecs)
+    assert kwargs["name"] == "job001"
+    np.testing.assert_array_equal(vecs, np.concatenate([file_vecs, file_vecs]))
+    assert list(kwargs["metadata"]["source_files"].itertuples(index=False, name=None)) == [("a.star", 0, n), ("b.star", n, 2 * n)]
+    pd.testing.assert_frame_equal(kwargs["metadata"]["optics"], file_kwargs["metadata"]["optics"])
+    # Splitting by source file gives back the files
+    layers = list(split_layer(vecs, kwargs["features"], "sourceFile"))
+    assert [layer_kwargs["name"] for _, layer_kwargs, _ in layers] == ["a.star", "b.star"]
+    np.testing.assert_array_equal(layers[1][0], file_vecs)
+
+
+def test_read_star_directory_refine_job(tmp_path):
+    data_dir = Path(__file__).parent.parent / "data"
+    job_dir = tmp_path / "Refine3D" / "job010"
+    job_dir.mkdir(parents=True)
+    source = (data_dir / "example_particles_with_optics.star").read_text()
+    for name in ["run_it000_data.star", "run_it001_data.star", "run_ct1_it002_data.star", "run_data.star"]:
+        (job_dir / name).write_text(source)
+    (job_dir / "run_it001_model.star").write_text("data_model_general\n\n_rlnReferenceDimensionality 3\n")
+    (vecs, kwargs, _), = read_star_directory(job_dir)
+    (file_vecs, _, _), = read_stars(job_dir / "run_data.star")
+    np.testing.assert_array_equal(vecs, file_vecs)
+    assert list(kwargs["metadata"]["source_files"]["file"]) == ["run_data.star"]
+    # Directories without star files, e.g. zarr stores, are left to other readers
+    (tmp_path / "volume.zarr").mkdir()
+    assert napari_get_reader(str(tmp_path / "volume.zarr")) is None
+    assert napari_get_reader(str(tmp_path / "Refine3D")) is None
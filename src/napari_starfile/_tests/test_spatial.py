@@ -0,0 +1,30 @@
+from pathlib import Path
+
+import numpy as np
+
+from napari_starfile import utils
+from napari_starfile._reader import read_stars
+from napari_starfile._widget import SpatialWidget, spatial_index
+
+
+def test_spatial_widget(make_napari_viewer):
+    viewer = make_napari_viewer()
+    (vecs, kwargs, _), = read_stars(Path(__file__).parent.parent / "data" / "example_particles_with_optics.star")
+    layer = viewer.add_vectors(vecs, **kwargs)
+    widget = SpatialWidget(viewer)
+    widget.cb_layer.value = layer
+    widget.on_layer_changed()
+    assert spatial_index(layer) is spatial_index(layer)
+    widget.sb_distance.value = 50
+    widget.cb_score.value = "rlnLogLikeliContribution"
+    widget.on_remove_duplicates_clicked()
+    keep = utils.remove_duplicates(vecs, kwargs["features"]["rlnLogLikeliContribution"].to_numpy(), 50)
+    deduplicated = viewer.layers[-1]
+    assert deduplicated.name == f"{layer.name} deduplicated"
+    np.testing.assert_array_equal(deduplicated.data, vecs[keep])
+    assert len(deduplicated.features) == keep.sum()
+    widget.on_neighbor_counts_clicked()
+    widget.on_nearest_neighbor_clicked()
+    np.testing.assert_array_equal(layer.features["neighborCount"], utils.neighbor_counts(vecs, 50))
+    np.testing.assert_allclose(layer.features["nearestNeighborDistance"], utils.nearest_neighbor_distances(vecs))
+    assert "nearestNeighborDistance" in widget.cb_score.choices
@@ -0,0 +1,46 @@
+from pathlib import Path
+
+import numpy as np
+
+from napari_starfile._reader import read_stars
+from napari_starfile._widget import SplitWidget
+
+
+def test_split_widget(make_napari_viewer, qtbot):
+    viewer = make_napari_viewer()
+    (vecs, kwargs, _), = read_stars(Path(__file__).parent.parent / "data" / "example_particles_with_optics.star")
+    layer = viewer.add_vectors(vecs, **kwargs)
+    widget = SplitWidget(viewer)
+    widget.batch_size = 2
+    widget.cb_layer.value = layer
+    widget.on_layer_changed()
+    widget.cb_column.value = "rlnClassNumber"
+    widget.on_split_clicked()
+    groups = layer.features.groupby("rlnClassNumber")
+    qtbot.waitUntil(lambda: widget._worker is None)
+    assert len(viewer.layers) == 1 + len(groups)
+    for (value, table), split_layer in zip(groups, viewer.layers[1:], strict=True):
+        assert split_layer.name == str(value)
+        np.testing.assert_array_equal(split_layer.data, vecs[table.index])
+        np.testing.assert_array_equal(split_layer.features["rlnImageName"], table["rlnImageName"])
+        assert split_layer.metadata["optics"] is kwargs["metadata"]["optics"]
+
+
+def test_split_widget_lazy_column(make_napari_viewer, qtbot):
+    viewer = make_napari_viewer()
+    (vecs, kwargs, _), = read_stars(Path(__file__).parent.parent / "data" / "example_particles_with_optics.star", lazy=True)
+    layer = viewer.add_vectors(vecs, **kwargs)
+    widget = SplitWidget(viewer)
+    widget.cb_layer.value = layer
+    widget.on_layer_changed()
+    assert "rlnClassNumber" not in layer.features.columns
+    assert "rlnClassNumber" in widget.cb_column.choices
+    widget.cb_column.value = "rlnClassNumber"
+    widget.on_split_clicked()
+    qtbot.waitUntil(lambda: widget._worker is None)
+    class_numbers = kwargs["metadata"]["lazy_columns"].column("rlnClassNumber")
+    assert len(viewer.layers) == 1 + len(np.unique(class_numbers))
+    for split_layer in viewer.layers[1:]:
+        store = split_layer.metadata["lazy_columns"]
+        assert len(store) == len(split_layer.data)
+        assert (store.column("rlnClassNumber") == int(split_layer.name)).all()
@@ -0,0 +1,104 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from napari_starfile._reader import read_stars
+from napari_starfile._widget import (
+    CategoryIndex,
+    SortedIndex,
+    SubsetSelectorWidget,
+)
+
+
+def test_sorted_index():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=1000)
+    values[::50] = np.nan
+    index = SortedIndex(values)
+    assert index.mask.all()
+    for low, high in [(-1, 1), (-0.5, 2), (0.5, 0.7), (1.5, 3), (-3, -2), (-3, 3)]:
+        before = index.mask.copy()
+        changed = index.select(low, high)
+        expected = (values >= low) & (values <= high)
+        np.testing.assert_array_equal(index.mask, expected)
+        np.testing.assert_array_equal(np.sort(changed), np.flatnonzero(before != expected))
+
+
+def test_category_index():
+    rng = np.random.default_rng(0)
+    values = np.array([f"micrograph_{i:04d}" for i in rng.integers(0, 200, 5000)], dtype=object)
+    values[::100] = None
+    index = CategoryIndex(values)
+    assert index.choices == sorted(set(values[values != None]))  # noqa: E711
+    selected = index.choices[::3] + ["not in column"]
+    np.testing.assert_array_equal(index.mask(selected), np.isin(values, selected))
+    assert not index.mask([]).any()
+
+
+def test_subset_selector_incremental(make_napari_viewer, qtbot):
+    viewer = make_napari_viewer()
+    rng = np.random.default_rng(0)
+    features = pd.DataFrame(
+        {
+            "score": rng.uniform(0, 1, 500),
+            "defocus": rng.uniform(-2, 2, 500),
+            "group": rng.integers(0, 5, 500),
+        }
+    )
+    layer = viewer.add_points(rng.uniform(0, 100, (500, 3)), features=features)
+    widget = SubsetSelectorWidget(viewer)
+    widget.cb_points_layer.value = layer
+    widget.on_b_add_filter_clicked()
+    score_filter, defocus_filter = widget.filter_widgets
+    score_filter.cb_filter_property.value = "score"
+    defocus_filter.cb_filter_property.value = "defocus"
+    assert layer.shown.all()
+    for score_range, defocus_range in [((0.2, 0.8), (-1.5, 1.5)), ((0.2, 0.8), (-1, 0.5)), ((0.5, 0.9), (-1, 0.5))]:
+        score_filter.rs_float_filter.value = score_range
+        defocus_filter.rs_float_filter.value = defocus_range
+        score_filter.apply_filter()
+        defocus_filter.apply_filter()
+        expected = features["score"].between(*score_range) & features["defocus"].between(*defocus_range)
+        np.testing.assert_array_equal(layer.shown, expected.to_numpy())
+    # Slider changes are applied after the debounce interval
+    score_filter.rs_float_filter.value = (0.1, 0.3)
+    expected = features["score"].between(0.1, 0.3) & features["defocus"].between(-1, 0.5)
+    qtbot.waitUntil(lambda: np.array_equal(layer.shown, expected.to_numpy()))
+    score_filter.rs_float_filter.value = (0.5, 0.9)
+    score_filter.apply_filter()
+    widget.on_b_pop_filter_clicked()
+    expected = features["score"].between(0.5, 0.9)
+    np.testing.assert_array_equal(layer.shown, expected.to_numpy())
+    # Discrete filter on an integer column
+    score_filter.cb_filter_property.value = "group"
+    assert score_filter.cb_discrete_filter.choices == (0, 1, 2, 3, 4)
+    score_filter.cb_discrete_filter.value = [1, 3]
+    score_filter.apply_filter()
+    np.testing.assert_array_equal(layer.shown, features["group"].isin([1, 3]).to_numpy())
+
+
+def test_subset_selector_compact(make_napari_viewer):
+    viewer = make_napari_viewer()
+    (vecs, kwargs, _), = read_stars(Path(__file__).parent.parent / "data" / "example_particles_with_optics.star", compact=True)
+    features = kwargs["features"]
+    assert features["rlnClassNumber"].dtype == np.int8
+    assert features["rlnLogLikeliContribution"].dtype == np.float32
+    layer = viewer.add_points(vecs[:, 0], features=features)
+    widget = SubsetSelectorWidget(viewer)
+    widget.cb_points_layer.value = layer
+    widget.on_b_add_filter_clicked()
+    class_filter, score_filter = widget.filter_widgets
+    class_filter.cb_filter_property.value = "rlnClassNumber"
+    score_filter.cb_filter_property.value = "rlnLogLikeliContribution"
+    assert (class_filter._mode, score_filter._mode) == ("discrete", "range")
+    selected = sorted(features["rlnClassNumber"].unique())[:1]
+    class_filter.cb_discrete_filter.value = selected
+    low, high = features["rlnLogLikeliContribution"].quantile([0.25, 0.75])
+    score_filter.rs_float_filter.value = (low, high)
+    class_filter.apply_filter()
+    score_filter.apply_filter()
+    score_range = score_filter.rs_float_filter.value
+    expected = features["rlnClassNumber"].isin(selected) & features["rlnLogLikeliContribution"].between(*score_range)
+    assert not expected.all()
+    np.testing.assert_array_equal(layer.shown, expected.to_numpy())
@@ -0,0 +1,23 @@
+from pathlib import Path
+
+import numpy as np
+
+from napari_starfile import utils
+from napari_starfile._reader import read_stars
+from napari_starfile._widget import SymmetryWidget
+
+
+def test_symmetry_widget(make_napari_viewer):
+    viewer = make_napari_viewer()
+    (vecs, kwargs, _), = read_stars(Path(__file__).parent.parent / "data" / "example_particles_with_optics.star")
+    layer = viewer.add_vectors(vecs, **kwargs)
+    widget = SymmetryWidget(viewer)
+    widget.cb_layer.value = layer
+    widget.le_symmetry.value = "C4"
+    widget.on_expand_clicked()
+    expanded = viewer.layers[-1]
+    assert expanded.name == f"{layer.name} C4"
+    assert len(expanded.data) == 4 * len(vecs)
+    np.testing.assert_allclose(expanded.data[::4], vecs)
+    np.testing.assert_array_equal(expanded.features["symmetryOperator"], np.tile(np.arange(4), len(vecs)))
+    np.testing.assert_allclose(utils.particles2vecs(expanded.features, expanded.metadata.get("optics")), expanded.data, atol=1e-9)
@@ -1,7 +1,26 @@
 import starfile
 from pathlib import Path
 import numpy as np
-from napari_starfile.utils import euler2vec, vec2euler
+import pandas as pd
+import pytest
+from scipy.spatial.transform import Rotation
+from napari_starfile.utils import (
+    compact_features,
+    euler2vec,
+    group_indices,
+    euler2matrix,
+    join_optics,
+    matrix2euler,
+    merge_optics_tables,
+    nearest_neighbor_distances,
+    neighbor_counts,
+    particles2vecs,
+    remove_duplicates,
+    SpatialGrid,
+    symmetry_expand,
+    symmetry_matrices,
+    vec2euler,
+)
 
 def test_euler2vec():
     star = starfile.read(Path(__file__).parent.parent / "data" / "example_particles.star")
@@ -12,4 +31,195 @@ def test_euler2vec():
     # Check array input
     vecs = euler2vec(star[["rlnAngleRot", "rlnAngleTilt", "rlnAnglePsi"]].to_numpy())
     eulers = vec2euler(vecs)
-    assert np.allclose(eulers[:, (1, 2)], star[["rlnAngleTilt", "rlnAnglePsi"]].to_numpy())
\ No newline at end of file
+    assert np.allclose(eulers[:, (1, 2)], star[["rlnAngleTilt", "rlnAnglePsi"]].to_numpy())
+
+def _vec2euler_loop(vecs: np.ndarray) -> np.ndarray:
+    """Per-vector reference implementation that vec2euler replaced."""
+    eulers = np.empty_like(vecs, dtype=float)
+    for i, vec in enumerate(vecs):
+        rot, _ = Rotation.align_vectors(vec[::-1], [[0, 0, 1]])
+        eulers[i] = rot.inv().as_euler("ZYZ", degrees=True)
+    return eulers
+
+
+def test_vec2euler_roundtrip():
+    rng = np.random.default_rng(0)
+    vecs = rng.normal(size=(1000, 3))
+    vecs /= np.linalg.norm(vecs, axis=1)[:, None]
+    eulers = vec2euler(vecs)
+    assert np.allclose(euler2vec(eulers), vecs)
+    # Non-normalized input gives the same angles
+    assert np.allclose(vec2euler(vecs * 3), eulers)
+
+
+def test_vec2euler_poles():
+    vecs = np.array([[1, 0, 0], [-1, 0, 0], [0, 0, 0], [0, 1, 0]], dtype=float)
+    eulers = vec2euler(vecs)
+    assert np.allclose(eulers[0], 0)
+    assert np.isclose(eulers[1, 1], 180)
+    assert np.allclose(eulers[2], 0)
+    assert np.allclose(euler2vec(eulers[[0, 1, 3]]), vecs[[0, 1, 3]])
+
+
+def test_vec2euler_matches_loop():
+    rng = np.random.default_rng(1)
+    vecs = rng.normal(size=(2000, 3))
+    vecs /= np.linalg.norm(vecs, axis=1)[:, None]
+    assert np.allclose(vec2euler(vecs), _vec2euler_loop(vecs), atol=1e-6)
+
+
+def test_compact_features():
+    star = starfile.read(Path(__file__).parent.parent / "data" / "example_particles_with_optics.star")
+    particles = star["particles"]
+    compact, saved = compact_features(particles)
+    assert saved > 0
+    assert saved == particles.memory_usage(deep=True).sum() - compact.memory_usage(deep=True).sum()
+    assert isinstance(compact["rlnMicrographName"].dtype, pd.CategoricalDtype)
+    assert compact["rlnOpticsGroup"].dtype == np.int8
+    for column in particles.columns:
+        assert (compact[column].astype(particles[column].dtype) == particles[column]).all()
+
+
+def _optics_example() -> tuple[pd.DataFrame, pd.DataFrame]:
+    star = starfile.read(Path(__file__).parent.parent / "data" / "example_particles_with_optics.star")
+    particles = star["particles"].drop(columns=["rlnPixelSize"])
+    optics = pd.concat([star["optics"]] * 2, ignore_index=True)
+    optics.loc[1, "rlnOpticsGroup"] = 2
+    optics.loc[1, "rlnImagePixelSize"] = 2.0
+    particles.loc[::3, "rlnOpticsGroup"] = 2
+    particles.loc[1, "rlnOpticsGroup"] = 5
+    return particles, optics
+
+
+def test_join_optics():
+    particles, optics = _optics_example()
+    expected = pd.merge(particles, optics, how="left", on="rlnOpticsGroup", validate="many_to_one")
+    pd.testing.assert_frame_equal(join_optics(particles, optics), expected)
+    with pytest.raises(ValueError, match="not unique"):
+        join_optics(particles, pd.concat([optics, optics]))
+
+
+def test_merge_optics_tables():
+    _, optics = _optics_example()
+    # The second table defines group 2 differently and adds group 3
+    other = optics.copy()
+    other.loc[1, "rlnImagePixelSize"] = 3.0
+    other = pd.concat([other, other.iloc[[0]].assign(rlnOpticsGroup=3)], ignore_index=True)
+    merged = merge_optics_tables([optics, None, optics.copy(), other])
+    assert (merged.n_tables, merged.n_distinct, merged.n_renumbered) == (3, 2, 1)
+    assert str(merged) == "4 optics groups from 3 optics tables (2 distinct), 1 renumbered"
+    np.testing.assert_array_equal(merged.optics["rlnOpticsGroup"], [1, 2, 4, 3])
+    np.testing.assert_array_equal(merged.optics["rlnImagePixelSize"], [optics.loc[0, "rlnImagePixelSize"], 2.0, 3.0, optics.loc[0, "rlnImagePixelSize"]])
+    assert merged.group_maps[1] is None
+    particles = pd.DataFrame({"rlnOpticsGroup": [1, 2, 2, 3, 5]})
+    assert merged.remap(0, particles) is particles
+    np.testing.assert_array_equal(merged.remap(3, particles)["rlnOpticsGroup"], [1, 4, 4, 3, 5])
+    assert merge_optics_tables([None]).optics is None
+
+
+def test_merge_optics_tables_dtypes():
+    optics = pd.DataFrame({"rlnOpticsGroup": [1, 2], "rlnVoltage": [300, 200], "rlnImagePixelSize": [0.885, 1.1]})
+    # The same groups read with float columns, e.g. from a file that wrote 300.0
+    as_float = optics.astype({"rlnOpticsGroup": float, "rlnVoltage": float, "rlnImagePixelSize": np.float32})
+    merged = merge_optics_tables([optics, as_float])
+    assert (merged.n_distinct, merged.n_renumbered) == (1, 0)
+    assert len(merged.optics) == 2
+    np.testing.assert_array_equal(merged.group_maps[1][1], [1, 2])
+
+
+def test_particles2vecs_optics_pixel_size():
+    particles, optics = _optics_example()
+    vecs = particles2vecs(particles, optics)
+    pixel_size = np.where(particles["rlnOpticsGroup"] == 2, 2.0, 4.0)
+    pixel_size[1] = np.nan
+    shifts = particles[[f"rlnOrigin{zyx}Angst" for zyx in "ZYX"]].to_numpy() / pixel_size[:, None]
+    coords = particles[[f"rlnCoordinate{zyx}" for zyx in "ZYX"]].to_numpy() - shifts
+    np.testing.assert_allclose(vecs[:, 0], coords)
+
+
+def test_matrix2euler_roundtrip():
+    rng = np.random.default_rng(0)
+    eulers = np.deg2rad(np.column_stack([rng.uniform(-180, 180, 100), rng.uniform(0, 180, 100), rng.uniform(-180, 180, 100)]))
+    eulers[:2, 1] = (0, np.pi)
+    matrices = euler2matrix(eulers, homogenous=False)
+    np.testing.assert_allclose(euler2matrix(matrix2euler(matrices), homogenous=False), matrices, atol=1e-12)
+
+
+@pytest.mark.parametrize(("symmetry", "order"), [("C1", 1), ("C7", 7), ("D3", 6), ("T", 12), ("O", 24), ("I", 60)])
+def test_symmetry_matrices(symmetry, order):
+    matrices = symmetry_matrices(symmetry)
+    assert matrices.shape == (order, 3, 3)
+    np.testing.assert_allclose(matrices[0], np.eye(3))
+    np.testing.assert_allclose(matrices @ matrices.transpose(0, 2, 1), np.broadcast_to(np.eye(3), matrices.shape), atol=1e-12)
+    np.testing.assert_allclose(np.linalg.det(matrices), 1)
+
+
+def test_symmetry_expand():
+    particles, optics = _optics_example()
+    particles = particles.assign(rlnAngleRot=10.0, rlnAngleTilt=20.0, rlnAnglePsi=30.0).iloc[[0, 2, 3]]
+    vecs, expanded, rows = symmetry_expand(particles, optics, "D7", offset=np.array([5.0, 0.0, 10.0]))
+    assert len(expanded) == len(vecs) == 14 * len(particles)
+    np.testing.assert_array_equal(rows, np.repeat(np.arange(len(particles)), 14))
+    np.testing.assert_array_equal(expanded["symmetryOperator"], np.tile(np.arange(14), len(particles)))
+    np.testing.assert_allclose(vecs, particles2vecs(expanded, optics), atol=1e-9)
+    vecs, expanded, _ = symmetry_expand(particles, optics, "C1")
+    np.testing.assert_allclose(vecs, particles2vecs(particles, optics))
+    with pytest.raises(ValueError, match="Unknown symmetry"):
+        symmetry_expand(particles, optics, "X2")
+
+
+def test_group_indices():
+    values = pd.Series(["b", "a", "b", None, "c", "c", "a"])
+    groups = group_indices(values)
+    assert [value for value, _ in groups] == ["a", "b", "c"]
+    expected = {value: table.index.to_numpy() for value, table in values.to_frame("v").groupby("v")}
+    for value, rows in groups:
+        np.testing.assert_array_equal(np.arange(len(values))[rows], expected[value])
+    # Contiguous groups are returned as slices
+    assert groups[2][1] == slice(4, 6)
+
+
+def _random_vecs(n: int, size: float, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    vecs = np.zeros((n, 2, 3))
+    vecs[:, 0] = rng.uniform(0, size, (n, 3))
+    vecs[:, 1] = [1, 0, 0]
+    return vecs
+
+
+def test_remove_duplicates():
+    vecs = _random_vecs(1000, 100)
+    scores = np.random.default_rng(1).normal(size=1000)
+    scores[:10] = scores[10:20]
+    for distance in [3, 10]:
+        # Greedy non-maximum suppression, one particle at a time
+        expected = np.zeros(len(vecs), dtype=bool)
+        removed = np.zeros(len(vecs), dtype=bool)
+        for i in np.lexsort((np.arange(len(scores)), -scores)):
+            if not removed[i]:
+                expected[i] = True
+                removed[np.linalg.norm(vecs[:, 0] - vecs[i, 0], axis=1) <= distance] = True
+        np.testing.assert_array_equal(remove_duplicates(vecs, scores, distance), expected)
+
+
+def test_neighbor_queries():
+    vecs = _random_vecs(500, 50)
+    distances = np.linalg.norm(vecs[:, None, 0] - vecs[None, :, 0], axis=-1)
+    np.fill_diagonal(distances, np.inf)
+    np.testing.assert_array_equal(neighbor_counts(vecs, 5), (distances <= 5).sum(axis=1))
+    np.testing.assert_allclose(nearest_neighbor_distances(vecs), distances.min(axis=1))
+
+
+def test_spatial_grid_sample():
+    coords = _random_vecs(5000, 100)[:, 0]
+    grid = SpatialGrid(coords, cells_per_axis=8)
+    np.testing.assert_array_equal(grid.sample(10_000), np.arange(5000))
+    small = grid.sample(1000)
+    assert len(small) == 1000
+    # A larger budget refines the sample instead of drawing a new one
+    assert np.isin(small, grid.sample(2000)).all()
+    # Only particles in cells overlapping the box are sampled
+    low, high = np.array([0, 0, 0]), np.array([30, 30, 30])
+    inside = grid.sample(100, low, high)
+    assert len(inside) == 100
+    assert (coords[inside] <= 100 * 4 / 8).all()
@@ -0,0 +1,80 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import starfile
+
+from napari_starfile import utils
+from napari_starfile._watch import GrowingLayerData, StarTail
+from napari_starfile._widget import WatchWidget
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+
+
+def _split_lines(path: Path) -> tuple[str, list[str]]:
+    """Returns the text of a STAR file up to its first particle row, and the particle rows."""
+    lines = path.read_text().splitlines(keepends=True)
+    # The particles loop is the last one in the file
+    loops = [i for i, line in enumerate(lines) if line.startswith("loop_")]
+    first_row = next(i for i in range(loops[-1] + 1, len(lines)) if not lines[i].startswith("_"))
+    rows = [line for line in lines[first_row:] if line.strip()]
+    return "".join(lines[:first_row]), rows
+
+
+def test_star_tail(tmp_path):
+    header, rows = _split_lines(DATA_DIR / "example_particles_with_optics.star")
+    expected = starfile.read(DATA_DIR / "example_particles_with_optics.star")["particles"]
+    path = tmp_path / "growing.star"
+    # Header and a partially written row
+    path.write_text(header + "".join(rows[:10]) + rows[10][:5])
+    tail = StarTail(path)
+    vecs, particles, optics = tail.read()
+    assert len(particles) == 10
+    assert optics is not None
+    assert tail.poll() is None
+    data = GrowingLayerData(vecs, particles)
+    # Finish the row and append more
+    with open(path, "a") as f:
+        f.write(rows[10][5:] + "".join(rows[11:100]))
+    update = tail.poll()
+    assert not update.reloaded
+    assert len(update.particles) == 90
+    data.append(update.vecs, update.particles)
+    with open(path, "a") as f:
+        f.write("".join(rows[100:]))
+    update = tail.poll()
+    data.append(update.vecs, update.particles)
+    np.testing.assert_allclose(data.vecs, utils.particles2vecs(expected, optics))
+    pd.testing.assert_series_equal(data.features["rlnAngleTilt"], expected["rlnAngleTilt"])
+    assert list(data.features["rlnMicrographName"].astype(str)) == list(expected["rlnMicrographName"])
+    # Rewriting the file with fewer rows reloads it
+    path.write_text(header + "".join(rows[:5]))
+    update = tail.poll()
+    assert update.reloaded
+    assert len(update.particles) == 5
+
+
+def test_watch_widget(make_napari_viewer, qtbot, tmp_path):
+    viewer = make_napari_viewer()
+    header, rows = _split_lines(DATA_DIR / "example_particles_with_optics.star")
+    expected = starfile.read(DATA_DIR / "example_particles_with_optics.star")["particles"]
+    path = tmp_path / "growing.star"
+    path.write_text(header + "".join(rows[:20]))
+    widget = WatchWidget(viewer)
+    widget.start(path)
+    qtbot.waitUntil(lambda: widget._worker is None)
+    layer = viewer.layers["growing"]
+    assert len(layer.data) == 20
+    assert "optics" in layer.metadata
+    with open(path, "a") as f:
+        f.write("".join(rows[20:50]))
+    widget.poll()
+    qtbot.waitUntil(lambda: widget._worker is None)
+    assert len(layer.data) == 50
+    assert len(layer.features) == 50
+    assert list(layer.features["rlnMicrographName"].astype(str)) == list(expected["rlnMicrographName"][:50])
+    np.testing.assert_allclose(layer.features["rlnAngleTilt"], expected["rlnAngleTilt"][:50])
+    np.testing.assert_allclose(
+        layer.metadata[utils.ORIENTATIONS_METADATA_KEY], utils.euler2quat(expected[:50]), atol=1e-6
+    )
+    widget.stop()
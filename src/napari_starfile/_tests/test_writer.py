@@ -1,7 +1,245 @@
-# from napari_starfile import write_single_image, write_multiple
+from pathlib import Path
 
-# add your tests here...
+import numpy as np
+import pandas as pd
+import pytest
+import starfile
+
+import napari_starfile
+from napari_starfile import utils
+from napari_starfile._profiling import disable_profiling, enable_profiling
+from napari_starfile._reader import read_stars
+from napari_starfile._star_writer import write_star
+from napari_starfile._writer import (
+    write_star_relion3,
+    write_star_relion5,
+    write_starz,
+    write_star_relion31,
+)
+
+DATA_DIR = Path(__file__).parent.parent / "data"
 
 
 def test_something():
     pass
+
+
+def _tomograms(name: str = "example_particles_with_optics") -> pd.DataFrame:
+    """Global table of a Relion 5 tomograms.star, with a tilt-series pixel size unlike the particles' one."""
+    return pd.DataFrame(
+        {
+            "rlnTomoName": [name, "other"],
+            "rlnTomoSizeX": [4000, 2000],
+            "rlnTomoSizeY": [4000, 2000],
+            "rlnTomoSizeZ": [1000, 500],
+            "rlnTomoTiltSeriesPixelSize": [1.0, 2.0],
+        }
+    )
+
+
+def _read_body(path) -> list[str]:
+    # Skip the header line, it contains the time of writing
+    return Path(path).read_text().splitlines()[1:]
+
+
+@pytest.mark.parametrize("writer", [write_star_relion3, write_star_relion31])
+def test_write_compact_features(tmp_path, writer):
+    path = DATA_DIR / "example_particles_with_optics.star"
+    (vecs, kwargs, layer_type), = read_stars(path)
+    (compact_vecs, compact_kwargs, _), = read_stars(path, compact=True)
+    assert compact_kwargs["metadata"]["features_bytes_saved"] > 0
+    writer(str(tmp_path / "full.star"), [(vecs, kwargs, layer_type)])
+    writer(str(tmp_path / "compact.star"), [(compact_vecs, compact_kwargs, layer_type)])
+    assert _read_body(tmp_path / "full.star") == _read_body(tmp_path / "compact.star")
+
+
+def test_write_star_matches_starfile(tmp_path):
+    star = starfile.read(DATA_DIR / "example_particles_with_optics.star")
+    first = star["particles"]
+    second = first.copy()
+    second["rlnCoordinateX"] = np.nan
+    second.loc[3, "rlnImageName"] = "with space"
+    second.loc[4, "rlnImageName"] = ""
+    second["rlnClassNumber"] = second["rlnClassNumber"].astype(float)
+    second["rlnMicrographName"] = second["rlnMicrographName"].astype("category")
+    second["extra"] = 1
+    starfile.write(
+        {"optics": star["optics"], "particles": pd.concat([first, second], ignore_index=True, join="inner")},
+        tmp_path / "starfile.star",
+    )
+    write_star(tmp_path / "streaming.star", {"optics": star["optics"], "particles": [first, second]}, chunksize=100)
+    assert _read_body(tmp_path / "starfile.star") == _read_body(tmp_path / "streaming.star")
+
+
+def test_write_star_relion5_roundtrip(tmp_path):
+    (vecs, kwargs, layer_type), = read_stars(DATA_DIR / "example_particles_with_optics.star")
+    features = kwargs["features"]
+    layers = []
+    for i, (name, table) in enumerate(features.groupby(features.index % 3)):
+        table = table.drop(columns=["rlnMicrographName"]).assign(rlnTomoSizeX=1000 + i, rlnTomoSizeY=1200, rlnTomoSizeZ=300)
+        layers.append((vecs[table.index], {**kwargs, "name": f"tomo {name}", "features": table.reset_index(drop=True)}, layer_type))
+    path, = write_star_relion5(str(tmp_path / "relion5"), layers)
+    star = starfile.read(path, always_dict=True)
+    assert list(star) == ["general", "optics", "particles"]
+    assert star["general"] == {"rlnTomoSubTomosAre2DStacks": 1}
+    particles = star["particles"]
+    assert "rlnCoordinateX" not in particles.columns
+    assert set(particles["rlnTomoName"]) == {"tomo_0", "tomo_1", "tomo_2"}
+    table = layers[1][1]["features"]
+    expected = (table["rlnCoordinateX"] - 1001 / 2) * table["rlnPixelSize"]
+    centered = particles.loc[particles["rlnTomoName"] == "tomo_1", "rlnCenteredCoordinateXAngst"]
+    np.testing.assert_allclose(centered, expected, atol=1e-5)
+    (read_vecs, read_kwargs, _), = read_stars(path)
+    expected_vecs = np.concatenate([layer[0] for layer in layers])
+    np.testing.assert_allclose(read_vecs, expected_vecs, atol=1e-4)
+    # Writing the Relion 5 layer again keeps the centered coordinates
+    path2, = write_star_relion5(str(tmp_path / "relion5_again.star"), [(read_vecs, read_kwargs, "vectors")])
+    assert _read_body(path) == _read_body(path2)
+
+
+def test_write_star_relion5_tomograms(tmp_path):
+    (vecs, kwargs, layer_type), = read_stars(DATA_DIR / "example_particles_with_optics.star")
+    features = kwargs["features"]
+    layers = [(vecs, kwargs, layer_type)]
+    # The tomogram sizes are needed to center the coordinates
+    with pytest.raises(ValueError, match="Tomogram sizes unknown"):
+        write_star_relion5(str(tmp_path / "unknown"), layers)
+    tomograms_path = tmp_path / "tomograms.star"
+    (tmp_path / "relion5").mkdir()
+    starfile.write({"global": _tomograms()}, tomograms_path)
+    path, = write_star_relion5(str(tmp_path / "relion5" / "particles"), layers, tomograms=tomograms_path)
+    particles = starfile.read(path)["particles"]
+    # Coordinates in Angstrom from the tomogram center, which is in pixels of the tilt series
+    expected = features[utils.COORDINATE_COLUMNS].to_numpy() * features["rlnPixelSize"].to_numpy()[:, None] - [2000.0, 2000.0, 500.0]
+    np.testing.assert_allclose(particles[utils.CENTERED_COORDINATE_COLUMNS].to_numpy(), expected, atol=1e-4)
+    # Reading the Relion 5 file needs the tomograms as well
+    with pytest.raises(ValueError, match="Tomogram sizes unknown"):
+        read_stars(path)
+    (read_vecs, read_kwargs, _), = read_stars(path, tomograms=tomograms_path)
+    pd.testing.assert_frame_equal(read_kwargs["metadata"]["tomograms"], _tomograms(), check_dtype=False)
+    # In pixels of the tilt series
+    expected_vecs = vecs.copy()
+    expected_vecs[:, 0] = (vecs[:, 0] * features["rlnPixelSize"].to_numpy()[:, None])
+    np.testing.assert_allclose(read_vecs, expected_vecs, atol=1e-4)
+    # The tomograms.star of a Relion 5 project is found from the optimisation set next to the particles
+    project = tmp_path / "relion5"
+    (project / "Tomograms" / "job003").mkdir(parents=True)
+    tomograms_path.rename(project / "Tomograms" / "job003" / "tomograms.star")
+    (project / "Extract" / "job010").mkdir(parents=True)
+    Path(path).rename(project / "Extract" / "job010" / "particles.star")
+    (project / "Extract" / "job010" / "optimisation_set.star").write_text(
+        "data_\n\n_rlnTomoParticlesFile Extract/job010/particles.star\n_rlnTomoTomogramsFile Tomograms/job003/tomograms.star\n"
+    )
+    (found_vecs, found_kwargs, _), = read_stars(project / "Extract" / "job010" / "particles.star")
+    np.testing.assert_allclose(found_vecs, read_vecs)
+    # Writing again keeps the centered coordinates
+    path2, = write_star_relion5(str(tmp_path / "again"), [(found_vecs, found_kwargs, "vectors")])
+    np.testing.assert_allclose(starfile.read(path2)["particles"][utils.CENTERED_COORDINATE_COLUMNS].to_numpy(), expected, atol=1e-4)
+
+
+def test_write_star_relion5_keeps_columns(tmp_path):
+    (vecs, kwargs, _), = read_stars(DATA_DIR / "example_particles_with_optics.star")
+    path, = write_star_relion5(str(tmp_path / "relion5"), [(vecs, {**kwargs, "name": "layer"}, "vectors")], tomograms=_tomograms("layer"))
+    star = starfile.read(path, always_dict=True)
+    assert list(star) == ["general", "optics", "particles"]
+    pd.testing.assert_series_equal(star["particles"]["rlnMicrographName"], kwargs["features"]["rlnMicrographName"], check_dtype=False)
+    assert "rlnMicrographName" in kwargs["features"] and (kwargs["features"]["rlnMicrographName"] != "layer").all()
+    # The general block is read into the layer metadata and written back
+    (read_vecs, read_kwargs, _), = read_stars(path, tomograms=_tomograms("layer"))
+    read_kwargs["metadata"]["general"]["rlnTomoSubTomosAre2DStacks"] = 0
+    path, = write_star_relion5(str(tmp_path / "again"), [(read_vecs, read_kwargs, "vectors")])
+    assert starfile.read(path, always_dict=True)["general"] == {"rlnTomoSubTomosAre2DStacks": 0}
+
+
+def test_write_profiling(tmp_path):
+    (vecs, kwargs, _), = read_stars(DATA_DIR / "example_particles_with_optics.star")
+    records = []
+    enable_profiling(callback=records.append)
+    try:
+        write_star_relion31(str(tmp_path / "out.star"), [(vecs, {**kwargs, "name": "layer"}, "vectors")])
+    finally:
+        disable_profiling()
+    stages = [record.stage for record in records]
+    assert stages[-1] == "write_star_relion31"
+    assert {"layer2particles", "write_block_particles", "write_block_optics"} <= set(stages)
+    assert all(record.peak_bytes is None for record in records)
+
+
+def test_write_changed_rows_only(tmp_path):
+    (vecs, kwargs, _), = read_stars(DATA_DIR / "example_particles_with_optics.star")
+    original = kwargs["features"]
+    assert kwargs["metadata"]["orientations"].dtype == np.float32
+    vecs = vecs.copy()
+    vecs[0, 0] += [1.0, 2.0, 3.0]
+    vecs[1, 1] = [0.0, 0.6, 0.8]
+    path = str(tmp_path / "changed.star")
+    write_star_relion31(path, [(vecs, {**kwargs, "name": "layer"}, "vectors")])
+    written = starfile.read(path)["particles"]
+    # Unchanged rows are written as read
+    for col in ["rlnCoordinateX", "rlnCoordinateY", "rlnCoordinateZ", "rlnAngleRot", "rlnAngleTilt", "rlnAnglePsi"]:
+        np.testing.assert_array_equal(written[col].to_numpy()[2:], original[col].to_numpy()[2:])
+    # The moved row keeps its angles and has shifted coordinates
+    np.testing.assert_allclose(
+        written.loc[0, ["rlnCoordinateX", "rlnCoordinateY", "rlnCoordinateZ"]].to_numpy(dtype=float),
+        original.loc[0, ["rlnCoordinateX", "rlnCoordinateY", "rlnCoordinateZ"]].to_numpy(dtype=float) + [3.0, 2.0, 1.0],
+        atol=1e-5,
+    )
+    # The rotated row points in the new direction
+    np.testing.assert_allclose(utils.euler2vec(written.iloc[[1]]), [[0.0, 0.6, 0.8]], atol=1e-5)
+    # Rereading gives the edited vectors
+    (reread, _, _), = read_stars(path)
+    np.testing.assert_allclose(reread, vecs, atol=1e-4)
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_write_starz(tmp_path, lazy):
+    pytest.importorskip("pyarrow")
+    (vecs, kwargs, _), = read_stars(DATA_DIR / "example_particles_with_optics.star", lazy=lazy)
+    layers = [(vecs, {**kwargs, "name": "a"}, "vectors"), (vecs[:10], {**kwargs, "name": "b", "features": kwargs["features"].iloc[:10]}, "vectors")]
+    if lazy:
+        layers[1][1]["metadata"] = utils.slice_metadata(kwargs["metadata"], slice(0, 10))
+    assert write_starz(str(tmp_path / "out"), layers) == [str(tmp_path / "out.starz")]
+    write_star_relion31(str(tmp_path / "out.star"), layers)
+    (starz_vecs, starz_kwargs, _), = read_stars(tmp_path / "out.starz")
+    (star_vecs, star_kwargs, _), = read_stars(tmp_path / "out.star")
+    # The vectors are memory-mapped from the file
+    assert not starz_vecs.flags.writeable
+    np.testing.assert_array_equal(starz_vecs, star_vecs)
+    pd.testing.assert_frame_equal(starz_kwargs["features"], star_kwargs["features"])
+    pd.testing.assert_frame_equal(starz_kwargs["metadata"]["optics"], star_kwargs["metadata"]["optics"])
+    # Saving the starz layer gives the same starfile as saving the starfile layer
+    write_star_relion31(str(tmp_path / "from_starz.star"), [(starz_vecs, starz_kwargs, "vectors")])
+    write_star_relion31(str(tmp_path / "from_star.star"), [(star_vecs, star_kwargs, "vectors")])
+    assert _read_body(tmp_path / "from_starz.star") == _read_body(tmp_path / "from_star.star")
+
+
+@pytest.mark.parametrize("writer", [write_star_relion3, write_star_relion31])
+def test_write_conflicting_optics(tmp_path, writer, caplog):
+    (vecs, kwargs, _), = read_stars(DATA_DIR / "example_particles_with_optics.star")
+    optics = kwargs["metadata"]["optics"]
+    other = optics.assign(rlnImagePixelSize=optics["rlnImagePixelSize"] * 2)
+    layers = [
+        (vecs, {**kwargs, "name": "a"}, "vectors"),
+        (vecs, {**kwargs, "name": "b", "metadata": {**kwargs["metadata"], "optics": optics.copy()}}, "vectors"),
+        (vecs, {**kwargs, "name": "c", "metadata": {**kwargs["metadata"], "optics": other}}, "vectors"),
+    ]
+    with caplog.at_level("INFO", logger="napari_starfile._writer"), pytest.warns(UserWarning, match="renumbered 1 optics groups"):
+        path, = writer(str(tmp_path / "out"), layers)
+    assert "2 optics groups from 3 optics tables (2 distinct), 1 renumbered" in caplog.text
+    star = starfile.read(path, always_dict=True)
+    particles = star["particles"] if "particles" in star else star[""]
+    groups = particles["rlnOpticsGroup"].to_numpy()
+    np.testing.assert_array_equal(groups, np.repeat([1, 1, 2], len(vecs)))
+    if writer is write_star_relion31:
+        np.testing.assert_array_equal(star["optics"]["rlnOpticsGroup"], [1, 2])
+    (read_vecs, _, _), = read_stars(path)
+    np.testing.assert_allclose(read_vecs[2 * len(vecs):, 0], vecs[:, 0], atol=1e-4)
+
+
+def test_write_header_and_empty(tmp_path):
+    (vecs, kwargs, _), = read_stars(DATA_DIR / "example_particles_with_optics.star")
+    path, = write_star_relion31(str(tmp_path / "out"), [(vecs, kwargs, "vectors")])
+    assert Path(path).read_text().startswith(f"# Created by napari-starfile (version {napari_starfile.__version__})")
+    with pytest.raises(ValueError, match="no layers"):
+        write_star_relion31(str(tmp_path / "empty"), [])
+    assert not (tmp_path / "empty.star").exists()
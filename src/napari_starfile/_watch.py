@@ -0,0 +1,213 @@
+"""Following STAR files that are still being written, e.g. by a running Relion job.
+
+:class:`StarTail` remembers the byte offset of the last parsed particle row and on every
+:meth:`StarTail.poll` parses only the complete rows appended since. Changes before that offset
+(the file was rewritten or truncated) are detected from the file size and digests of the header
+and of the last parsed bytes, and trigger a full reload.
+
+:class:`GrowingLayerData` holds the vectors and features with spare capacity, so appending
+new rows costs amortized O(new rows) instead of copying everything read so far. Handing them to
+the napari layer still costs O(all rows) per update, as layers can only be replaced as a whole.
+Polling only reads the file, so it can run in a background thread while the layer is updated in the GUI thread.
+"""
+import hashlib
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from napari_starfile import utils
+from napari_starfile._parser import LoopBlock, iter_loop_chunks, read_loop_chunked, scan_appended_rows, scan_blocks
+
+# Number of bytes before the end of the parsed rows that are compared to detect rewrites
+TAIL_DIGEST_BYTES = 4096
+
+
+@dataclass
+class TailUpdate:
+    """Particles read by :meth:`StarTail.poll`. If ``reloaded``, they replace everything read before,
+    otherwise they were appended to the file."""
+    vecs: np.ndarray
+    particles: pd.DataFrame
+    optics: pd.DataFrame | None
+    reloaded: bool
+    # Orientations of the particles as quaternions, if they have angles
+    quats: np.ndarray | None = None
+
+    def __post_init__(self):
+        if self.quats is None and all(col in self.particles.columns for col in utils.ANGLE_COLUMNS):
+            self.quats = utils.euler2quat(self.particles)
+
+
+def _digest(path: str | Path, start: int, end: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return hashlib.blake2b(f.read(end - start), digest_size=16).digest()
+
+
+class StarTail:
+    """Incremental reader of the particles loop of a STAR file that grows at the end."""
+
+    def __init__(self, path: str | Path, chunksize: int = 100_000, tomograms: pd.DataFrame | None = None):
+        self.path = Path(path)
+        self.chunksize = chunksize
+        # Tomogram sizes for Relion 5 centered coordinates, see utils.tomogram_sizes
+        self.tomograms = tomograms
+        self.optics: pd.DataFrame | None = None
+        self._block: LoopBlock | None = None
+        # Whether another block follows the particles, so nothing more can be appended to them
+        self._ended = False
+        self._stat: os.stat_result | None = None
+        self._header_digest = b""
+        self._tail_digest = b""
+
+    def read(self) -> tuple[np.ndarray, pd.DataFrame, pd.DataFrame | None]:
+        """Reads all complete particle rows and starts following the file from there."""
+        stat = self.path.stat()
+        blocks = scan_blocks(self.path, complete_lines=True)
+        if "particles" in blocks:
+            block = blocks["particles"]
+        elif "" in blocks:
+            block = blocks[""]
+        else:
+            raise ValueError("No particles in star file")
+        self.optics = read_loop_chunked(self.path, blocks["optics"], self.chunksize) if "optics" in blocks else None
+        particles = read_loop_chunked(self.path, block, self.chunksize)
+        self._ended = any(other.start > block.start for other in blocks.values())
+        self._track(block, stat)
+        return utils.particles2vecs(particles, self.optics, self.tomograms), particles, self.optics
+
+    def _track(self, block: LoopBlock, stat: os.stat_result):
+        self._block = block
+        self._stat = stat
+        self._header_digest = _digest(self.path, 0, block.start)
+        self._tail_digest = _digest(self.path, max(block.start, block.end - TAIL_DIGEST_BYTES), block.end)
+
+    def _rewritten(self, stat: os.stat_result) -> bool:
+        block = self._block
+        if stat.st_ino != self._stat.st_ino or stat.st_size < block.end:
+            return True
+        return (
+            _digest(self.path, 0, block.start) != self._header_digest
+            or _digest(self.path, max(block.start, block.end - TAIL_DIGEST_BYTES), block.end) != self._tail_digest
+        )
+
+    def poll(self) -> TailUpdate | None:
+        """Returns the particles appended since the last call, all particles if the file was rewritten,
+        or None if nothing changed."""
+        if self._block is None:
+            return TailUpdate(*self.read(), reloaded=True)
+        stat = self.path.stat()
+        if (stat.st_ino, stat.st_size, stat.st_mtime_ns) == (self._stat.st_ino, self._stat.st_size, self._stat.st_mtime_ns):
+            return None
+        if self._rewritten(stat):
+            return TailUpdate(*self.read(), reloaded=True)
+        if self._ended:
+            self._stat = stat
+            return None
+        appended, ended = scan_appended_rows(self.path, self._block)
+        if ended and self._block.n_rows == 0:
+            # The loop header was still being written when it was scanned
+            return TailUpdate(*self.read(), reloaded=True)
+        self._ended = ended
+        if appended.n_rows == 0:
+            self._stat = stat
+            return None
+        chunks = list(iter_loop_chunks(self.path, appended, self.chunksize))
+        particles = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+        block = LoopBlock(
+            name=self._block.name,
+            columns=self._block.columns,
+            start=self._block.start,
+            end=appended.end,
+            n_rows=self._block.n_rows + appended.n_rows,
+        )
+        self._track(block, stat)
+        return TailUpdate(utils.particles2vecs(particles, self.optics, self.tomograms), particles, self.optics, reloaded=False)
+
+
+class GrowingLayerData:
+    """Vectors and feature columns in buffers with spare capacity that grow by doubling.
+    Non-numeric columns are stored as categorical codes."""
+
+    def __init__(self, vecs: np.ndarray, features: pd.DataFrame, quats: np.ndarray | None = None):
+        self.n_rows = 0
+        self._vecs = np.empty((0, 2, 3))
+        self._quats = None if quats is None else np.empty((0, 4), dtype=np.float32)
+        self._columns: dict[str, np.ndarray] = {}
+        # Value-to-code mappings and values of the categorical columns, in code order
+        self._codes: dict[str, dict] = {}
+        self._categories: dict[str, list] = {}
+        for name in features.columns:
+            if features[name].dtype.kind in "biuf":
+                self._columns[name] = np.empty(0, dtype=features[name].dtype)
+            else:
+                self._columns[name] = np.empty(0, dtype=np.int32)
+                self._codes[name] = {}
+                self._categories[name] = []
+        self.append(vecs, features, quats)
+
+    def _reserve(self, n_rows: int):
+        capacity = len(self._vecs)
+        if n_rows <= capacity:
+            return
+        capacity = max(n_rows, 2 * capacity, 1024)
+        vecs = np.empty((capacity, *self._vecs.shape[1:]), dtype=self._vecs.dtype)
+        vecs[:self.n_rows] = self._vecs[:self.n_rows]
+        self._vecs = vecs
+        if self._quats is not None:
+            quats = np.empty((capacity, 4), dtype=self._quats.dtype)
+            quats[:self.n_rows] = self._quats[:self.n_rows]
+            self._quats = quats
+        for name, values in self._columns.items():
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[:self.n_rows] = values[:self.n_rows]
+            self._columns[name] = grown
+
+    def _encode(self, name: str, values: pd.Series) -> np.ndarray:
+        codes = self._codes[name]
+        for value in pd.unique(values.dropna()):
+            if value not in codes:
+                codes[value] = len(codes)
+                self._categories[name].append(value)
+        return values.map(codes).fillna(-1).to_numpy(dtype=np.int32)
+
+    def append(self, vecs: np.ndarray, features: pd.DataFrame, quats: np.ndarray | None = None):
+        start = self.n_rows
+        stop = start + len(vecs)
+        self._reserve(stop)
+        self._vecs[start:stop] = vecs
+        if self._quats is not None:
+            self._quats[start:stop] = quats
+        for name, target in self._columns.items():
+            if name in self._codes:
+                target[start:stop] = self._encode(name, features[name])
+                continue
+            values = features[name].to_numpy()
+            if np.result_type(target.dtype, values.dtype) != target.dtype:
+                # e.g. an int column that turns out to contain floats further down
+                target = self._columns[name] = target.astype(np.result_type(target.dtype, values.dtype))
+            target[start:stop] = values
+        self.n_rows = stop
+
+    @property
+    def vecs(self) -> np.ndarray:
+        return self._vecs[:self.n_rows]
+
+    @property
+    def quats(self) -> np.ndarray | None:
+        return None if self._quats is None else self._quats[:self.n_rows]
+
+    @property
+    def features(self) -> pd.DataFrame:
+        columns = {}
+        for name, values in self._columns.items():
+            if name in self._codes:
+                columns[name] = pd.Categorical.from_codes(
+                    values[:self.n_rows], categories=self._categories[name], validate=False
+                )
+            else:
+                columns[name] = values[:self.n_rows]
+        return pd.DataFrame(columns, copy=False)
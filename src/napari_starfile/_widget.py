@@ -2,32 +2,105 @@
 - Widget specification: https://napari.org/stable/plugins/building_a_plugin/guides.html#widgets
 - magicgui docs: https://pyapp-kit.github.io/magicgui/
 """
+import weakref
+from functools import partial
 from typing import TYPE_CHECKING, List, Optional
 
-from magicgui.widgets import Container, create_widget, RadioButtons, ComboBox, Select, RangeSlider, PushButton
-from magicgui.tqdm import tqdm
+from magicgui.widgets import Container, create_widget, RadioButtons, ComboBox, Select, FileEdit, FloatRangeSlider, FloatSpinBox, LineEdit, PushButton, SpinBox
 import numpy as np
+import pandas as pd
+from qtpy.QtCore import QTimer
 
 from napari_starfile import utils
+from napari_starfile._reader import find_tomograms_file, read_tomograms
+from napari_starfile._watch import GrowingLayerData, StarTail, TailUpdate
 
 if TYPE_CHECKING:
     import napari
+    from scipy.spatial import cKDTree
+
+
+class SortedIndex:
+    """Sorted view of a numeric column that selects a value range incrementally.
+    Moving the range only touches the rows that enter or leave it instead of comparing every value."""
+
+    def __init__(self, values: np.ndarray):
+        self.order = np.argsort(values, kind="stable")
+        self.sorted_values = values[self.order]
+        # Initially everything is selected
+        self.start = 0
+        self.stop = len(values)
+        self.mask = np.ones(len(values), dtype=bool)
+
+    def select(self, low: float, high: float) -> np.ndarray:
+        """Selects the rows with ``low <= value <= high`` and returns the rows whose membership changed."""
+        start = int(np.searchsorted(self.sorted_values, low, side="left"))
+        stop = max(start, int(np.searchsorted(self.sorted_values, high, side="right")))
+        if stop <= self.start or self.stop <= start:
+            # Old and new range do not overlap
+            positions = [np.arange(self.start, self.stop), np.arange(start, stop)]
+        else:
+            positions = [
+                np.arange(min(start, self.start), max(start, self.start)),
+                np.arange(min(stop, self.stop), max(stop, self.stop)),
+            ]
+        changed = self.order[np.concatenate(positions)]
+        self.mask[changed] = ~self.mask[changed]
+        self.start, self.stop = start, stop
+        return changed
+
+
+class CategoryIndex:
+    """Integer codes of a discrete column, so that any selection of values is matched in a single pass."""
+
+    def __init__(self, values: np.ndarray):
+        self.codes, uniques = pd.factorize(values, sort=True)
+        self.choices = list(uniques)
+        self._positions = pd.Index(uniques)
+
+    def mask(self, selected) -> np.ndarray:
+        """Returns which rows have one of the ``selected`` values."""
+        # One extra entry for missing values, which have code -1
+        lookup = np.zeros(len(self.choices) + 1, dtype=bool)
+        positions = self._positions.get_indexer(list(selected))
+        lookup[positions[positions >= 0]] = True
+        return lookup[self.codes]
+
+
+def lazy_column_names(layer: "napari.layers.Layer") -> list[str]:
+    """Returns the feature columns of a layer that the out-of-core reader left on disk."""
+    store = layer.metadata.get(utils.LAZY_COLUMNS_METADATA_KEY)
+    return [] if store is None else store.columns
 
 
 class FilterWidget(Container):
+    # Delay before a slider or selection change is applied, so that dragging a slider does not update on every tick
+    debounce_ms = 30
+
     def __init__(self, parent: "SubsetSelectorWidget"):
         super().__init__()
         self.parent = parent
         self._points_layer = None
+        self._index: SortedIndex | None = None
+        self._mask: np.ndarray | None = None
+        # Factorized discrete columns of the current layer, by column name
+        self._categories: dict[str, CategoryIndex] = {}
+        # "discrete" or "range" once a property is selected. Tracked separately from widget
+        # visibility, which is also False while the whole widget is hidden
+        self._mode: str | None = None
         # use create_widget to generate widgets from type annotations
         self.cb_filter_property = ComboBox(choices=[], nullable=True)
         self.cb_filter_property.changed.connect(self.on_cb_filter_property_changed)
         self.cb_discrete_filter = Select(choices=[], allow_multiple=True)
         self.cb_discrete_filter.changed.connect(self.on_filter_changed)
-        self.rs_float_filter = RangeSlider()
+        self.rs_float_filter = FloatRangeSlider()
         self.rs_float_filter.changed.connect(self.on_filter_changed)
         self.cb_discrete_filter.visible = False
         self.rs_float_filter.visible = False
+        self._debounce_timer = QTimer()
+        self._debounce_timer.setSingleShot(True)
+        self._debounce_timer.setInterval(self.debounce_ms)
+        self._debounce_timer.timeout.connect(self.apply_filter)
 
         self.extend(
             [
@@ -44,50 +117,110 @@ class FilterWidget(Container):
     @points_layer.setter
     def points_layer(self, layer: Optional["napari.layers.Points"]):
         self._points_layer = layer
+        self._index = None
+        self._mask = None
+        self._mode = None
+        self._categories = {}
         if layer is None:
             self.cb_filter_property.choices = []
             self.cb_discrete_filter.visible = False
             self.rs_float_filter.visible = False
         else:
-            self.cb_filter_property.choices = list(layer.properties.keys())
+            self.cb_filter_property.choices = list(layer.properties.keys()) + [
+                name for name in lazy_column_names(layer) if name not in layer.properties
+            ]
 
     def on_filter_changed(self):
-        if self.parent is not None:
-            self.parent.update_mask()
+        self._debounce_timer.start()
+
+    def apply_filter(self):
+        """Updates the cached mask and passes the rows that changed on to the parent."""
+        self._debounce_timer.stop()
+        changed = self.update_mask()
+        if self.parent is not None and changed is not None:
+            self.parent.on_filter_mask_changed(self, changed)
+
+    def update_mask(self) -> Optional[np.ndarray]:
+        """Updates the cached mask to the current filter values and returns the indices of the rows that changed."""
+        if self.points_layer is None:
+            return None
+        if self._index is not None and self._mode == "range":
+            return self._index.select(*self.rs_float_filter.value)
+        old_mask = self._mask
+        self._mask = self._compute_mask()
+        if old_mask is None:
+            return np.arange(len(self._mask))
+        return np.flatnonzero(old_mask != self._mask)
 
     def get_mask(self) -> Optional[np.ndarray]:
         if self.points_layer is None:
             return None
+        if self._index is not None and self._mode == "range":
+            return self._index.mask
+        if self._mask is None:
+            self._mask = self._compute_mask()
+        return self._mask
+
+    def _compute_mask(self) -> np.ndarray:
         filter_column = self.cb_filter_property.value
-        if filter_column is None:
+        if filter_column is None or self._mode is None:
             return np.ones(len(self.points_layer.data), dtype=bool)
-        if self.cb_discrete_filter.visible:
-            mask = np.zeros(len(self.points_layer.data), dtype=bool)
-            for val in self.cb_discrete_filter.value:
-                mask |= self.points_layer.properties[filter_column] == val
-            return mask
-        if self.rs_float_filter.visible:
-            return (self.points_layer.properties[filter_column] >= self.rs_float_filter.value[0]) & (self.points_layer.properties[filter_column] <= self.rs_float_filter.value[1])
-        raise ValueError("No filter is visible")
+        if self._mode == "discrete":
+            return self._category_index(filter_column).mask(self.cb_discrete_filter.value)
+        if self._mode == "range":
+            values = self._column_values(filter_column)
+            return (values >= self.rs_float_filter.value[0]) & (values <= self.rs_float_filter.value[1])
+        raise ValueError(f"Unknown filter mode: {self._mode}")
+
+    def _category_index(self, column: str) -> CategoryIndex:
+        if column not in self._categories:
+            self._categories[column] = CategoryIndex(self._column_values(column))
+        return self._categories[column]
+
+    def _column_values(self, column: str) -> np.ndarray:
+        if column in self.points_layer.properties:
+            return self.points_layer.properties[column]
+        # Columns left on disk by the out-of-core reader
+        return np.asarray(self.points_layer.metadata[utils.LAZY_COLUMNS_METADATA_KEY].column(column))
 
     def on_cb_filter_property_changed(self):
+        self._index = None
+        self._mask = None
+        self._mode = None
         filter_column = self.cb_filter_property.value
         if self.points_layer is None or filter_column is None:
+            if self.parent is not None:
+                self.parent.update_mask()
             return
-        values = self.points_layer.properties[filter_column]
-        if values.dtype in (int, "O"):
+        values = self._column_values(filter_column)
+        # Compact layers have e.g. int8 and float32 columns
+        if values.dtype.kind in "iubOU" or isinstance(values.dtype, pd.CategoricalDtype):
+            self._mode = "discrete"
             self.cb_discrete_filter.visible = True
             self.rs_float_filter.visible = False
-            self.cb_discrete_filter.choices = sorted(np.unique(values))
-        elif values.dtype == float:
+            self.cb_discrete_filter.choices = self._category_index(filter_column).choices
+        elif values.dtype.kind == "f":
+            self._mode = "range"
             self.cb_discrete_filter.visible = False
             self.rs_float_filter.visible = True
-            self.rs_float_filter.min = float(np.min(values))
-            self.rs_float_filter.max = float(np.max(values))
-            self.rs_float_filter.value = (self.rs_float_filter.min, self.rs_float_filter.max)
+            self._index = SortedIndex(values)
+            with self.rs_float_filter.changed.blocked():
+                self.rs_float_filter.min = float(np.min(values))
+                self.rs_float_filter.max = float(np.max(values))
+                self.rs_float_filter.value = (self.rs_float_filter.min, self.rs_float_filter.max)
+            self._index.select(*self.rs_float_filter.value)
+        if self.parent is not None:
+            self.parent.update_mask()
+
+
+# Layer metadata carried over to layers made of a subset of the rows
+SLICED_METADATA_KEYS = ("optics", "general", "tomograms", utils.ORIENTATIONS_METADATA_KEY, utils.LAZY_COLUMNS_METADATA_KEY)
 
 
 class SplitWidget(Container):
+    # Number of layers added to the viewer at once
+    batch_size = 20
+
     def __init__(self, viewer: "napari.viewer.Viewer"):
         super().__init__()
         self._viewer = viewer
@@ -95,16 +228,20 @@ class SplitWidget(Container):
         self.b_update_columns = PushButton(text="Update columns")
         self.cb_column = ComboBox(label="Column")
         self.b_split = PushButton(text="Split")
+        self.b_cancel = PushButton(text="Cancel", enabled=False)
+        self._worker = None
         # Signals
         self.cb_layer.changed.connect(self.on_layer_changed)
         self.b_update_columns.clicked.connect(self.on_layer_changed)
         self.b_split.clicked.connect(self.on_split_clicked)
+        self.b_cancel.clicked.connect(self.on_cancel_clicked)
         # Build
         self.extend([
             self.cb_layer,
             self.b_update_columns,
             self.cb_column,
             self.b_split,
+            self.b_cancel,
         ])
 
     def on_layer_changed(self):
@@ -112,7 +249,9 @@ class SplitWidget(Container):
         if layer is None:
             self.cb_column.choices = []
         else:
-            self.cb_column.choices = list(layer.features.columns)
+            self.cb_column.choices = list(layer.features.columns) + [
+                name for name in lazy_column_names(layer) if name not in layer.features.columns
+            ]
 
     def on_split_clicked(self):
         layer: "napari.layer.Vectors | None" = self.cb_layer.value
@@ -121,14 +260,414 @@ class SplitWidget(Container):
         column: str | None = self.cb_column.value
         if column is None or column == "":
             return
-        optics = layer.metadata.get("optics", None)
-        for value, table in tqdm(layer.features.groupby(column)):
-            vecs = utils.particles2vecs(table, optics)
-            extra_kwargs = {"name": value, "edge_color": "blue", "features": table}
-            if optics is not None:
-                extra_kwargs["metadata"] = {"optics": optics}
+        from napari.qt.threading import create_worker
+
+        metadata = {key: layer.metadata[key] for key in SLICED_METADATA_KEYS if key in layer.metadata}
+        vecs, layer_meta = utils.full_layer(layer.data, {"features": layer.features, "metadata": layer.metadata})
+        features = layer_meta["features"]
+        if column not in features.columns:
+            # Load just the column to split by from the out-of-core store
+            features = features.assign(**{column: layer.metadata[utils.LAZY_COLUMNS_METADATA_KEY].column(column)})
+        self._worker = create_worker(self._split, vecs, features, column, metadata)
+        self._worker.yielded.connect(self._add_layers)
+        self._worker.finished.connect(self._on_split_finished)
+        self.b_split.enabled = False
+        self.b_cancel.enabled = True
+        self._worker.start()
+
+    def _split(self, vecs: np.ndarray, features, column: str, metadata: dict | None):
+        """Runs in a background thread and yields the new layers in batches."""
+        batch = []
+        for layer_data in utils.split_layer(vecs, features, column, metadata):
+            batch.append(layer_data)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _add_layers(self, batch: list):
+        for vecs, extra_kwargs, _ in batch:
             self._viewer.add_vectors(vecs, **extra_kwargs)
 
+    def on_cancel_clicked(self):
+        if self._worker is not None:
+            self._worker.quit()
+
+    def _on_split_finished(self):
+        self._worker = None
+        self.b_split.enabled = True
+        self.b_cancel.enabled = False
+
+
+def set_full_features(layer: "napari.layers.Vectors", features: pd.DataFrame):
+    """Replaces the features of all vectors of a layer, keeping a level-of-detail subsample in sync."""
+    lod = layer.metadata.get(utils.LOD_METADATA_KEY)
+    if lod is None:
+        layer.features = features
+        return
+    lod["features"] = features
+    layer.features = features.iloc[lod["indices"]].reset_index(drop=True)
+
+
+# KD-trees of vectors layers, rebuilt when the layer's data array is replaced
+_spatial_indices: "weakref.WeakKeyDictionary[napari.layers.Vectors, tuple[np.ndarray, cKDTree]]" = weakref.WeakKeyDictionary()
+
+
+def spatial_index(layer: "napari.layers.Vectors") -> "cKDTree":
+    """Returns the KD-tree over the coordinates of a vectors layer, building it on first use."""
+    vecs, _ = utils.full_layer(layer.data, {"metadata": layer.metadata})
+    cached = _spatial_indices.get(layer)
+    if cached is not None and cached[0] is vecs:
+        return cached[1]
+    tree = utils.build_kdtree(vecs)
+    _spatial_indices[layer] = (vecs, tree)
+    return tree
+
+
+class SpatialWidget(Container):
+    def __init__(self, viewer: "napari.viewer.Viewer"):
+        super().__init__()
+        self._viewer = viewer
+        self.cb_layer = create_widget(label="Layer", annotation="napari.layers.Vectors")
+        self.sb_distance = FloatSpinBox(label="Distance", value=10.0, min=0.0, max=1e6)
+        self.cb_score = ComboBox(label="Keep best by", choices=[], nullable=True)
+        self.b_remove_duplicates = PushButton(text="Remove duplicates")
+        self.b_neighbor_counts = PushButton(text="Count neighbors within distance")
+        self.b_nearest_neighbor = PushButton(text="Nearest neighbor distance")
+        # Signals
+        self.cb_layer.changed.connect(self.on_layer_changed)
+        self.b_remove_duplicates.clicked.connect(self.on_remove_duplicates_clicked)
+        self.b_neighbor_counts.clicked.connect(self.on_neighbor_counts_clicked)
+        self.b_nearest_neighbor.clicked.connect(self.on_nearest_neighbor_clicked)
+        # Build
+        self.extend([
+            self.cb_layer,
+            self.sb_distance,
+            self.cb_score,
+            self.b_remove_duplicates,
+            self.b_neighbor_counts,
+            self.b_nearest_neighbor,
+        ])
+
+    def on_layer_changed(self):
+        layer: "napari.layer.Vectors | None" = self.cb_layer.value
+        if layer is None:
+            self.cb_score.choices = []
+        else:
+            self.cb_score.choices = [col for col in layer.features.columns if layer.features[col].dtype.kind in "biuf"]
+
+    def on_remove_duplicates_clicked(self):
+        """Adds a new layer without particles that are within the distance of a better scoring one."""
+        layer: "napari.layer.Vectors | None" = self.cb_layer.value
+        if layer is None:
+            return
+        column: str | None = self.cb_score.value
+        vecs, layer_meta = utils.full_layer(layer.data, {"features": layer.features, "metadata": layer.metadata})
+        features = layer_meta["features"]
+        # Without a score column, earlier rows win
+        scores = np.zeros(len(vecs)) if column is None else features[column].to_numpy()
+        keep = utils.remove_duplicates(vecs, scores, self.sb_distance.value, tree=spatial_index(layer))
+        extra_kwargs = {
+            "name": f"{layer.name} deduplicated",
+            "edge_color": "blue",
+            "features": features[keep].reset_index(drop=True),
+        }
+        metadata = {key: layer.metadata[key] for key in SLICED_METADATA_KEYS if key in layer.metadata}
+        if metadata:
+            extra_kwargs["metadata"] = utils.slice_metadata(metadata, keep)
+        self._viewer.add_vectors(vecs[keep], **extra_kwargs)
+
+    def on_neighbor_counts_clicked(self):
+        layer: "napari.layer.Vectors | None" = self.cb_layer.value
+        if layer is None:
+            return
+        vecs, layer_meta = utils.full_layer(layer.data, {"features": layer.features, "metadata": layer.metadata})
+        features = layer_meta["features"]
+        counts = utils.neighbor_counts(vecs, self.sb_distance.value, tree=spatial_index(layer))
+        set_full_features(layer, features.assign(neighborCount=counts))
+        self.on_layer_changed()
+
+    def on_nearest_neighbor_clicked(self):
+        layer: "napari.layer.Vectors | None" = self.cb_layer.value
+        if layer is None:
+            return
+        vecs, layer_meta = utils.full_layer(layer.data, {"features": layer.features, "metadata": layer.metadata})
+        features = layer_meta["features"]
+        distances = utils.nearest_neighbor_distances(vecs, tree=spatial_index(layer))
+        set_full_features(layer, features.assign(nearestNeighborDistance=distances))
+        self.on_layer_changed()
+
+
+def layer_particles(vecs: np.ndarray, features: pd.DataFrame, metadata: dict) -> pd.DataFrame:
+    """Returns the features of a layer with coordinates and angles matching its current vectors."""
+    has_positions = all(col in features.columns for col in utils.COORDINATE_COLUMNS) or all(
+        col in features.columns for col in utils.CENTERED_COORDINATE_COLUMNS
+    )
+    quats = metadata.get(utils.ORIENTATIONS_METADATA_KEY)
+    if has_positions and quats is not None and len(quats) == len(vecs):
+        return utils.update_particles(vecs, features, quats, metadata.get("optics"), metadata.get("tomograms"))
+    if has_positions and all(col in features.columns for col in utils.ANGLE_COLUMNS):
+        return features
+    return features.assign(**utils.vecs2particles(vecs))
+
+
+class SymmetryWidget(Container):
+    """Symmetry expansion of a vectors layer into a new layer, optionally recentered on a point of the reference."""
+
+    def __init__(self, viewer: "napari.viewer.Viewer"):
+        super().__init__()
+        self._viewer = viewer
+        self.cb_layer = create_widget(label="Layer", annotation="napari.layers.Vectors")
+        self.le_symmetry = LineEdit(label="Symmetry", value="C1", tooltip="C<n>, D<n>, T, O or I")
+        self.sb_offsets = [
+            FloatSpinBox(label=f"Offset {xyz} (Å)", value=0.0, min=-1e5, max=1e5) for xyz in "XYZ"
+        ]
+        self.b_expand = PushButton(text="Expand")
+        # Signals
+        self.b_expand.clicked.connect(self.on_expand_clicked)
+        # Build
+        self.extend([self.cb_layer, self.le_symmetry, *self.sb_offsets, self.b_expand])
+
+    def on_expand_clicked(self):
+        """Adds a new layer with one copy of every particle per symmetry operator."""
+        layer: "napari.layer.Vectors | None" = self.cb_layer.value
+        if layer is None:
+            return
+        symmetry = self.le_symmetry.value.strip().upper()
+        vecs, layer_meta = utils.full_layer(layer.data, {"features": layer.features, "metadata": layer.metadata})
+        features = layer_meta["features"]
+        metadata = {key: layer.metadata[key] for key in SLICED_METADATA_KEYS if key in layer.metadata}
+        particles = layer_particles(vecs, features, metadata)
+        offset = np.array([spin_box.value for spin_box in self.sb_offsets])
+        new_vecs, new_particles, rows = utils.symmetry_expand(
+            particles, metadata.get("optics"), symmetry, offset, tomograms=metadata.get("tomograms")
+        )
+        metadata = utils.slice_metadata(metadata, rows)
+        metadata[utils.ORIENTATIONS_METADATA_KEY] = utils.euler2quat(new_particles)
+        self._viewer.add_vectors(
+            new_vecs,
+            name=f"{layer.name} {symmetry}",
+            edge_color="blue",
+            features=new_particles,
+            metadata=metadata,
+        )
+
+
+def _camera(viewer: "napari.viewer.Viewer"):
+    # viewer.camera moved to viewer.scene.camera in napari 0.9
+    return viewer.scene.camera if hasattr(viewer, "scene") else viewer.camera
+
+
+def _visible_box(viewer: "napari.viewer.Viewer", layer: "napari.layers.Vectors") -> tuple[np.ndarray | None, np.ndarray | None]:
+    """Returns the box of the layer's data coordinates shown by a 2D view, or None if the whole layer may be visible."""
+    camera = _camera(viewer)
+    canvas_size = getattr(getattr(viewer, "canvas", None), "size", None) or getattr(viewer, "_canvas_size", None)
+    if viewer.dims.ndisplay != 2 or canvas_size is None or camera.zoom <= 0:
+        return None, None
+    low = np.full(layer.ndim, -np.inf)
+    high = np.full(layer.ndim, np.inf)
+    displayed = list(viewer.dims.displayed)[-2:]
+    center = np.asarray(camera.center)[-2:]
+    half_extent = np.asarray(canvas_size, dtype=float) / camera.zoom / 2
+    # Map the corners of the view through the layer's scale, translation and affine transform
+    corners = []
+    for signs in ((-1, -1), (-1, 1), (1, -1), (1, 1)):
+        point = np.array(viewer.dims.point, dtype=float)
+        point[displayed] = center + np.array(signs) * half_extent
+        corners.append(layer.world_to_data(point))
+    corners = np.asarray(corners)
+    # World dimensions in front of the layer's dimensions are not part of its data
+    offset = viewer.dims.ndim - layer.ndim
+    data_displayed = [dim - offset for dim in displayed if dim >= offset]
+    low[data_displayed] = corners[:, data_displayed].min(axis=0)
+    high[data_displayed] = corners[:, data_displayed].max(axis=0)
+    return low, high
+
+
+class LevelOfDetailWidget(Container):
+    """Shows only a spatially stratified subsample of a large vectors layer, sized to the current view.
+    The full vectors and features are kept in the layer metadata, where the writers and the other
+    widgets pick them up. Moved or rotated vectors of the displayed subsample are written back to the
+    full data before the subsample changes. Vectors added or removed while it is on are not kept."""
+
+    # Delay after the last camera change before the subsample is updated
+    debounce_ms = 100
+
+    def __init__(self, viewer: "napari.viewer.Viewer"):
+        super().__init__()
+        self._viewer = viewer
+        self._layer: "napari.layers.Vectors | None" = None
+        self.cb_layer = create_widget(label="Layer", annotation="napari.layers.Vectors")
+        self.sb_max_vectors = SpinBox(label="Max. vectors", value=100_000, min=1, max=10**8, step=10_000)
+        self.b_toggle = PushButton(text="Enable level of detail")
+        self._debounce_timer = QTimer()
+        self._debounce_timer.setSingleShot(True)
+        self._debounce_timer.setInterval(self.debounce_ms)
+        self._debounce_timer.timeout.connect(self.refresh)
+        # Signals
+        self.b_toggle.clicked.connect(self.on_toggle_clicked)
+        self.sb_max_vectors.changed.connect(self.on_view_changed)
+        # Build
+        self.extend([
+            self.cb_layer,
+            self.sb_max_vectors,
+            self.b_toggle,
+        ])
+
+    def on_toggle_clicked(self):
+        if self._layer is None:
+            self.enable(self.cb_layer.value)
+        else:
+            self.disable()
+
+    def enable(self, layer: "napari.layers.Vectors | None"):
+        if layer is None or utils.LOD_METADATA_KEY in layer.metadata:
+            return
+        layer.metadata[utils.LOD_METADATA_KEY] = {
+            "data": layer.data,
+            "features": layer.features,
+            "grid": utils.SpatialGrid(layer.data[:, 0]),
+            "indices": None,
+        }
+        self._layer = layer
+        _camera(self._viewer).events.zoom.connect(self.on_view_changed)
+        _camera(self._viewer).events.center.connect(self.on_view_changed)
+        self._viewer.dims.events.ndisplay.connect(self.on_view_changed)
+        self._viewer.layers.events.removed.connect(self.on_layer_removed)
+        self.b_toggle.text = "Disable level of detail"
+        self.refresh()
+
+    def disable(self):
+        layer = self._layer
+        if layer is None:
+            return
+        _camera(self._viewer).events.zoom.disconnect(self.on_view_changed)
+        _camera(self._viewer).events.center.disconnect(self.on_view_changed)
+        self._viewer.dims.events.ndisplay.disconnect(self.on_view_changed)
+        self._viewer.layers.events.removed.disconnect(self.on_layer_removed)
+        self._debounce_timer.stop()
+        data, _ = utils.full_layer(layer.data, {"metadata": layer.metadata})
+        lod = layer.metadata.pop(utils.LOD_METADATA_KEY)
+        layer.data = data
+        layer.features = lod["features"]
+        self._layer = None
+        self.b_toggle.text = "Enable level of detail"
+
+    def on_layer_removed(self, event):
+        if event.value is self._layer:
+            self.disable()
+
+    def on_view_changed(self):
+        if self._layer is not None:
+            self._debounce_timer.start()
+
+    def refresh(self):
+        """Shows the subsample for the current view, if it differs from the one shown."""
+        layer = self._layer
+        if layer is None:
+            return
+        lod = layer.metadata[utils.LOD_METADATA_KEY]
+        low, high = _visible_box(self._viewer, layer)
+        indices = lod["grid"].sample(self.sb_max_vectors.value, low, high)
+        if lod["indices"] is not None and np.array_equal(indices, lod["indices"]):
+            return
+        # Keep the edits of the subsample that is about to be replaced
+        lod["data"], _ = utils.full_layer(layer.data, {"metadata": layer.metadata})
+        lod["indices"] = indices
+        layer.data = lod["data"][indices]
+        layer.features = lod["features"].iloc[indices].reset_index(drop=True)
+
+
+class WatchWidget(Container):
+    """Opens a STAR file that is still being written and appends new particles to its layer as they arrive."""
+
+    def __init__(self, viewer: "napari.viewer.Viewer"):
+        super().__init__()
+        self._viewer = viewer
+        self._tail: StarTail | None = None
+        self._data: GrowingLayerData | None = None
+        self._layer: "napari.layers.Vectors | None" = None
+        self._worker = None
+        self.fe_path = FileEdit(label="File", filter="*.star")
+        self.sb_interval = FloatSpinBox(label="Interval (s)", value=2.0, min=0.1, max=3600.0)
+        self.b_toggle = PushButton(text="Start watching")
+        self._timer = QTimer()
+        self._timer.timeout.connect(self.poll)
+        # Signals
+        self.b_toggle.clicked.connect(self.on_toggle_clicked)
+        self.sb_interval.changed.connect(self.on_interval_changed)
+        # Build
+        self.extend([
+            self.fe_path,
+            self.sb_interval,
+            self.b_toggle,
+        ])
+
+    def on_toggle_clicked(self):
+        if self._tail is None:
+            self.start(self.fe_path.value)
+        else:
+            self.stop()
+
+    def on_interval_changed(self):
+        self._timer.setInterval(int(self.sb_interval.value * 1000))
+
+    def start(self, path):
+        tomograms_file = find_tomograms_file(path)
+        self._tail = StarTail(path, tomograms=None if tomograms_file is None else read_tomograms(tomograms_file))
+        self._layer = None
+        self.poll()
+        self._timer.start(int(self.sb_interval.value * 1000))
+        self.b_toggle.text = "Stop watching"
+
+    def stop(self):
+        self._timer.stop()
+        self._tail = None
+        self._data = None
+        self.b_toggle.text = "Start watching"
+
+    def poll(self):
+        """Reads the particles written since the last poll in a background thread, unless a read is still running."""
+        if self._tail is None or self._worker is not None:
+            return
+        from napari.qt.threading import create_worker
+
+        self._worker = create_worker(self._tail.poll)
+        self._worker.returned.connect(partial(self._apply_update, self._tail))
+        self._worker.finished.connect(self._on_poll_finished)
+        self._worker.start()
+
+    def _on_poll_finished(self):
+        self._worker = None
+
+    def _apply_update(self, tail: StarTail, update: TailUpdate | None):
+        """Adds the particles read by :meth:`poll` to the layer, or reloads it if the file was rewritten."""
+        if tail is not self._tail or update is None:
+            # Nothing changed, or watching was stopped while reading
+            return
+        new_layer = self._layer is None or self._layer not in self._viewer.layers
+        if update.reloaded or self._data is None:
+            self._data = GrowingLayerData(update.vecs, update.particles, update.quats)
+        else:
+            self._data.append(update.vecs, update.particles, update.quats)
+        if new_layer:
+            extra_kwargs = {"name": self._tail.path.stem, "edge_color": "blue", "features": self._data.features}
+            self._layer = self._viewer.add_vectors(self._data.vecs, **extra_kwargs)
+        else:
+            # napari has no public way to append, so it copies all vectors and features on every
+            # update that reads new particles; only reading and buffering them is O(new rows)
+            self._layer.data = self._data.vecs
+            self._layer.features = self._data.features
+        if update.optics is not None:
+            self._layer.metadata["optics"] = update.optics
+        if tail.tomograms is not None:
+            self._layer.metadata["tomograms"] = tail.tomograms
+        if self._data.quats is not None:
+            self._layer.metadata[utils.ORIENTATIONS_METADATA_KEY] = self._data.quats
+        else:
+            self._layer.metadata.pop(utils.ORIENTATIONS_METADATA_KEY, None)
+
 
 class SubsetSelectorWidget(Container):
     def __init__(self, viewer: "napari.viewer.Viewer"):
@@ -143,6 +682,8 @@ class SubsetSelectorWidget(Container):
         self.b_add_filter.clicked.connect(self.on_b_add_filter_clicked)
         self.b_pop_filter.clicked.connect(self.on_b_pop_filter_clicked)
         self.filter_widgets: List[FilterWidget] = []
+        self._excluded_count: Optional[np.ndarray] = None
+        self._shown: Optional[np.ndarray] = None
 
         # append into/extend the container with your widgets
         self.extend(
@@ -156,15 +697,31 @@ class SubsetSelectorWidget(Container):
         self.native_parent_changed.connect(self.on_cb_points_layer_changed)
 
     def update_mask(self):
+        """Recomputes the combined mask of all filters."""
         points_layer = self.cb_points_layer.value
         if points_layer is None:
             return
-        mask = np.ones(len(points_layer.data), dtype=bool)
+        # Number of filters that exclude each point; a point is shown if no filter excludes it
+        self._excluded_count = np.zeros(len(points_layer.data), dtype=np.int32)
         for widget in self.filter_widgets:
             widget_mask = widget.get_mask()
             if widget_mask is not None:
-                mask &= widget_mask
-        points_layer.shown = mask
+                self._excluded_count += ~widget_mask
+        self._shown = self._excluded_count == 0
+        points_layer.shown = self._shown
+
+    def on_filter_mask_changed(self, widget: FilterWidget, changed: np.ndarray):
+        """Updates the combined mask for the rows of one filter that changed."""
+        points_layer = self.cb_points_layer.value
+        if points_layer is None:
+            return
+        if self._excluded_count is None or len(self._excluded_count) != len(points_layer.data):
+            self.update_mask()
+            return
+        included = widget.get_mask()[changed]
+        self._excluded_count[changed] += np.where(included, -1, 1).astype(np.int32)
+        self._shown[changed] = self._excluded_count[changed] == 0
+        points_layer.shown = self._shown
 
     def on_b_add_filter_clicked(self):
         widget = FilterWidget(self)
@@ -172,6 +729,7 @@ class SubsetSelectorWidget(Container):
         self.filter_widgets.append(widget)
         self.extend([widget])
         self.b_pop_filter.enabled = True
+        self.update_mask()
 
     def on_b_pop_filter_clicked(self):
         if len(self.filter_widgets) == 0:
@@ -180,12 +738,14 @@ class SubsetSelectorWidget(Container):
         widget.points_layer = None
         self.remove(widget)
         self.b_pop_filter.enabled = len(self.filter_widgets) > 0
+        self.update_mask()
 
 
     def on_cb_points_layer_changed(self):
         layer = self.cb_points_layer.value
         for widget in self.filter_widgets:
             widget.points_layer = layer
+        self.update_mask()
 
     def on_cb_filter_property_changed(self):
         points_layer = self.cb_points_layer.value
@@ -1,85 +1,218 @@
-"""
-This module is an example of a barebones writer plugin for napari.
+"""Writers of vectors layers into STAR files, registered in the plugin manifest.
 
-It implements the Writer specification.
-see: https://napari.org/stable/plugins/building_a_plugin/guides.html#writers
+Each writer turns the layers into particle tables with :func:`layer2particles` (or
+:func:`layer2particles_relion5`), using :func:`napari_starfile.utils.full_layer` so that layers shown at
+a lower level of detail are written in full. Rows that were not moved or rotated keep the values they
+were read with. Feature columns that the out-of-core reader left on disk are streamed into the file.
+The optics tables of all layers are merged, renumbering groups that clash, and a summary of the write
+is logged. rlnMicrographName is set to the layer name unless ``keep_micrograph_names`` is given, which
+the Relion 5 writer does by default.
 
-Replace code below according to your needs.
+- :func:`write_star_relion3`: one particles loop with the optics columns joined into it
+- :func:`write_star_relion31`: optics and particles blocks
+- :func:`write_star_relion5`: general, optics and particles blocks with centered coordinates in Angstrom
+- :func:`write_starz`: the binary format of :mod:`napari_starfile._starz`
 """
 
 from collections.abc import Sequence
+import logging
 from pathlib import Path
 from typing import TYPE_CHECKING, Any
 import warnings
 
 import numpy as np
 import pandas as pd
-import starfile
 
 from napari_starfile import utils
+from napari_starfile._lazy import LazyFeatures
+from napari_starfile._profiling import stage
+from napari_starfile._star_writer import write_star
 
 if TYPE_CHECKING:
     DataType = Any | Sequence[Any]
     FullLayerData = tuple[DataType, dict, str]
 
+logger = logging.getLogger(__name__)
+
 
-def layer2particles(layer_data: "DataType", layer_meta: dict, layer_type: str) -> pd.DataFrame:
+def layer2particles(layer_data: "DataType", layer_meta: dict, layer_type: str, keep_micrograph_names: bool = False) -> pd.DataFrame:
+    """Returns the particles table of a layer. rlnMicrographName is set to the layer name,
+    unless ``keep_micrograph_names`` is set and the particles already have one."""
     if layer_type != "vectors":
         raise ValueError(f"Unsupported layer type: {layer_type}")
     particles = layer_meta["features"]
     if not isinstance(particles, pd.DataFrame):
         raise ValueError("Layer features must be a DataFrame")
+    metadata = layer_meta.get("metadata", {})
+    quats = metadata.get(utils.ORIENTATIONS_METADATA_KEY)
+    if quats is not None and len(quats) != len(layer_data):
+        quats = None
     # Check if the layer has a particles table already
-    if not all(col in particles.columns for col in [f"rlnCoordinate{zyx}" for zyx in "ZYX"] + [f"rlnAngle{angle}" for angle in ["Rot", "Tilt", "Psi"]]):
+    if not all(col in particles.columns for col in utils.COORDINATE_COLUMNS) or (
+        quats is None and not all(col in particles.columns for col in utils.ANGLE_COLUMNS)
+    ):
         particles = utils.vecs2particles(layer_data)
-    particles["rlnMicrographName"] = layer_meta["name"].replace(" ", "_")
+    elif quats is not None:
+        # Only rows moved or rotated in the viewer are recomputed
+        particles = utils.update_particles(layer_data, particles, quats, metadata.get("optics"), metadata.get("tomograms"))
+    if not keep_micrograph_names or "rlnMicrographName" not in particles.columns:
+        particles = particles.assign(rlnMicrographName=layer_meta["name"].replace(" ", "_"))
     return particles
 
-def write_star_relion3(path: str, data: list["FullLayerData"]) -> list[str]:
+
+def with_lazy_columns(particles: pd.DataFrame, layer_meta: dict) -> "pd.DataFrame | LazyFeatures":
+    """Adds the feature columns the out-of-core reader left on disk, to be streamed into the file."""
+    store = layer_meta.get("metadata", {}).get(utils.LAZY_COLUMNS_METADATA_KEY)
+    if store is None or len(store) != len(particles):
+        return particles
+    return LazyFeatures(particles, store)
+
+
+def write_star_relion3(path: str, data: list["FullLayerData"], keep_micrograph_names: bool = False) -> list[str]:
     if not path.endswith(".star"):
         path += ".star"
-    all_particles: list[pd.DataFrame] = []
-    for layer_data, layer_meta, layer_type in data:
-        particles = layer2particles(layer_data, layer_meta, layer_type)
-        if "optics" in layer_meta["metadata"]:
-            try:
-                particles = pd.merge(
-                    particles,
-                    layer_meta["metadata"]["optics"],
-                    how="left",
-                    left_on="rlnOpticsGroup",
-                    right_on="rlnOpticsGroup",
-                    validate="many_to_one",
-                )
-            except pd.errors.MergeError as err:
-                raise ValueError(
-                    "Error: could not merge particles and optics"
-                ) from err
-        all_particles.append(particles)
-    particles = pd.concat(all_particles, ignore_index=True, join="inner")
-    starfile.write(particles, Path(path), overwrite=True)
+    with stage("write_star_relion3"):
+        all_particles: list[pd.DataFrame] = []
+        all_meta: list[dict] = []
+        for layer_data, layer_meta, layer_type in data:
+            layer_data, layer_meta = utils.full_layer(layer_data, layer_meta)
+            with stage("layer2particles", rows=len(layer_data)):
+                all_particles.append(layer2particles(layer_data, layer_meta, layer_type, keep_micrograph_names))
+            all_meta.append(layer_meta)
+        all_particles, merged = merge_optics(path, all_particles, all_meta)
+        for i, (particles, layer_meta) in enumerate(zip(all_particles, all_meta, strict=True)):
+            if "optics" in layer_meta["metadata"]:
+                # Each layer keeps all columns of its own optics table, with the renumbered groups
+                optics = layer_meta["metadata"]["optics"].assign(rlnOpticsGroup=merged.group_maps[i][1])
+                with stage("join_optics", rows=len(particles)):
+                    particles = utils.join_optics(particles, optics)
+            all_particles[i] = with_lazy_columns(particles, layer_meta)
+        write_star(path, {"": all_particles})
     return [path]
 
 
-def write_star_relion31(path: str, data: list["FullLayerData"]) -> list[str]:
+def merge_optics(path: str, all_particles: list[pd.DataFrame], all_meta: list[dict]) -> tuple[list[pd.DataFrame], utils.MergedOptics]:
+    """Merges the optics tables of the layers with :func:`napari_starfile.utils.merge_optics_tables` and
+    renumbers the optics groups of the particles to match. The result is logged as the summary of the write."""
+    with stage("merge_optics"):
+        merged = utils.merge_optics_tables([layer_meta["metadata"].get("optics") for layer_meta in all_meta])
+        all_particles = [merged.remap(i, particles) for i, particles in enumerate(all_particles)]
+    if merged.n_renumbered:
+        warnings.warn(
+            f"Layers define the same optics group differently, renumbered {merged.n_renumbered} optics groups",
+            stacklevel=3,
+        )
+    logger.info("%s: %d particles from %d layers, %s", path, sum(map(len, all_particles)), len(all_particles), merged)
+    return all_particles, merged
+
+
+def write_star_relion31(path: str, data: list["FullLayerData"], keep_micrograph_names: bool = False) -> list[str]:
     if not path.endswith(".star"):
         path += ".star"
-    all_particles: list[pd.DataFrame] = []
-    all_optics: list[pd.DataFrame] | pd.DataFrame = []
-    for layer_data, layer_meta, layer_type in data:
-        particles = layer2particles(layer_data, layer_meta, layer_type)
-        if "optics" in layer_meta["metadata"]:
-            all_optics.append(layer_meta["metadata"]["optics"])
-        all_particles.append(particles)
-    star_data = {"particles": pd.concat(all_particles, ignore_index=True, join="inner")}
-    if len(all_optics) > 1:
-        warnings.warn("Joining optics tables from different layers. Make sure they are all the same!", stacklevel=2)
-    if len(all_optics) > 0:
-        star_data["optics"] = pd.concat(all_optics, join="inner").drop_duplicates().reset_index(drop=True)
-    starfile.write(star_data, Path(path), overwrite=True)
+    with stage("write_star_relion31"):
+        all_particles: list[pd.DataFrame] = []
+        all_meta: list[dict] = []
+        for layer_data, layer_meta, layer_type in data:
+            layer_data, layer_meta = utils.full_layer(layer_data, layer_meta)
+            with stage("layer2particles", rows=len(layer_data)):
+                all_particles.append(layer2particles(layer_data, layer_meta, layer_type, keep_micrograph_names))
+            all_meta.append(layer_meta)
+        all_particles, merged = merge_optics(path, all_particles, all_meta)
+        optics = merged.optics
+        star_data = {"particles": [with_lazy_columns(p, m) for p, m in zip(all_particles, all_meta, strict=True)]}
+        if optics is not None:
+            star_data["optics"] = optics
+        write_star(path, star_data)
     return [path]
 
-def write_star_relion5(path: str, data: list["FullLayerData"]) -> list[str]:
+
+def layer2particles_relion5(
+    layer_data: "DataType",
+    layer_meta: dict,
+    layer_type: str,
+    keep_micrograph_names: bool = True,
+    tomograms: pd.DataFrame | None = None,
+) -> pd.DataFrame:
+    """Returns the particles of a layer with Relion 5 rlnCenteredCoordinateX/Y/ZAngst coordinates.
+    Coordinates in pixels are centered on the tomogram given by rlnTomoSizeX/Y/Z columns, or by
+    ``tomograms`` or else the ``tomograms`` table in the layer metadata, and scaled by the tilt-series
+    pixel size. Raises a ValueError if the tomogram sizes are unknown.
+    Particles without rlnTomoName get the layer name."""
+    particles = layer_meta["features"]
+    if not isinstance(particles, pd.DataFrame):
+        raise ValueError("Layer features must be a DataFrame")
+    if tomograms is None:
+        tomograms = layer_meta["metadata"].get("tomograms")
+    quats = layer_meta["metadata"].get(utils.ORIENTATIONS_METADATA_KEY)
+    if quats is not None and len(quats) == len(layer_data) and all(col in particles.columns for col in utils.CENTERED_COORDINATE_COLUMNS):
+        particles = utils.update_particles(layer_data, particles, quats, layer_meta["metadata"].get("optics"), tomograms)
+    if not all(col in particles.columns for col in utils.CENTERED_COORDINATE_COLUMNS + utils.ANGLE_COLUMNS):
+        particles = layer2particles(layer_data, layer_meta, layer_type, keep_micrograph_names)
+        if "rlnTomoName" not in particles.columns:
+            # Needed to look up the tomogram
+            particles = particles.assign(rlnTomoName=layer_meta["name"].replace(" ", "_"))
+        centered = utils.coords2centered(particles, layer_meta["metadata"].get("optics"), tomograms)
+        # Replace the pixel coordinates in place to keep the column order
+        particles = particles.rename(columns=dict(zip(utils.COORDINATE_COLUMNS, utils.CENTERED_COORDINATE_COLUMNS, strict=True)))
+        particles = particles.assign(**dict(zip(utils.CENTERED_COORDINATE_COLUMNS, centered.T, strict=True)))
+    if "rlnTomoName" not in particles.columns:
+        particles = particles.assign(rlnTomoName=layer_meta["name"].replace(" ", "_"))
+    return particles
+
+
+def write_star_relion5(
+    path: str,
+    data: list["FullLayerData"],
+    keep_micrograph_names: bool = True,
+    tomograms: "str | Path | pd.DataFrame | None" = None,
+) -> list[str]:
+    """Writes all layers into one Relion 5 particles file with general, optics and particles blocks.
+    Particles are centered on their tomograms from ``tomograms``, a tomograms.star or its global table,
+    or the ``tomograms`` table in the layer metadata (see :func:`layer2particles_relion5`).
+    The general block is the one read with the first layer that has one, and says that the
+    subtomograms are 2D stacks otherwise. Each layer's particles are streamed to the file
+    without concatenating the layers."""
     if not path.endswith(".star"):
         path += ".star"
-    raise NotImplementedError("write_star_relion5 is not implemented yet")
+    if isinstance(tomograms, (str, Path)):
+        from napari_starfile._reader import read_tomograms
+
+        tomograms = read_tomograms(tomograms)
+    with stage("write_star_relion5"):
+        all_particles: list[pd.DataFrame] = []
+        all_meta: list[dict] = []
+        for layer_data, layer_meta, layer_type in data:
+            layer_data, layer_meta = utils.full_layer(layer_data, layer_meta)
+            with stage("layer2particles", rows=len(layer_data)):
+                all_particles.append(layer2particles_relion5(layer_data, layer_meta, layer_type, keep_micrograph_names, tomograms))
+            all_meta.append(layer_meta)
+        all_particles, merged = merge_optics(path, all_particles, all_meta)
+        optics = merged.optics
+        general = next((m["metadata"]["general"] for m in all_meta if "general" in m["metadata"]), {})
+        star_data = {"general": {"rlnTomoSubTomosAre2DStacks": 1, **general}}
+        if optics is not None:
+            star_data["optics"] = optics
+        star_data["particles"] = [with_lazy_columns(p, m) for p, m in zip(all_particles, all_meta, strict=True)]
+        write_star(path, star_data)
+    return [path]
+
+
+def write_starz(path: str, data: list["FullLayerData"], keep_micrograph_names: bool = False) -> list[str]:
+    """Writes all layers into one binary ``.starz`` file (see :mod:`napari_starfile._starz`) with the
+    particles and optics a Relion 3.1 starfile of the layers would have, and their vectors."""
+    from napari_starfile._starz import write_starz_tables
+
+    if not path.endswith(".starz"):
+        path += ".starz"
+    with stage("write_starz"):
+        all_particles: list[pd.DataFrame] = []
+        all_meta: list[dict] = []
+        for layer_data, layer_meta, layer_type in data:
+            layer_data, layer_meta = utils.full_layer(layer_data, layer_meta)
+            with stage("layer2particles", rows=len(layer_data)):
+                all_particles.append(layer2particles(layer_data, layer_meta, layer_type, keep_micrograph_names))
+            all_meta.append(layer_meta)
+        all_particles, merged = merge_optics(path, all_particles, all_meta)
+        optics = merged.optics
+        write_starz_tables(path, [with_lazy_columns(p, m) for p, m in zip(all_particles, all_meta, strict=True)], optics)
+    return [path]
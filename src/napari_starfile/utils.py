@@ -1,51 +1,509 @@
 import warnings
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
 import pandas as pd
 import numpy as np
-from scipy.spatial.transform import Rotation
 from warnings import warn
 
-def particles2vecs(particles: pd.DataFrame, optics: pd.DataFrame | None) -> np.ndarray:
+from napari_starfile._profiling import stage
+
+# scipy takes about as long to import as pandas, so it is only imported by the functions that use it
+if TYPE_CHECKING:
+    from scipy.spatial import cKDTree
+    from scipy.spatial.transform import Rotation
+
+PIXEL_SIZE_COLUMNS = ["rlnPixelSize", "rlnDetectorPixelSize", "rlnImagePixelSize"]
+COORDINATE_COLUMNS = [f"rlnCoordinate{xyz}" for xyz in "XYZ"]
+CENTERED_COORDINATE_COLUMNS = [f"rlnCenteredCoordinate{xyz}Angst" for xyz in "XYZ"]
+TOMO_SIZE_COLUMNS = [f"rlnTomoSize{xyz}" for xyz in "XYZ"]
+# Pixel size of the coordinates and tomogram sizes in Relion 4 and 5 tomography, where rlnImagePixelSize
+# is the one of the binned subtomograms
+TILT_SERIES_PIXEL_SIZE_COLUMN = "rlnTomoTiltSeriesPixelSize"
+ANGLE_COLUMNS = ["rlnAngleRot", "rlnAngleTilt", "rlnAnglePsi"]
+# Layer metadata key under which the level-of-detail mode keeps all vectors and features
+LOD_METADATA_KEY = "level_of_detail"
+# Layer metadata key of the particle orientations as read, as float32 quaternions
+ORIENTATIONS_METADATA_KEY = "orientations"
+# Layer metadata key of the feature columns kept on disk by the out-of-core reader
+LAZY_COLUMNS_METADATA_KEY = "lazy_columns"
+# Decimals numeric optics values are rounded to when deciding whether two optics groups are the same
+OPTICS_HASH_DECIMALS = 6
+
+def particles2vecs(particles: pd.DataFrame, optics: pd.DataFrame | None, tomograms: pd.DataFrame | None = None) -> np.ndarray:
     """Converts a particles DataFrame to an (N, 2, 3) array of coords and vectors.
-    Vectors are unit vectors in the direction of the Z axis after rotation, axis order is ZYX."""
-    if not all(col in particles.columns for col in [f"rlnCoordinate{zyx}" for zyx in "ZYX"]):
-        raise ValueError("Particles DataFrame must contain rlnCoordinateX/Y/Z columns")
-    has_eulers = all(col in particles.columns for col in [f"rlnAngle{angle}" for angle in ["Rot", "Tilt", "Psi"]])
+    Vectors are unit vectors in the direction of the Z axis after rotation, axis order is ZYX.
+    Relion 5 centered coordinates need the tomogram sizes, see :func:`tomogram_sizes`."""
+    with stage("particles2vecs", rows=len(particles)):
+        return _particles2vecs(particles, optics, tomograms)
+
+
+def _particles2vecs(particles: pd.DataFrame, optics: pd.DataFrame | None, tomograms: pd.DataFrame | None = None) -> np.ndarray:
+    coords = particle_positions(particles, optics, tomograms)
+    has_eulers = all(col in particles.columns for col in ANGLE_COLUMNS)
     if not has_eulers:
         warn("Particles DataFrame does not contain rlnAngleRot/Tilt/Psi columns")
-    if optics is not None:
-        particles = pd.merge(
-            particles,
-            optics,
-            how="left",
-            left_on="rlnOpticsGroup",
-            right_on="rlnOpticsGroup",
-            validate="many_to_one",
+    vecs = np.empty((len(coords), 2, 3), dtype=float)
+    vecs[:, 0] = coords
+    if has_eulers:
+        with stage("euler2vec", rows=len(particles)):
+            vecs[:, 1, :] = euler2vec(particles)
+    else:
+        vecs[:, 1, :] = [1, 0, 0]
+    return vecs
+
+def particle_positions(particles: pd.DataFrame, optics: pd.DataFrame | None, tomograms: pd.DataFrame | None = None) -> np.ndarray:
+    """Returns the positions of the particles in pixels as an (N, 3) ZYX array, with origin shifts applied."""
+    if all(col in particles.columns for col in COORDINATE_COLUMNS):
+        coords = (
+            particles[[f"rlnCoordinate{zyx}" for zyx in "ZYX"]]
+            .to_numpy()
+            .astype(float)
         )
-    coords = (
-        particles[[f"rlnCoordinate{zyx}" for zyx in "ZYX"]]
-        .to_numpy()
-        .astype(float)
-    )
+    elif all(col in particles.columns for col in CENTERED_COORDINATE_COLUMNS):
+        coords = centered2coords(particles, optics, tomograms)[:, ::-1]
+    else:
+        raise ValueError("Particles DataFrame must contain rlnCoordinateX/Y/Z or rlnCenteredCoordinateX/Y/ZAngst columns")
     shift_columns = [f"rlnOrigin{zyx}Angst" for zyx in "ZYX"]
     if all(col in particles.columns for col in shift_columns):
         shifts = particles[shift_columns].to_numpy().astype(float)
-        if "rlnPixelSize" in particles.columns:
-            shifts /= particles["rlnPixelSize"].to_numpy().astype(float)[:, None]
-        elif "rlnDetectorPixelSize" in particles.columns:
-            shifts /= particles["rlnDetectorPixelSize"].to_numpy().astype(float)[:, None]
-        elif "rlnImagePixelSize" in particles.columns:
-            shifts /= particles["rlnImagePixelSize"].to_numpy().astype(float)[:, None]
+        with stage("optics_lookup", rows=len(particles)):
+            pixel_size = coordinate_pixel_size(particles, optics, tomograms)
+        if pixel_size is not None:
+            shifts /= pixel_size[:, None]
         else:
             warnings.warn("No pixel size found in particles or optics, shifts will be ignored")
             shifts = np.zeros_like(shifts)
         coords -= shifts
-    vecs = np.empty((len(coords), 2, 3), dtype=float)
-    vecs[:, 0] = coords
-    if has_eulers:
-        vecs[:, 1, :] = euler2vec(particles)
-    else:
-        vecs[:, 1, :] = [1, 0, 0]
-    return vecs
+    return coords
+
+def compact_features(features: pd.DataFrame, max_category_fraction: float = 0.5) -> tuple[pd.DataFrame, int]:
+    """Returns a copy of ``features`` with a smaller memory footprint and the number of bytes saved.
+    String columns with at most ``max_category_fraction`` unique values per row become categoricals,
+    integer columns are downcast to the smallest integer type holding their range and float columns
+    become float32 where that does not change any value."""
+    compact = {}
+    for name in features.columns:
+        values = features[name]
+        if values.dtype.kind == "f":
+            as_float32 = values.to_numpy().astype(np.float32)
+            if np.array_equal(as_float32.astype(values.dtype), values.to_numpy(), equal_nan=True):
+                values = pd.Series(as_float32, index=values.index, name=name)
+        elif values.dtype.kind in "iu":
+            values = pd.to_numeric(values, downcast="integer" if values.dtype.kind == "i" else "unsigned")
+        elif not isinstance(values.dtype, pd.CategoricalDtype) and len(values) > 0:
+            if values.nunique(dropna=False) <= max_category_fraction * len(values):
+                values = values.astype("category")
+        compact[name] = values
+    compact = pd.DataFrame(compact, index=features.index)
+    saved = int(features.memory_usage(deep=True).sum() - compact.memory_usage(deep=True).sum())
+    return compact, saved
+
+def optics_lookup(particles: pd.DataFrame, optics: pd.DataFrame) -> np.ndarray:
+    """Returns for each particle the row of its rlnOpticsGroup in ``optics``, or -1 if the group is missing.
+    Only the small optics table is indexed, the particles table is not copied."""
+    if "rlnOpticsGroup" not in particles.columns:
+        raise ValueError("Particles DataFrame must contain a rlnOpticsGroup column to join optics")
+    groups = pd.Index(optics["rlnOpticsGroup"])
+    if not groups.is_unique:
+        raise ValueError("Optics groups are not unique")
+    return groups.get_indexer(particles["rlnOpticsGroup"].to_numpy())
+
+def optics_column(
+    particles: pd.DataFrame,
+    optics: pd.DataFrame | None,
+    column: str,
+    optics_index: np.ndarray | None = None,
+) -> np.ndarray | None:
+    """Returns the per-particle values of ``column``, taken from the particles table if it has it
+    and looked up in the optics table otherwise. Returns None if neither has the column."""
+    if column in particles.columns:
+        return particles[column].to_numpy()
+    if optics is None or column not in optics.columns:
+        return None
+    if optics_index is None:
+        optics_index = optics_lookup(particles, optics)
+    return pd.api.extensions.take(optics[column].to_numpy(), optics_index, allow_fill=True)
+
+def join_optics(particles: pd.DataFrame, optics: pd.DataFrame) -> pd.DataFrame:
+    """Returns the particles with the columns of their optics group appended.
+    Equivalent to a left, many-to-one merge on rlnOpticsGroup, but done as a single indexed lookup.
+    Optics columns that the particles table already has are left untouched."""
+    optics_index = optics_lookup(particles, optics)
+    columns = [col for col in optics.columns if col not in particles.columns]
+    return particles.assign(
+        **{
+            col: pd.api.extensions.take(optics[col].array, optics_index, allow_fill=True)
+            for col in columns
+        }
+    )
+
+@dataclass
+class MergedOptics:
+    """Result of :func:`merge_optics_tables`. ``group_maps`` holds for every input table the old and new
+    rlnOpticsGroup numbers of its groups, or None for layers without optics."""
+    optics: pd.DataFrame | None
+    group_maps: list[tuple[np.ndarray, np.ndarray] | None]
+    n_tables: int = 0
+    n_distinct: int = 0
+    n_renumbered: int = 0
+
+    def remap(self, i: int, particles: pd.DataFrame) -> pd.DataFrame:
+        """Returns the particles of input table ``i`` with the rlnOpticsGroup numbers of the merged table,
+        with one vectorized lookup. Particles of groups missing from the table keep their number."""
+        group_map = self.group_maps[i]
+        if group_map is None or "rlnOpticsGroup" not in particles.columns:
+            return particles
+        old, new = group_map
+        if np.array_equal(old, new):
+            return particles
+        groups = particles["rlnOpticsGroup"].to_numpy()
+        index = pd.Index(old).get_indexer(groups)
+        return particles.assign(rlnOpticsGroup=np.where(index >= 0, new[index], groups))
+
+    def __str__(self) -> str:
+        n_groups = 0 if self.optics is None else len(self.optics)
+        return (
+            f"{n_groups} optics groups from {self.n_tables} optics tables "
+            f"({self.n_distinct} distinct), {self.n_renumbered} renumbered"
+        )
+
+def _hash_rows(table: pd.DataFrame) -> np.ndarray:
+    """Hashes the rows of a table by value: numeric columns are compared as float64 rounded to
+    ``OPTICS_HASH_DECIMALS``, so e.g. an int and a float column with the same numbers hash alike."""
+    numeric = [col for col in table.columns if table[col].dtype.kind in "biuf"]
+    if numeric:
+        table = table.assign(**{col: table[col].to_numpy(dtype=np.float64, na_value=np.nan).round(OPTICS_HASH_DECIMALS) for col in numeric})
+    return pd.util.hash_pandas_object(table, index=False).to_numpy()
+
+def _table_fingerprint(table: pd.DataFrame) -> tuple:
+    return tuple(table.columns), _hash_rows(table).tobytes()
+
+def merge_optics_tables(all_optics: list[pd.DataFrame | None]) -> MergedOptics:
+    """Merges the optics tables of several layers into one table in a single pass.
+    Tables are fingerprinted by their content, so a table shared by many layers is only merged once.
+    Identical groups are kept once. A group whose rlnOpticsGroup number is already taken by a different
+    definition gets the next free number; :meth:`MergedOptics.remap` applies the new numbers to the particles.
+    Only the columns that all tables have are kept, like ``pd.concat(join="inner")``."""
+    distinct: list[pd.DataFrame] = []
+    fingerprints: dict[tuple, int] = {}
+    # Layers usually share the same DataFrame object, which is only hashed once
+    by_id: dict[int, int] = {}
+    table_indices: list[int | None] = []
+    for optics in all_optics:
+        if optics is None:
+            table_indices.append(None)
+            continue
+        if "rlnOpticsGroup" not in optics.columns:
+            raise ValueError("Optics tables must contain a rlnOpticsGroup column")
+        if id(optics) not in by_id:
+            by_id[id(optics)] = fingerprints.setdefault(_table_fingerprint(optics), len(distinct))
+            if by_id[id(optics)] == len(distinct):
+                distinct.append(optics)
+        table_indices.append(by_id[id(optics)])
+    n_tables = len(all_optics) - table_indices.count(None)
+    if not distinct:
+        return MergedOptics(None, [None] * len(all_optics))
+    columns = [col for col in distinct[0].columns if all(col in table.columns for table in distinct[1:])]
+    content_columns = [col for col in columns if col != "rlnOpticsGroup"]
+    next_group = max((int(table["rlnOpticsGroup"].max()) for table in distinct if len(table)), default=0) + 1
+    used: set[int] = set()
+    assigned: dict[tuple[int, int], int] = {}
+    pieces = []
+    table_maps = []
+    n_renumbered = 0
+    for table in distinct:
+        old = table["rlnOpticsGroup"].to_numpy()
+        if content_columns:
+            content = _hash_rows(table[content_columns])
+        else:
+            content = np.zeros(len(table), dtype=np.uint64)
+        new = old.copy()
+        added = []
+        for row, key in enumerate(zip(old.tolist(), content.tolist(), strict=True)):
+            if key not in assigned:
+                group = key[0]
+                if group in used:
+                    group = next_group
+                    next_group += 1
+                    n_renumbered += 1
+                used.add(group)
+                assigned[key] = group
+                added.append(row)
+            new[row] = assigned[key]
+        pieces.append(table.iloc[added][columns].assign(rlnOpticsGroup=new[added]))
+        table_maps.append((old, new))
+    return MergedOptics(
+        pd.concat(pieces, ignore_index=True),
+        [None if i is None else table_maps[i] for i in table_indices],
+        n_tables,
+        len(distinct),
+        n_renumbered,
+    )
+
+def particle_pixel_size(particles: pd.DataFrame, optics: pd.DataFrame | None) -> np.ndarray | None:
+    """Returns the per-particle pixel size from the first of ``PIXEL_SIZE_COLUMNS`` found in particles or optics."""
+    for pixel_size_column in PIXEL_SIZE_COLUMNS:
+        pixel_size = optics_column(particles, optics, pixel_size_column)
+        if pixel_size is not None:
+            return pixel_size.astype(float)
+    return None
+
+def coordinate_pixel_size(
+    particles: pd.DataFrame, optics: pd.DataFrame | None, tomograms: pd.DataFrame | None = None
+) -> np.ndarray | None:
+    """Returns the per-particle pixel size of the coordinates in pixels: rlnTomoTiltSeriesPixelSize from the
+    particles or optics, as in Relion 4 and 5, or otherwise :func:`particle_pixel_size`. Relion 5 centered
+    coordinates are converted to pixels of the tilt series given in ``tomograms`` if need be."""
+    pixel_size = optics_column(particles, optics, TILT_SERIES_PIXEL_SIZE_COLUMN)
+    if pixel_size is None and not all(col in particles.columns for col in COORDINATE_COLUMNS):
+        pixel_size = _tomogram_column(particles, tomograms, TILT_SERIES_PIXEL_SIZE_COLUMN)
+    if pixel_size is not None:
+        return pixel_size.astype(float)
+    return particle_pixel_size(particles, optics)
+
+def _tomogram_column(particles: pd.DataFrame, tomograms: pd.DataFrame | None, column: str) -> np.ndarray | None:
+    """Returns the per-particle values of a column of the tomograms table, or None if it is not there."""
+    if tomograms is None or column not in tomograms.columns:
+        return None
+    index = _tomogram_index(particles, tomograms)
+    return None if index is None else tomograms[column].to_numpy()[index]
+
+def _tomogram_index(particles: pd.DataFrame, tomograms: pd.DataFrame) -> np.ndarray | None:
+    """Returns the row of ``tomograms`` of every particle, matched by rlnTomoName."""
+    if "rlnTomoName" not in particles.columns or "rlnTomoName" not in tomograms.columns:
+        return None
+    names = pd.Index(tomograms["rlnTomoName"])
+    if not names.is_unique:
+        raise ValueError("Tomogram names are not unique")
+    index = names.get_indexer(particles["rlnTomoName"].to_numpy())
+    if (index < 0).any():
+        missing = pd.unique(particles["rlnTomoName"].to_numpy()[index < 0])
+        raise ValueError(f"Particles refer to tomograms missing from the tomograms table: {', '.join(map(str, missing[:5]))}")
+    return index
+
+def tomogram_sizes(particles: pd.DataFrame, tomograms: pd.DataFrame | None = None) -> np.ndarray | None:
+    """Returns the per-particle tomogram size in pixels as an (N, 3) XYZ array, or None if it is unknown.
+    Sizes are taken from rlnTomoSizeX/Y/Z columns of the particles, or looked up by rlnTomoName in ``tomograms``,
+    e.g. the global table of a Relion 5 tomograms.star."""
+    if all(col in particles.columns for col in TOMO_SIZE_COLUMNS):
+        return particles[TOMO_SIZE_COLUMNS].to_numpy().astype(float)
+    if tomograms is None or not all(col in tomograms.columns for col in TOMO_SIZE_COLUMNS):
+        return None
+    index = _tomogram_index(particles, tomograms)
+    if index is None:
+        return None
+    return tomograms[TOMO_SIZE_COLUMNS].to_numpy().astype(float)[index]
+
+def _tomogram_centers(particles: pd.DataFrame, optics: pd.DataFrame | None, tomograms: pd.DataFrame | None) -> np.ndarray:
+    """Returns the centers of the tomograms of the particles in Angstrom. Tomogram sizes are in pixels of the
+    tilt series, whose size is taken from the tomograms table, the particles or optics, or the coordinates."""
+    sizes = tomogram_sizes(particles, tomograms)
+    if sizes is None:
+        raise ValueError(
+            "Tomogram sizes unknown, centered coordinates need rlnTomoSizeX/Y/Z columns or a tomograms.star "
+            "with the particles' rlnTomoName"
+        )
+    pixel_size = _tomogram_column(particles, tomograms, TILT_SERIES_PIXEL_SIZE_COLUMN)
+    if pixel_size is None:
+        pixel_size = optics_column(particles, optics, TILT_SERIES_PIXEL_SIZE_COLUMN)
+    if pixel_size is None:
+        pixel_size = _required_coordinate_pixel_size(particles, optics, tomograms)
+    return sizes / 2 * pixel_size.astype(float)[:, None]
+
+def _required_coordinate_pixel_size(
+    particles: pd.DataFrame, optics: pd.DataFrame | None, tomograms: pd.DataFrame | None = None
+) -> np.ndarray:
+    pixel_size = coordinate_pixel_size(particles, optics, tomograms)
+    if pixel_size is None:
+        raise ValueError("No pixel size found in particles or optics")
+    return pixel_size
+
+def coords2centered(
+    particles: pd.DataFrame,
+    optics: pd.DataFrame | None,
+    tomograms: pd.DataFrame | None = None,
+) -> np.ndarray:
+    """Converts rlnCoordinateX/Y/Z in pixels to Relion 5 centered coordinates in Angstrom, as an (N, 3) XYZ array.
+    Raises a ValueError if the tomogram sizes are unknown."""
+    coords = particles[COORDINATE_COLUMNS].to_numpy().astype(float)
+    centers = _tomogram_centers(particles, optics, tomograms)
+    return coords * _required_coordinate_pixel_size(particles, optics, tomograms)[:, None] - centers
+
+def centered2coords(
+    particles: pd.DataFrame,
+    optics: pd.DataFrame | None,
+    tomograms: pd.DataFrame | None = None,
+) -> np.ndarray:
+    """Converts Relion 5 rlnCenteredCoordinateX/Y/ZAngst to coordinates in pixels, as an (N, 3) XYZ array.
+    Raises a ValueError if the tomogram sizes are unknown."""
+    centered = particles[CENTERED_COORDINATE_COLUMNS].to_numpy().astype(float)
+    centers = _tomogram_centers(particles, optics, tomograms)
+    return (centered + centers) / _required_coordinate_pixel_size(particles, optics, tomograms)[:, None]
+
+def group_indices(values: np.ndarray | pd.Series) -> list[tuple[object, np.ndarray | slice]]:
+    """Groups rows by value in a single pass, like ``DataFrame.groupby`` (sorted, missing values dropped).
+    Returns ``(value, rows)`` pairs, where ``rows`` is a slice if the group's rows are contiguous."""
+    codes, uniques = pd.factorize(values, sort=True)
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    # Missing values have code -1 and are sorted first
+    bounds = np.concatenate([[0], np.cumsum(counts)]) + np.count_nonzero(codes < 0)
+    groups = []
+    for value, start, stop in zip(uniques, bounds[:-1], bounds[1:], strict=True):
+        rows = order[start:stop]
+        if rows[-1] - rows[0] + 1 == len(rows):
+            rows = slice(int(rows[0]), int(rows[-1]) + 1)
+        groups.append((value, rows))
+    return groups
+
+def slice_metadata(metadata: dict, rows: np.ndarray | slice) -> dict:
+    """Returns layer metadata for a subset of the rows, with the per-row orientations and lazy columns sliced accordingly."""
+    per_row = [key for key in (ORIENTATIONS_METADATA_KEY, LAZY_COLUMNS_METADATA_KEY) if key in metadata]
+    if not per_row:
+        return metadata
+    return {**metadata, **{key: metadata[key][rows] for key in per_row}}
+
+def split_layer(vecs: np.ndarray, features: pd.DataFrame, column: str, metadata: dict | None = None):
+    """Yields one vectors layer data tuple per value of ``column``.
+    The vectors and features of each group are sliced from the existing arrays, which avoids copies
+    for groups of contiguous rows."""
+    for value, rows in group_indices(features[column]):
+        if isinstance(rows, slice):
+            group_features = features.iloc[rows]
+        else:
+            group_features = features.take(rows)
+        extra_kwargs = {"name": str(value), "edge_color": "blue", "features": group_features}
+        if metadata:
+            extra_kwargs["metadata"] = slice_metadata(metadata, rows)
+        yield (vecs[rows], extra_kwargs, "vectors")
+
+def build_kdtree(vecs: np.ndarray) -> "cKDTree":
+    """Builds a KD-tree over the coordinates of an (N, 2, 3) vectors array."""
+    from scipy.spatial import cKDTree
+
+    return cKDTree(np.asarray(vecs)[:, 0])
+
+def remove_duplicates(vecs: np.ndarray, scores: np.ndarray, distance: float, tree: "cKDTree | None" = None) -> np.ndarray:
+    """Returns a mask of the particles to keep so that no two kept particles are within ``distance``.
+    Among close particles the one with the highest score is kept, like greedy non-maximum suppression
+    in order of decreasing score (ties are broken by row order). Instead of visiting particles one by one,
+    all particles that score best among their undecided neighbors are kept at once, which gives the same result."""
+    if tree is None:
+        tree = build_kdtree(vecs)
+    n = len(scores)
+    # Rank 0 is the best particle
+    rank = np.empty(n, dtype=np.int64)
+    rank[np.lexsort((np.arange(n), -np.asarray(scores, dtype=float)))] = np.arange(n)
+    pairs = tree.query_pairs(distance, output_type="ndarray")
+    a = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    b = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    undecided = np.ones(n, dtype=bool)
+    keep = np.zeros(n, dtype=bool)
+    while undecided.any():
+        beaten = np.zeros(n, dtype=bool)
+        beaten[a[rank[b] < rank[a]]] = True
+        kept = undecided & ~beaten
+        keep |= kept
+        undecided &= ~kept
+        undecided[b[kept[a]]] = False
+        # Only pairs between undecided particles matter from now on
+        active = undecided[a] & undecided[b]
+        a, b = a[active], b[active]
+    return keep
+
+def neighbor_counts(vecs: np.ndarray, radius: float, tree: "cKDTree | None" = None) -> np.ndarray:
+    """Returns for each particle the number of other particles within ``radius``."""
+    if tree is None:
+        tree = build_kdtree(vecs)
+    # Querying in the tree's own point order keeps consecutive queries in the same part of the tree
+    counts = np.empty(tree.n, dtype=np.int64)
+    counts[tree.indices] = tree.query_ball_point(tree.data[tree.indices], radius, return_length=True, workers=-1) - 1
+    return counts
+
+def nearest_neighbor_distances(vecs: np.ndarray, tree: "cKDTree | None" = None) -> np.ndarray:
+    """Returns for each particle the distance to its nearest other particle (inf if there is none)."""
+    if tree is None:
+        tree = build_kdtree(vecs)
+    distances = np.empty(tree.n, dtype=float)
+    distances[tree.indices] = tree.query(tree.data[tree.indices], k=2, workers=-1)[0][:, 1]
+    return distances
+
+
+class SpatialGrid:
+    """Regular grid over particle coordinates for drawing spatially stratified subsamples.
+    Particles are sorted by cell and in random order within each cell, so a subsample is the first few
+    particles of every cell in view. Raising the per-cell quota only adds particles (the sample is refined),
+    and selecting a sample only touches the cells in view, not all particles."""
+
+    def __init__(self, coords: np.ndarray, cells_per_axis: int = 64, seed: int = 0):
+        coords = np.asarray(coords, dtype=float)
+        self.ndim = coords.shape[1]
+        self.low = np.nanmin(coords, axis=0) if len(coords) else np.zeros(self.ndim)
+        high = np.nanmax(coords, axis=0) if len(coords) else np.ones(self.ndim)
+        self.shape = np.full(self.ndim, cells_per_axis)
+        self.cell_size = np.maximum(high - self.low, 1e-9) / cells_per_axis
+        cells = self._cell_coords(coords)
+        cell_ids = np.ravel_multi_index(tuple(cells.T), self.shape)
+        random_keys = np.random.default_rng(seed).random(len(coords))
+        self.order = np.lexsort((random_keys, cell_ids))
+        self.cell_starts = np.searchsorted(cell_ids[self.order], np.arange(np.prod(self.shape) + 1))
+
+    def _cell_coords(self, coords: np.ndarray) -> np.ndarray:
+        # Clip before casting, boxes may extend to infinity
+        cells = np.floor((np.nan_to_num(coords) - self.low) / self.cell_size)
+        return np.clip(cells, 0, self.shape - 1).astype(np.int64)
+
+    def cells_in_box(self, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+        """Returns the ids of the cells overlapping the box from ``low`` to ``high``."""
+        first = self._cell_coords(np.asarray(low, dtype=float)[None])[0]
+        last = self._cell_coords(np.asarray(high, dtype=float)[None])[0]
+        ranges = np.meshgrid(*[np.arange(a, b + 1) for a, b in zip(first, last, strict=True)], indexing="ij")
+        return np.ravel_multi_index(tuple(r.ravel() for r in ranges), self.shape)
+
+    def sample(self, budget: int, low: np.ndarray | None = None, high: np.ndarray | None = None) -> np.ndarray:
+        """Returns sorted indices of at most ``budget`` particles, spread evenly over the cells in the box."""
+        if low is None or high is None:
+            cells = np.arange(np.prod(self.shape))
+        else:
+            cells = self.cells_in_box(low, high)
+        starts = self.cell_starts[cells]
+        counts = self.cell_starts[cells + 1] - starts
+        # Largest per-cell quota that fits into the budget
+        quota = int(np.max(counts, initial=0))
+        if counts.sum() > budget:
+            lo, hi = 0, quota
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if np.minimum(counts, mid).sum() <= budget:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            quota = lo
+        lengths = np.minimum(counts, quota)
+        # Spend what is left of the budget on one more particle from evenly spaced cells
+        eligible = np.flatnonzero(counts > quota)
+        remaining = min(budget - int(lengths.sum()), len(eligible))
+        if remaining > 0:
+            lengths[eligible[np.linspace(0, len(eligible) - 1, remaining).astype(np.int64)]] += 1
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return np.sort(self.order[offsets])
+
+def full_layer(layer_data: np.ndarray, layer_meta: dict) -> tuple[np.ndarray, dict]:
+    """Returns the data and metadata of a layer with all vectors and features,
+    including the ones hidden by the level-of-detail mode, with the edits made to the shown subsample."""
+    lod = layer_meta.get("metadata", {}).get(LOD_METADATA_KEY)
+    if lod is None:
+        return layer_data, layer_meta
+    data = lod["data"]
+    indices = lod["indices"]
+    if indices is not None and len(layer_data) != len(indices):
+        warn("Vectors were added to or removed from a layer in level-of-detail mode, these changes are not kept", stacklevel=2)
+    elif indices is not None and not np.array_equal(layer_data, data[indices]):
+        # Vectors of the subsample were moved or rotated since it was shown
+        data = data.copy()
+        data[indices] = layer_data
+    return data, {**layer_meta, "features": lod["features"]}
+
 
 def vecs2particles(vecs: np.ndarray) -> pd.DataFrame:
     eulers = vec2euler(vecs[:, 1])
@@ -90,9 +548,134 @@ def euler2matrix(angles: np.ndarray, homogenous: bool) -> np.ndarray:
     out[:, 0, 0] = cos_angles[:, 1]
     return out
 
+def matrix2euler(matrices: np.ndarray) -> np.ndarray:
+    """
+    Inverse of :func:`euler2matrix` for (N, 3, 3) or homogenous (N, 4, 4) rotation matrices in ZYX order.
+    Returns [rot, tilt, psi] in radians, evaluated for all matrices at once.
+    Follows https://github.com/3dem/relion/blob/d476e6f6a4f1f37627c06ace5227fc374c0c2b05/src/euler.cpp#L116
+    """
+    # Relion's A(i, j) in XYZ order
+    a = np.asarray(matrices)[:, 2::-1, 2::-1]
+    abs_sb = np.sqrt(a[:, 0, 2] ** 2 + a[:, 1, 2] ** 2)
+    general = abs_sb > 16 * np.finfo(np.float32).eps
+    gamma = np.arctan2(a[:, 1, 2], -a[:, 0, 2])
+    alpha = np.arctan2(a[:, 2, 1], a[:, 2, 0])
+    sin_gamma = np.sin(gamma)
+    sign = lambda x: np.where(x >= 0, 1.0, -1.0)  # noqa: E731
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sign_sb = np.where(
+            np.abs(sin_gamma) < np.finfo(np.float32).eps,
+            sign(-a[:, 0, 2] / np.cos(gamma)),
+            np.where(sin_gamma > 0, sign(a[:, 1, 2]), -sign(a[:, 1, 2])),
+        )
+    beta = np.arctan2(sign_sb * abs_sb, a[:, 2, 2])
+    # Tilt of 0 or 180 degrees: only rot + psi is defined, which is put into psi
+    up = a[:, 2, 2] >= 0
+    angles = np.empty((len(a), 3), dtype=float)
+    angles[:, 0] = np.where(general, alpha, 0.0)
+    angles[:, 1] = np.where(general, beta, np.where(up, 0.0, np.pi))
+    angles[:, 2] = np.where(general, gamma, np.where(up, np.arctan2(-a[:, 1, 0], a[:, 0, 0]), np.arctan2(a[:, 1, 0], -a[:, 0, 0])))
+    return angles
+
+def _axis_rotations(folds: np.ndarray, axes: np.ndarray) -> np.ndarray:
+    """Rotation matrices by 360 / fold degrees around the given XYZ axes (Rodrigues' formula)."""
+    axes = axes / np.linalg.norm(axes, axis=1)[:, None]
+    angle = 2 * np.pi / folds
+    cross = np.zeros((len(axes), 3, 3))
+    cross[:, 0, 1], cross[:, 0, 2], cross[:, 1, 2] = -axes[:, 2], axes[:, 1], -axes[:, 0]
+    cross -= cross.transpose(0, 2, 1)
+    outer = axes[:, :, None] * axes[:, None, :]
+    return (
+        np.cos(angle)[:, None, None] * np.eye(3)
+        + np.sin(angle)[:, None, None] * cross
+        + (1 - np.cos(angle))[:, None, None] * outer
+    )
+
+# Generators of the point groups as (fold, XYZ axis), as defined in Relion's symmetries.cpp
+# (I is Relion's default icosahedral setting I2)
+POINT_GROUP_GENERATORS = {
+    "T": [(3, (0, 0, 1)), (2, (0, np.sqrt(2 / 3), np.sqrt(1 / 3)))],
+    "O": [(3, (1, 1, 1)), (4, (0, 0, 1))],
+    "I": [(2, (0, 0, 1)), (5, (0.525731112119, 0, 0.850650808354)), (3, (0, 0.356822089773, 0.934172358963))],
+}
+
+def symmetry_matrices(symmetry: str) -> np.ndarray:
+    """Returns the rotation matrices of point group ``symmetry`` (C<n>, D<n>, T, O or I, as in Relion)
+    as a (K, 3, 3) array in ZYX order like :func:`euler2matrix`, starting with the identity."""
+    symmetry = symmetry.strip().upper()
+    if symmetry[:1] in ("C", "D") and symmetry[1:].isdigit() and int(symmetry[1:]) > 0:
+        generators = [(int(symmetry[1:]), (0, 0, 1))]
+        if symmetry[0] == "D":
+            generators.append((2, (1, 0, 0)))
+    elif symmetry in POINT_GROUP_GENERATORS:
+        generators = POINT_GROUP_GENERATORS[symmetry]
+    else:
+        raise ValueError(f"Unknown symmetry {symmetry}, expected C<n>, D<n>, T, O or I")
+    folds, axes = zip(*generators, strict=True)
+    group = np.concatenate([np.eye(3)[None], _axis_rotations(np.array(folds, dtype=float), np.array(axes, dtype=float))])
+    # Close the group under multiplication: all products of the elements found so far, until no new ones appear.
+    # First occurrences are kept in order, so the identity stays first
+    while True:
+        products = np.einsum("aij,bjk->abik", group, group).reshape((-1, 3, 3))
+        _, first = np.unique(np.round(products, 6).reshape((-1, 9)) + 0.0, axis=0, return_index=True)
+        closed = products[np.sort(first)]
+        if len(closed) == len(group):
+            return closed[:, ::-1, ::-1].copy()
+        group = closed
+
+def symmetry_expand(
+    particles: pd.DataFrame,
+    optics: pd.DataFrame | None,
+    symmetry: str,
+    offset: np.ndarray | None = None,
+    tomograms: pd.DataFrame | None = None,
+) -> tuple[np.ndarray, pd.DataFrame, np.ndarray]:
+    """Expands every particle into one copy per operator R of point group ``symmetry``, like
+    relion_particle_symmetry_expand: the copies have the orientation matrix A R instead of A.
+    With ``offset``, a point in the reference frame (XYZ in Angstrom), each copy is moved onto that point,
+    e.g. to recenter on a sub-region. Copies of a particle are consecutive and the first one has the identity
+    operator; the operator index is stored in the ``symmetryOperator`` column.
+
+    All copies are computed at once, as (N, K) products of the homogenous particle matrices with the
+    homogenous matrices of the operators followed by the offset.
+    Returns the vectors, the particles and the row each copy was made from."""
+    missing = [col for col in ANGLE_COLUMNS if col not in particles.columns]
+    if missing:
+        raise ValueError(f"Particles DataFrame does not contain {', '.join(missing)}")
+    operators = symmetry_matrices(symmetry)
+    offset = np.zeros(3) if offset is None else np.asarray(offset, dtype=float)[::-1]
+    n_operators = len(operators)
+    transforms = np.zeros((n_operators, 4, 4))
+    transforms[:, :3, :3] = operators
+    transforms[:, :3, 3] = operators @ offset
+    transforms[:, 3, 3] = 1
+    poses = euler2matrix(np.radians(particles[ANGLE_COLUMNS].to_numpy(dtype=float)), homogenous=True)
+    # optimize lets einsum hand the products to BLAS as one (4N, 4) x (4, 4K) matrix product
+    expanded = np.einsum("nij,kjl->nkil", poses, transforms, optimize=True).reshape((-1, 4, 4))
+    rows = np.repeat(np.arange(len(particles)), n_operators)
+    vecs = np.empty((len(expanded), 2, 3), dtype=float)
+    vecs[:, 0] = particle_positions(particles, optics, tomograms)[rows]
+    # The Z axis of the reference frame, like euler2vec
+    vecs[:, 1] = expanded[:, :3, 0]
+    new_particles = particles.take(rows).reset_index(drop=True)
+    new_particles[ANGLE_COLUMNS] = np.degrees(matrix2euler(expanded))
+    new_particles["symmetryOperator"] = np.tile(np.arange(n_operators), len(particles))
+    if offset.any():
+        shifts = expanded[:, :3, 3]
+        pixel_size = _required_coordinate_pixel_size(particles, optics, tomograms)[rows]
+        vecs[:, 0] += shifts / pixel_size[:, None]
+        if all(col in particles.columns for col in COORDINATE_COLUMNS):
+            moved = new_particles[COORDINATE_COLUMNS].to_numpy(dtype=float) + shifts[:, ::-1] / pixel_size[:, None]
+            new_particles[COORDINATE_COLUMNS] = moved
+        else:
+            new_particles[CENTERED_COORDINATE_COLUMNS] = new_particles[CENTERED_COORDINATE_COLUMNS].to_numpy(dtype=float) + shifts[:, ::-1]
+    return vecs, new_particles, rows
+
 def euler2vec(euler: np.ndarray | pd.DataFrame) -> np.ndarray:
     """Turns a set of euler angles ((N, 3) array in rot, tilt, psi order or dataframe with rlnAngleRot/Tilt/Psi columns)
     into a unit vector in the direction of the Z axis after rotation."""
+    from scipy.spatial.transform import Rotation
+
     if isinstance(euler, pd.DataFrame):
         euler = euler[["rlnAngleRot", "rlnAngleTilt", "rlnAnglePsi"]].to_numpy()
     rotations = Rotation.from_euler(
@@ -103,10 +686,119 @@ def euler2vec(euler: np.ndarray | pd.DataFrame) -> np.ndarray:
     return rotations.apply([0, 0, 1])[:, ::-1]
 
 def vec2euler(vecs: np.ndarray) -> np.ndarray:
-    """Turns a (N, 3) array of unit vectors into an array of euler angles in rot, tilt, psi order.
-    Angles are in degrees."""
-    eulers = np.empty_like(vecs, dtype=float)
-    for i, vec in enumerate(vecs):
-        rot, _ = Rotation.align_vectors(vec[::-1], [[0, 0, 1]])
-        eulers[i] = rot.inv().as_euler("ZYZ", degrees=True)
+    """Turns a (N, 3) array of unit vectors (ZYX order) into an array of euler angles in rot, tilt, psi order.
+    Angles are in degrees.
+
+    Closed-form equivalent of taking the shortest-arc rotation from the Z axis to each vector
+    (``Rotation.align_vectors``) and converting its inverse to ZYZ euler angles, evaluated for all vectors at once.
+    Vectors do not need to be normalized. Vectors along the Z axis and zero-length vectors map to rot = psi = 0."""
+    vecs = np.asarray(vecs, dtype=float).reshape((-1, 3))
+    z, y, x = vecs[:, 0], vecs[:, 1], vecs[:, 2]
+    norm = np.sqrt(x * x + y * y + z * z)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cos_tilt = np.clip(z / norm, -1.0, 1.0)
+    cos_tilt[norm == 0] = 1.0
+    eulers = np.empty((len(vecs), 3), dtype=float)
+    eulers[:, 1] = np.degrees(np.arccos(cos_tilt))
+    # The shortest-arc rotation towards azimuth phi has inverse eulers (phi + 180, tilt, -phi - 180)
+    psi = (-np.degrees(np.arctan2(y, x))) % 360 - 180
+    # At the north pole (and for zero-length vectors) the rotation is the identity
+    psi[cos_tilt == 1.0] = 0.0
+    psi[np.isnan(cos_tilt)] = np.nan
+    eulers[:, 0] = 0.0 - psi
+    eulers[:, 2] = psi
     return eulers
+
+def euler2quat(euler: np.ndarray | pd.DataFrame) -> np.ndarray:
+    """Turns euler angles (like :func:`euler2vec`) into an (N, 4) float32 array of scalar-last quaternions."""
+    from scipy.spatial.transform import Rotation
+
+    if isinstance(euler, pd.DataFrame):
+        euler = euler[ANGLE_COLUMNS].to_numpy()
+    return Rotation.from_euler("ZYZ", euler, degrees=True).as_quat().astype(np.float32)
+
+def quat2euler(quats: np.ndarray) -> np.ndarray:
+    """Inverse of :func:`euler2quat`, returns rot, tilt, psi in degrees."""
+    from scipy.spatial.transform import Rotation
+
+    return Rotation.from_quat(quats.astype(float)).as_euler("ZYZ", degrees=True)
+
+def quat2vec(quats: np.ndarray) -> np.ndarray:
+    """Direction vectors (ZYX) of quaternions from :func:`euler2quat`, like :func:`euler2vec`."""
+    from scipy.spatial.transform import Rotation
+
+    return Rotation.from_quat(quats.astype(float)).inv().apply([0, 0, 1])[:, ::-1]
+
+def _shortest_arc(a: np.ndarray, b: np.ndarray) -> "Rotation":
+    """Rotations turning each unit vector in ``a`` into the corresponding one in ``b`` by the smallest angle."""
+    from scipy.spatial.transform import Rotation
+
+    cross = np.cross(a, b)
+    sin = np.linalg.norm(cross, axis=1)
+    angle = np.arctan2(sin, np.einsum("ij,ij->i", a, b))
+    axis = np.zeros_like(a)
+    np.divide(cross, sin[:, None], out=axis, where=sin[:, None] > 1e-12)
+    # Opposite vectors: turn by 180 degrees around any perpendicular axis
+    opposite = (sin <= 1e-12) & (angle > np.pi / 2)
+    if opposite.any():
+        helper = np.where(np.abs(a[opposite, :1]) < 0.9, [[1.0, 0, 0]], [[0, 1.0, 0]])
+        perpendicular = np.cross(a[opposite], helper)
+        axis[opposite] = perpendicular / np.linalg.norm(perpendicular, axis=1)[:, None]
+    return Rotation.from_rotvec(axis * angle[:, None])
+
+def changed_rows(
+    vecs: np.ndarray,
+    particles: pd.DataFrame,
+    quats: np.ndarray,
+    optics: pd.DataFrame | None,
+    tomograms: pd.DataFrame | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Compares the vectors of a layer with the particles and orientations they were read from.
+    Returns boolean masks of the moved rows and of the rotated rows."""
+    moved = ~np.isclose(vecs[:, 0], particle_positions(particles, optics, tomograms), rtol=1e-9, atol=1e-6).all(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        directions = vecs[:, 1] / np.linalg.norm(vecs[:, 1], axis=1)[:, None]
+    # Quaternions are float32, so directions only match to about 1e-7
+    rotated = ~(np.einsum("ij,ij->i", directions, quat2vec(quats)) >= 1 - 1e-6)
+    return moved, rotated
+
+def update_particles(
+    vecs: np.ndarray,
+    particles: pd.DataFrame,
+    quats: np.ndarray,
+    optics: pd.DataFrame | None,
+    tomograms: pd.DataFrame | None = None,
+) -> pd.DataFrame:
+    """Returns the particles with coordinates and angles recomputed for the rows whose vectors changed
+    since they were read. Rotated rows keep their in-plane angle relative to the new direction;
+    all other rows are written as read. Missing angle columns are filled from ``quats``."""
+    from scipy.spatial.transform import Rotation
+
+    if not all(col in particles.columns for col in ANGLE_COLUMNS):
+        particles = particles.assign(**dict(zip(ANGLE_COLUMNS, quat2euler(quats).T, strict=True)))
+    moved, rotated = changed_rows(vecs, particles, quats, optics, tomograms)
+    if not moved.any() and not rotated.any():
+        return particles
+    particles = particles.copy()
+    if rotated.any():
+        rows = np.flatnonzero(rotated)
+        old = Rotation.from_quat(quats[rows].astype(float))
+        old_directions = old.inv().apply([0, 0, 1])
+        new_directions = vecs[rows, 1, ::-1] / np.linalg.norm(vecs[rows, 1], axis=1)[:, None]
+        new = (_shortest_arc(old_directions, new_directions) * old.inv()).inv()
+        for col, values in zip(ANGLE_COLUMNS, new.as_euler("ZYZ", degrees=True).T, strict=True):
+            particles[col] = particles[col].astype(float)
+            particles.iloc[rows, particles.columns.get_loc(col)] = values
+    if moved.any():
+        rows = np.flatnonzero(moved)
+        # Shift the stored coordinates by the move, so that origin shifts are kept
+        delta = (vecs[rows, 0] - particle_positions(particles.iloc[rows], optics, tomograms))[:, ::-1]
+        if all(col in particles.columns for col in COORDINATE_COLUMNS):
+            columns = COORDINATE_COLUMNS
+        else:
+            columns = CENTERED_COORDINATE_COLUMNS
+            delta = delta * _required_coordinate_pixel_size(particles.iloc[rows], optics, tomograms)[:, None]
+        for col, values in zip(columns, delta.T, strict=True):
+            particles[col] = particles[col].astype(float)
+            particles.iloc[rows, particles.columns.get_loc(col)] += values
+    return particles